@@ -0,0 +1,96 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from dsa.parsing.line_parsing import line_parser
+from dsa.parsing.token_parsing import make_parser, single_parser
+from dsa.ui.dsa import dsa
+from contextlib import redirect_stdout
+from pathlib import Path
+from shutil import copytree
+from tempfile import TemporaryDirectory
+from timeit import timeit
+import io, os
+
+
+"""Micro-benchmarks for token and line parsers.
+
+Times building parsers (as filter parameter parsers and the structgroup
+loader do, once per chunk or definition line), calling them, and
+assembling a large generated listing of the example structgroup used by
+the tests. With the package installed (or the repository root on
+PYTHONPATH), run:
+
+    python benchmarks/parsers.py
+"""
+
+
+_LIB = Path(__file__).absolute().parent.parent / 'tests' / 'lib'
+
+
+def _build_make_parser():
+    return make_parser(
+        'benchmark', ('integer', 'size'), ({'a', 'b'}, 'kind'),
+        ('[string', 'extra')
+    )
+
+
+def _build_line_parser():
+    return line_parser(
+        'benchmark', single_parser('name', 'string'),
+        single_parser('size', 'integer?'), required=1, more=True
+    )
+
+
+def _write_listing(name, chunks, structs):
+    with open(name, 'w') as f:
+        for chunk in range(chunks):
+            f.write(f'!@c{chunk} 0x{chunk * structs * 8:X} example\n')
+            for i in range(structs):
+                f.write(f'DATA {i} {i} {i} {i}\n')
+            f.write('!\n')
+
+
+def _report(description, seconds):
+    print(f'{description:<32}{seconds:.2f}s')
+
+
+def main(count=200000, chunks=4000):
+    construction = count // 20
+    _report(
+        f'make_parser build x{construction}',
+        timeit(_build_make_parser, number=construction)
+    )
+    _report(
+        f'line_parser build x{construction}',
+        timeit(_build_line_parser, number=construction)
+    )
+    token = _build_make_parser()
+    _report(
+        f'make_parser x{count}',
+        timeit(lambda: token(['0x10', 'a', 'x', 'y']), number=count)
+    )
+    line = _build_line_parser()
+    _report(
+        f'line_parser x{count}',
+        timeit(lambda: line([['DATA'], ['16'], ['x']]), number=count)
+    )
+    with TemporaryDirectory() as folder:
+        old = Path.cwd()
+        os.chdir(folder)
+        try:
+            copytree(_LIB, 'lib')
+            with open('test.bin', 'wb') as f:
+                f.write(bytes(chunks * 16 * 8))
+            _write_listing('listing.txt', chunks, 16)
+            with redirect_stdout(io.StringIO()):
+                seconds = timeit(lambda: dsa(
+                    'test.bin', ['listing.txt'], 'output.bin',
+                    target='dsd', libraries=('sys',), paths=('lib',)
+                ), number=1)
+            _report(f'assemble {chunks * 16} lines', seconds)
+        finally:
+            os.chdir(old)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from importlib.abc import Loader
+from io import TextIOWrapper
+import os, zipfile
+
+
+"""Support for libraries packed into a single zip archive."""
+
+
+def is_archive(path):
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+class LibraryArchive:
+    """A zip archive containing a library. The archive is opened once (per
+    process) and shared by every file read from it."""
+    def __init__(self, path):
+        self._path = path
+        self._zip = None
+
+
+    @property
+    def path(self):
+        return self._path
+
+
+    @property
+    def mtime(self):
+        return os.stat(self._path).st_mtime_ns
+
+
+    @property
+    def _archive(self):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self._path)
+        return self._zip
+
+
+    def __getstate__(self):
+        # The open file can't be shared with other processes; they will
+        # open the archive for themselves when needed.
+        return self._path
+
+
+    def __setstate__(self, state):
+        self._path, self._zip = state, None
+
+
+    def names(self):
+        return [
+            info.filename for info in self._archive.infolist()
+            if not info.is_dir()
+        ]
+
+
+    def info(self, name):
+        return self._archive.getinfo(name)
+
+
+    def open(self, name):
+        return self._archive.open(name)
+
+
+    def read(self, name):
+        return self._archive.read(name)
+
+
+class ArchivePath:
+    """Stands in for a Path to a file within a LibraryArchive."""
+    def __init__(self, archive, name):
+        self._archive = archive
+        self._name = name # always uses '/' separators.
+
+
+    def __str__(self):
+        return f'{self._archive.path}/{self._name}'
+
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self)!r})'
+
+
+    def __eq__(self, other):
+        if not isinstance(other, ArchivePath):
+            return NotImplemented
+        return str(self) == str(other)
+
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+    @property
+    def stamp(self):
+        # Identifies the version of the file, for caching purposes.
+        info = self._archive.info(self._name)
+        return str(self), self._archive.mtime, info.CRC, info.file_size
+
+
+    def open_text(self):
+        return TextIOWrapper(self._archive.open(self._name), encoding='utf-8')
+
+
+    def read_bytes(self):
+        return self._archive.read(self._name)
+
+
+class ArchiveModuleLoader(Loader):
+    """Import machinery for plugin modules stored in a library archive."""
+    def __init__(self, path):
+        self._path = path
+
+
+    def create_module(self, spec):
+        return None # use the default module creation semantics.
+
+
+    def exec_module(self, module):
+        code = compile(self._path.read_bytes(), str(self._path), 'exec')
+        exec(code, module.__dict__)
@@ -0,0 +1,301 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .compression import compression_for
+from .errors import UserError
+from array import array
+from itertools import accumulate
+import os, sys
+
+
+"""A compact binary form of listings, for passing between programs.
+
+A binary listing stores the lines that loaders see after tokenization (as
+produced by `parsing.file_parsing.process`), so reading one skips all the
+text processing. The layout is:
+
+* the magic bytes `DSA\\0` and a version number byte;
+* sections (of unsigned LEB128 varints, except as noted) for the string
+table (the length of each string in characters,
+then all the strings together as UTF-8), the token table (the number of
+parts of each token, then the index of each part in the string table) and
+the block index (the first line number, number of lines and size in bytes
+of each block), each preceded by its size in bytes;
+* the blocks of lines (a block ends after each chunk terminator line).
+Each block gives the line numbers (relative to the previous line), then
+the index of each line's prefix in the string table, then the number of
+tokens in each line, then the index of each token in the token table.
+These are stored as little-endian unsigned integers of a fixed size (1, 2
+or 4 bytes, whichever is enough for the block), given by a first byte.
+
+Keeping like values together lets whole sections be decoded at once, and
+the fixed size numbers in blocks can be decoded without a Python loop."""
+
+
+class BAD_BINARY_LISTING(UserError):
+    """binary listing is corrupt or truncated ({reason})"""
+
+
+class BINARY_LISTING_VERSION(UserError):
+    """binary listing has format version {version} (expected {expected})"""
+
+
+MAGIC = b'DSA\x00'
+
+
+_VERSION = 1
+
+
+EXTENSION = '.dsb'
+
+
+def is_binary_name(filename):
+    """Whether a file name indicates a binary listing (i.e., it ends with
+    `.dsb`, possibly followed by a compression extension)."""
+    base, extension = os.path.splitext(str(filename))
+    if compression_for(filename) is not None:
+        base, extension = os.path.splitext(base)
+    return extension.lower() == EXTENSION
+
+
+def is_binary_listing(stream):
+    """Whether a binary input `stream` (which must support `peek`) holds
+    a binary listing."""
+    return stream.peek(len(MAGIC)).startswith(MAGIC)
+
+
+def _varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _varint_bytes(values):
+    result = bytearray()
+    for value in values:
+        _varint(value, result)
+    return result
+
+
+# Array type codes for each size of number used in blocks.
+_TYPECODES = {
+    array(code).itemsize: code for code in ('L', 'I', 'H', 'B')
+}
+
+
+def _packed(values):
+    biggest = max(values)
+    size = 1 if biggest < 1 << 8 else 2 if biggest < 1 << 16 else 4
+    packed = array(_TYPECODES[size], values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return bytes((size,)) + packed.tobytes()
+
+
+def _unpacked(data):
+    size = data[0]
+    BAD_BINARY_LISTING.require(
+        size in _TYPECODES and (len(data) - 1) % size == 0,
+        reason='bad block'
+    )
+    values = array(_TYPECODES[size])
+    values.frombytes(data[1:])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tolist()
+
+
+def _interned(table, key):
+    # The index for the `key` in the `table`, adding it if necessary.
+    try:
+        return table[key]
+    except KeyError:
+        index = table[key] = len(table)
+        return index
+
+
+class _BlockWriter:
+    def __init__(self):
+        self.clear()
+
+
+    def clear(self):
+        self.first, self.previous = None, 0
+        self.deltas, self.prefixes, self.counts, self.tokens = [], [], [], []
+
+
+    def add(self, line_number, prefix, tokens):
+        if self.first is None:
+            self.first = self.previous = line_number
+        self.deltas.append(line_number - self.previous)
+        self.previous = line_number
+        self.prefixes.append(prefix)
+        self.counts.append(len(tokens))
+        self.tokens.extend(tokens)
+
+
+    def data(self):
+        return _packed(self.deltas + self.prefixes + self.counts + self.tokens)
+
+
+def encode(lines):
+    """Produce a binary listing from tokenized `lines`, given as (line
+    number, prefix, tokens) like the output of `process`."""
+    strings, tokens = {}, {}
+    index, body, block = [], bytearray(), _BlockWriter()
+    def end_block():
+        data = block.data()
+        index.extend((block.first, len(block.deltas), len(data)))
+        body.extend(data)
+        block.clear()
+    for line_number, prefix, line_tokens in lines:
+        block.add(line_number, _interned(strings, prefix), [
+            _interned(tokens, tuple(
+                _interned(strings, part) for part in token
+            ))
+            for token in line_tokens
+        ])
+        if prefix == '!' and not line_tokens: # end of a chunk.
+            end_block()
+    if block.deltas:
+        end_block()
+    result = bytearray(MAGIC)
+    result.append(_VERSION)
+    for section in (
+        _varint_bytes(map(len, strings)), ''.join(strings).encode('utf-8'),
+        _varint_bytes(map(len, tokens)),
+        _varint_bytes(part for token in tokens for part in token),
+        _varint_bytes(index)
+    ):
+        _varint(len(section), result)
+        result.extend(section)
+    result.extend(body)
+    return bytes(result)
+
+
+def _varints(data):
+    # Decode all the varints in the `data` at once. Values are often all
+    # small, so that case is handled specially.
+    if not data or max(data) < 0x80:
+        return list(data)
+    result, value, shift = [], 0, 0
+    for byte in data:
+        if byte < 0x80:
+            result.append(value | byte << shift)
+            value, shift = 0, 0
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+    BAD_BINARY_LISTING.require(shift == 0, reason='incomplete number')
+    return result
+
+
+def _split(items, sizes):
+    # Consecutive slices of `items`, with the given `sizes`.
+    bounds = [0, *accumulate(sizes)]
+    BAD_BINARY_LISTING.require(
+        bounds[-1] == len(items), reason='inconsistent table sizes'
+    )
+    return [items[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+class _Reader:
+    """Reads the sections of a binary listing sequentially."""
+    def __init__(self, data, position):
+        self._data, self.position = data, position
+
+
+    def _number(self):
+        value, shift = 0, 0
+        while True:
+            byte = self._data[self.position]
+            self.position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+
+    def section(self):
+        size = self._number()
+        start, self.position = self.position, self.position + size
+        BAD_BINARY_LISTING.require(
+            self.position <= len(self._data), reason='incomplete section'
+        )
+        return self._data[start:self.position]
+
+
+    def rest(self):
+        return self._data[self.position:]
+
+
+class BinaryListing:
+    """A binary listing, decoded on demand one or more blocks at a time."""
+    def __init__(self, data):
+        BAD_BINARY_LISTING.require(
+            data.startswith(MAGIC), reason='missing header'
+        )
+        version = data[len(MAGIC)] if len(data) > len(MAGIC) else None
+        BINARY_LISTING_VERSION.require(
+            version == _VERSION, version=version, expected=_VERSION
+        )
+        try:
+            self._load(_Reader(memoryview(data), len(MAGIC) + 1))
+        except IndexError:
+            raise BAD_BINARY_LISTING(reason='incomplete header')
+        except UnicodeDecodeError as e:
+            raise BAD_BINARY_LISTING(reason=str(e))
+
+
+    def _load(self, reader):
+        sizes = _varints(reader.section())
+        self._strings = _split(str(reader.section(), 'utf-8'), sizes)
+        sizes, parts = _varints(reader.section()), _varints(reader.section())
+        # Loaders don't modify tokens, so each one is shared between all
+        # the lines that use it.
+        self._tokens = [
+            list(map(self._strings.__getitem__, token))
+            for token in _split(parts, sizes)
+        ]
+        index = _varints(reader.section())
+        self._blocks = [] # (first line number, line count, start, end)
+        position = 0
+        for first, count, size in zip(*[iter(index)] * 3):
+            self._blocks.append((first, count, position, position + size))
+            position += size
+        self._body = reader.rest()
+        BAD_BINARY_LISTING.require(
+            len(self._body) == position, reason='wrong body size'
+        )
+
+
+    def __len__(self):
+        """The number of blocks in the listing."""
+        return len(self._blocks)
+
+
+    def _block_lines(self, first, count, values):
+        deltas, prefixes = values[:count], values[count:count*2]
+        sizes, tokens = values[count*2:count*3], values[count*3:]
+        BAD_BINARY_LISTING.require(
+            len(sizes) == count, reason='incomplete block'
+        )
+        deltas[0] += first
+        return zip(
+            accumulate(deltas),
+            map(self._strings.__getitem__, prefixes),
+            _split(list(map(self._tokens.__getitem__, tokens)), sizes)
+        )
+
+
+    def lines(self, start=0, end=None):
+        """Produce (line number, prefix, tokens) for the lines in blocks
+        from `start` to `end` (by default, all of them), in the same way
+        as `parsing.file_parsing.process`."""
+        try:
+            for first, count, begin, finish in self._blocks[start:end]:
+                values = _unpacked(self._body[begin:finish])
+                yield from self._block_lines(first, count, values)
+        except IndexError:
+            raise BAD_BINARY_LISTING(reason='bad table reference')
@@ -0,0 +1,176 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from . import __version__
+from .archive import ArchivePath
+from .ui.tracing import my_tracer
+from hashlib import sha256
+from pathlib import Path
+import os, pickle
+
+
+"""Persistent storage for expensive intermediate results."""
+
+
+def _stamp(path):
+    # Identifies a specific version of a file without reading it.
+    if isinstance(path, ArchivePath):
+        return path.stamp
+    info = os.stat(path)
+    return str(path), info.st_mtime_ns, info.st_size
+
+
+def digest(*parts):
+    """Produce a stable hex digest for a tuple of simple (repr-able) values."""
+    return sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def fingerprint(*parts, paths=()):
+    """Produce a digest identifying the given values and exact versions of
+    the given files. Any added, removed or modified file changes the result."""
+    return digest(__version__, parts, sorted(_stamp(p) for p in paths))
+
+
+def _temp_path(path):
+    return path.with_suffix(f'.{os.getpid()}.tmp')
+
+
+class Cache:
+    """A folder of pickled results. Each entry is stored according to its
+    category and the cache's `scope` (which determine the file name) along
+    with a `key`; loading only succeeds if the key matches. Thus there is at
+    most one file per category and scope; a stale entry is overwritten."""
+    def __init__(self, folder, scope):
+        self._folder = Path(folder)
+        self._scope = digest(scope)[:16]
+
+
+    def _path(self, category):
+        return self._folder / f'{category}-{self._scope}.pickle'
+
+
+    def load(self, category, key):
+        path = self._path(category)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # A corrupt or incompatible cache entry just means a cache miss.
+            my_tracer.trace(f'Ignoring unreadable cache file `{path}`')
+            return None
+        return value if stored_key == key else None
+
+
+    def save(self, category, key, value):
+        path = self._path(category)
+        self._folder.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that a concurrent run never
+        # sees a partially-written entry.
+        temp = _temp_path(path)
+        with open(temp, 'wb') as f:
+            pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+
+    def _data_folder(self, category):
+        return self._folder / f'{category}-{self._scope}'
+
+
+    def load_data(self, category, name):
+        """Read back raw data stored with `save_data`, or None if the file
+        is missing."""
+        try:
+            with open(self._data_folder(category) / name, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+    def save_data(self, category, name, data):
+        """Store raw data in its own file, in a folder for the category.
+        The `name` should be a digest of the data, so an existing file
+        never needs to be rewritten."""
+        folder = self._data_folder(category)
+        path = folder / name
+        if path.exists():
+            return
+        folder.mkdir(parents=True, exist_ok=True)
+        temp = _temp_path(path)
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+
+    def prune_data(self, category, keep):
+        """Remove the data files for the category, except those named in
+        `keep`."""
+        folder = self._data_folder(category)
+        if not folder.is_dir():
+            return
+        for path in folder.iterdir():
+            # Temporary files may belong to a concurrent run.
+            if path.name in keep or path.suffix == '.tmp':
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError: # already pruned by a concurrent run.
+                pass
+
+
+class Memo:
+    """Results of a repeated computation (as bytes), keyed by digests of
+    their inputs and stored in a Cache between runs. Each result is kept in
+    its own file, named for a digest of its contents, so that only digests
+    are held in memory. Only the results used (or computed) during this run
+    are kept when saving, so stale entries don't pile up."""
+    def __init__(self, cache, category, key, description):
+        self._cache, self._category, self._key = cache, category, key
+        self._description = description # used for tracing.
+        # These map digests of inputs to digests of results.
+        self._old = cache.load(category, key) or {}
+        self._new = {}
+        self._hits, self._misses = 0, 0
+
+
+    def _stored(self, key):
+        return self._new[key] if key in self._new else self._old.get(key)
+
+
+    def has(self, *parts):
+        """Whether there is a stored result for the given `parts`."""
+        return self._stored(digest(*parts)) is not None
+
+
+    def get(self, compute, *parts):
+        """Get the result for the given `parts`, calling `compute()`
+        to produce it if there is no stored result."""
+        key = digest(*parts)
+        name = self._stored(key)
+        result = None
+        if name is not None:
+            # The file may have been pruned by a concurrent run.
+            result = self._cache.load_data(self._category, name)
+        if result is None:
+            self._misses += 1
+            result = compute()
+            name = sha256(result).hexdigest()
+            self._cache.save_data(self._category, name, result)
+        else:
+            self._hits += 1
+        self._new[key] = name
+        return result
+
+
+    def save(self, prune=True):
+        """Store the results used during this run. If `prune` is false,
+        unused results are kept as well (e.g. when only some of the chunks
+        were assembled)."""
+        total = self._hits + self._misses
+        my_tracer.trace(
+            f'Reused {self._hits} of {total} {self._description} from the cache'
+        )
+        results = self._new if prune else {**self._old, **self._new}
+        self._cache.save(self._category, self._key, results)
+        self._cache.prune_data(self._category, set(results.values()))
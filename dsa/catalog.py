@@ -1,10 +1,12 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
+from .archive import ArchivePath, LibraryArchive, is_archive
 from .ui.tracing import my_tracer
 import toml
-from glob import glob
+from fnmatch import fnmatchcase
 from pathlib import Path
+import os
 
 
 def read_sys_catalog():
@@ -23,14 +25,168 @@ def write_sys_catalog(lookup):
         toml.dump(lookup, f)
 
 
-def _path_info(library_root, target):
+_EXTENSIONS = {
+    'codec_code': 'py', 'codec_data': 'txt', 'filters': 'py',
+    'interpreters': 'py', 'structgroups': 'txt', 'types': 'txt'
+}
+
+
+def _hidden(name):
+    return name.startswith('.')
+
+
+def _match_parts(pattern, parts):
+    # Emulates a recursive `glob` for the pattern (a list of components)
+    # against a relative path (a tuple of components): `**` matches zero or
+    # more directories; hidden names must be matched explicitly.
+    if not pattern:
+        return not parts
+    first, *rest = pattern
+    if first == '**':
+        for i, part in enumerate(parts):
+            if _match_parts(rest, parts[i:]):
+                return True
+            if _hidden(part):
+                return False
+        return False
+    if not parts or (_hidden(parts[0]) and not _hidden(first)):
+        return False
+    return fnmatchcase(parts[0], first) and _match_parts(rest, parts[1:])
+
+
+def _read_targets(library_root):
     try:
         with open(library_root / 'targets.toml') as f:
-            targets = toml.load(f)
+            return toml.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
     except FileNotFoundError:
+        return None
+
+
+class _LibraryIndex:
+    """Every candidate file in a library, found with a single scan of the
+    library. Derived classes record what is needed to check the index for
+    staleness (e.g. when loaded from a cache) without scanning again."""
+    def __init__(self, root, targets, files):
+        self._root = root
+        self._targets = targets
+        # Mapping from kind to sorted relative paths (as tuples of parts).
+        self._files = files
+
+
+    @property
+    def root(self):
+        return self._root
+
+
+    @property
+    def targets(self):
+        return self._targets
+
+
+    def __call__(self, kind, fragment):
+        pattern = [p for p in fragment.split('/') if p]
+        pattern.append(f'*.{_EXTENSIONS[kind]}')
+        for parts in self._files[kind]:
+            if _match_parts(pattern, parts):
+                yield self._path(kind, parts)
+
+
+class _FolderIndex(_LibraryIndex):
+    """Index of a library folder, found with a single walk. Directory
+    modification times are recorded to check for staleness."""
+    def __init__(self, root):
+        self._stamps = {
+            path: _mtime(path) for path in (root, root / 'targets.toml')
+        }
+        files = {}
+        for kind, ext in _EXTENSIONS.items():
+            files[kind] = found = []
+            top = root / kind
+            self._stamps[top] = _mtime(top)
+            for folder, dirnames, filenames in os.walk(top, followlinks=True):
+                folder = Path(folder)
+                self._stamps[folder] = _mtime(folder)
+                relative = folder.relative_to(top).parts
+                found.extend(
+                    relative + (name,) for name in filenames
+                    if name.endswith(f'.{ext}')
+                )
+            found.sort()
+        super().__init__(root, _read_targets(root), files)
+
+
+    @property
+    def valid(self):
+        return all(
+            _mtime(path) == stamp for path, stamp in self._stamps.items()
+        )
+
+
+    def _path(self, kind, parts):
+        return self._root.joinpath(kind, *parts)
+
+
+class _ArchiveIndex(_LibraryIndex):
+    """Index of a library packed into a zip archive. Files are read directly
+    from the archive, which is checked for staleness by its own mtime."""
+    def __init__(self, root):
+        self._archive = LibraryArchive(root)
+        self._stamp = self._archive.mtime
+        files = {kind: [] for kind in _EXTENSIONS}
+        for name in self._archive.names():
+            kind, *parts = name.split('/')
+            if kind in files and name.endswith(f'.{_EXTENSIONS[kind]}'):
+                files[kind].append(tuple(parts))
+        for found in files.values():
+            found.sort()
+        try:
+            text = self._archive.read('targets.toml').decode('utf-8')
+        except KeyError:
+            targets = None
+        else:
+            targets = toml.loads(text)
+        super().__init__(root, targets, files)
+
+
+    @property
+    def valid(self):
+        return _mtime(self._root) == self._stamp
+
+
+    def _path(self, kind, parts):
+        return ArchivePath(self._archive, '/'.join((kind, *parts)))
+
+
+def _make_index(root):
+    return _ArchiveIndex(root) if is_archive(root) else _FolderIndex(root)
+
+
+def _load_indices(library_roots, cache):
+    cached = {} if cache is None else (cache.load('index', None) or {})
+    result, changed = {}, False
+    for root in library_roots:
+        index = cached.get(root, None)
+        if index is None or not index.valid:
+            index, changed = _make_index(root), True
+        result[root] = index
+    if cache is not None and changed:
+        cache.save('index', None, result)
+    return result
+
+
+def _path_info(index, target):
+    targets = index.targets
+    if targets is None:
         targets = {}
         my_tracer.trace(
-            f'Skipping library root `{library_root}`: no targets.toml found'
+            f'Skipping library root `{index.root}`: no targets.toml found'
         )
     if '*' in targets:
         yield from targets['*']
@@ -40,8 +196,10 @@ def _path_info(library_root, target):
 
 class PathSearcher:
     # Writing this as a class seems a bit more convenient for testing.
-    def __init__(self, *where):
+    def __init__(self, *where, indices=None):
         self.where = where
+        # Mapping of library root to _LibraryIndex, created as needed.
+        self._indices = {} if indices is None else indices
 
 
     @property
@@ -55,7 +213,7 @@ class PathSearcher:
 
 
     @staticmethod
-    def create(libraries, paths, target):
+    def create(libraries, paths, target, cache=None):
         if not (libraries or paths):
             libraries = {'sys'}
         library_roots = {Path(p).resolve() for p in paths}
@@ -65,20 +223,21 @@ class PathSearcher:
                 library_roots.add(lookup[library])
             except KeyError:
                 my_tracer.trace(f'Skipping library `{library}`: unknown name')
+        indices = _load_indices(library_roots, cache)
         result = PathSearcher(*(
             (library_root, fragment)
             for library_root in library_roots
-            for fragment in _path_info(library_root, target)
-        ))
+            for fragment in _path_info(indices[library_root], target)
+        ), indices=indices)
         return result
 
 
+    def _index(self, root):
+        if root not in self._indices:
+            self._indices[root] = _make_index(root)
+        return self._indices[root]
+
+
     def __call__(self, kind):
-        ext = {
-            'codec_code': 'py', 'codec_data': 'txt', 'filters': 'py',
-            'interpreters': 'py', 'structgroups': 'txt', 'types': 'txt'
-        }[kind]
         for root, fragment in self.where:
-            glob_path = str(root / kind / fragment / f'*.{ext}')
-            for path in glob(glob_path, recursive=True):
-                yield Path(path)
+            yield from self._index(root)(kind, fragment)
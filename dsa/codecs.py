@@ -7,9 +7,9 @@ from .parsing.codec_loader import CodecLoader
 from .ui.tracing import my_tracer
 
 
-def make_codec_library(code_paths, data_paths):
+def make_codec_library(code_paths, data_paths, jobs=None):
     with my_tracer('Setting up codec loaders'):
         loader_spec = (is_class_with, {'line': is_method, 'result': is_method})
         subloaders = load_plugins(code_paths, {'Loader': loader_spec})
     with my_tracer('Creating codecs from config data'):
-        return load_files(data_paths, CodecLoader, subloaders)
+        return load_files(data_paths, CodecLoader, subloaders, jobs=jobs)
@@ -0,0 +1,112 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .ui.tracing import my_tracer
+from array import array
+from pathlib import Path
+import sys, toml, zipfile
+
+
+"""Export of the numeric contents of struct chunks, as NumPy arrays.
+
+`dsd --export-columns` writes a `.npz` file for each chunk made of structs
+of a single kind, holding an array for each numeric field of the struct
+(named after the member, and field for members with several fields). The
+files are written directly, without needing NumPy. A manifest lists the
+files, along with the label, location and struct name of each chunk, and a
+table of the labels for the values in columns that use an enum or flags.
+"""
+
+
+MANIFEST_NAME = 'columns.toml'
+
+
+_NPY_MAGIC = b'\x93NUMPY\x01\x00' # format version 1.0
+
+
+def _typecodes():
+    # Array typecodes for each (size in bytes, signedness), where available.
+    result = {}
+    for code in 'bBhHiIlLqQ':
+        result.setdefault((array(code).itemsize, code.islower()), code)
+    return result
+
+
+_TYPECODES = _typecodes()
+
+
+def _item_type(low, high):
+    # The smallest (size, signed) that holds every value from `low` to
+    # `high`, or None if there isn't one.
+    signed = low < 0
+    for size in (1, 2, 4, 8):
+        bits = size * 8 - signed
+        if -(signed << bits) <= low and high < (1 << bits):
+            return size, signed
+    return None
+
+
+def npy(values, size, signed):
+    """The contents of a `.npy` file for a one-dimensional array of integer
+    `values`, each stored in `size` bytes (`signed` or not)."""
+    data = array(_TYPECODES[size, signed], values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    kind = 'i' if signed else 'u'
+    order = '|' if size == 1 else '<'
+    header = "{'descr': '%s%s%d', 'fortran_order': False, 'shape': (%d,), }" \
+        % (order, kind, size, len(values))
+    # Padding aligns the data to 64 bytes, as NumPy does.
+    header += ' ' * (-(len(_NPY_MAGIC) + 2 + len(header) + 1) % 64) + '\n'
+    header = header.encode('latin-1')
+    return b''.join((
+        _NPY_MAGIC, len(header).to_bytes(2, 'little'), header, data.tobytes()
+    ))
+
+
+def write_npz(filename, arrays):
+    """Write a `.npz` file with the `arrays`, given as (name, contents of
+    a `.npy` file) pairs."""
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED) as f:
+        for name, data in arrays:
+            f.writestr(f'{name}.npy', data)
+
+
+class ColumnWriter:
+    """Writes the columns exported from each chunk to a file in a folder,
+    and a manifest describing them."""
+    def __init__(self, directory):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._chunks = []
+
+
+    def _arrays(self, columns, labels):
+        for name, (values, bounds, table) in columns:
+            item_type = _item_type(*bounds)
+            if item_type is None:
+                my_tracer.trace(f'Warning: column `{name}` is too wide.')
+                continue
+            if table:
+                labels[name] = {str(k): v for k, v in table.items()}
+            yield name, npy(values, *item_type)
+
+
+    def __call__(self, location, label, struct, count, columns):
+        """Write the `columns` for the chunk at `location`, as produced by
+        `StructGroup.columns`."""
+        filename = f'{location:08X}.npz'
+        labels = {}
+        write_npz(self._directory / filename, self._arrays(columns, labels))
+        chunk = {
+            'file': filename, 'label': label, 'location': location,
+            'struct': struct, 'count': count
+        }
+        if labels:
+            chunk['labels'] = labels
+        self._chunks.append(chunk)
+
+
+    def finish(self):
+        with open(self._directory / MANIFEST_NAME, 'w') as f:
+            toml.dump({'chunk': self._chunks}, f)
@@ -0,0 +1,281 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .errors import UserError
+from .stdio import is_stdio, text_stdout
+from contextlib import contextmanager
+from queue import Queue
+import bz2, gzip, io, lzma, os, re, sys, threading, zlib
+
+
+"""Reading and writing compressed text files."""
+
+
+class UNKNOWN_COMPRESSION(UserError):
+    """unknown compression format `{name}` (use one of: {choices})"""
+
+
+class BAD_COMPRESSED_DATA(UserError):
+    """couldn't decompress `{filename}` as {name} ({reason})"""
+
+
+_COMPRESSORS = {
+    # zlib's gzip mode is used directly, so that output doesn't depend on
+    # the time (gzip.compress would record it in the header).
+    'gzip': lambda: zlib.compressobj(6, zlib.DEFLATED, 31),
+    'xz': lambda: lzma.LZMACompressor(lzma.FORMAT_XZ),
+    'bz2': bz2.BZ2Compressor
+}
+
+
+FORMATS = tuple(_COMPRESSORS)
+
+
+_OPENERS = {'gzip': gzip.open, 'xz': lzma.open, 'bz2': bz2.open}
+
+
+_EXTENSIONS = {'.gz': 'gzip', '.xz': 'xz', '.bz2': 'bz2'}
+
+
+# Every text file is checked, so the patterns must not match plain text.
+_MAGIC = (
+    (re.compile(b'\x1f\x8b\x08'), 'gzip'), # including the method (deflate)
+    (re.compile(b'\xfd7zXZ\x00'), 'xz'),
+    # `BZh` and the block size, then the magic number for the first block
+    # (or for the end of the stream, if it is empty).
+    (re.compile(b'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'), 'bz2')
+)
+
+
+# Errors raised while reading corrupt compressed data.
+_DECOMPRESSION_ERRORS = (OSError, EOFError, lzma.LZMAError, zlib.error)
+
+
+def compression_for(filename, name=None):
+    """Determine the compression format for an output file: either the
+    explicitly `name`d one, or according to the file name's extension.
+    Returns None for uncompressed output."""
+    if name is not None:
+        UNKNOWN_COMPRESSION.require(
+            name in _COMPRESSORS, name=name, choices=', '.join(FORMATS)
+        )
+        return name
+    if is_stdio(filename):
+        return None
+    return _EXTENSIONS.get(os.path.splitext(str(filename))[1].lower(), None)
+
+
+def extension_for(name):
+    """The usual file name extension for the `name`d compression format,
+    or an empty string for None (uncompressed)."""
+    if name is None:
+        return ''
+    return next(e for e, n in _EXTENSIONS.items() if n == name)
+
+
+# The number of bytes needed to detect any of the formats.
+_MAGIC_SIZE = 10
+
+
+class _ReadAhead(io.RawIOBase):
+    """Reads from a binary `stream`, after first giving back the `start`
+    bytes that were already read from it. The `stream` isn't closed."""
+    def __init__(self, start, stream):
+        super().__init__()
+        self._start, self._stream = start, stream
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        if not self._start:
+            return self._stream.readinto(buffer)
+        size = min(len(buffer), len(self._start))
+        buffer[:size] = self._start[:size]
+        self._start = self._start[size:]
+        return size
+
+
+def detect_compression(stream):
+    """Determine the compression format of a binary input `stream` from its
+    first bytes, or None if uncompressed. Returns the format name, and a
+    stream (supporting `peek`) that reads the same data from the start.
+    The first bytes are read until there are enough (or the data ends),
+    since a pipe may supply fewer at a time."""
+    start = b''
+    while len(start) < _MAGIC_SIZE:
+        more = stream.read(_MAGIC_SIZE - len(start))
+        if not more:
+            break
+        start += more
+    stream = io.BufferedReader(_ReadAhead(start, stream))
+    for magic, name in _MAGIC:
+        if magic.match(start):
+            return name, stream
+    return None, stream
+
+
+class _CheckedReader(io.RawIOBase):
+    """Reads from a decompressing `stream`, reporting corrupt data as a
+    UserError rather than letting the decompressor's exception through."""
+    def __init__(self, stream, filename, name):
+        super().__init__()
+        self._stream, self._filename, self._name = stream, filename, name
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        try:
+            return self._stream.readinto(buffer)
+        except _DECOMPRESSION_ERRORS as e:
+            raise BAD_COMPRESSED_DATA(
+                filename=self._filename, name=self._name, reason=e
+            )
+
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._stream.close()
+        finally:
+            super().close()
+
+
+def _decompressed(source, name, filename):
+    # A binary stream (supporting `peek`) of the decompressed data from the
+    # `source` (a file name or binary stream), which was written in the
+    # `name`d format. A stream `source` isn't closed afterward.
+    return io.BufferedReader(
+        _CheckedReader(_OPENERS[name](source, 'rb'), filename, name)
+    )
+
+
+class _CompressingWriter(io.RawIOBase):
+    """A binary stream that compresses data written to it and writes the
+    result to a `target` stream. Compression happens on a background
+    thread, so that it overlaps with producing the data (the compressors
+    release the GIL while working)."""
+    def __init__(self, target, compressor, close_target):
+        super().__init__()
+        self._target, self._compressor = target, compressor
+        self._close_target = close_target
+        self._queue = Queue(8) # bounds the memory used for pending data.
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def _run(self):
+        try:
+            for data in iter(self._queue.get, None):
+                self._target.write(self._compressor.compress(data))
+            self._target.write(self._compressor.flush())
+        except BaseException as e:
+            self._error = e
+            # Keep accepting data, so that the writer doesn't block.
+            for data in iter(self._queue.get, None):
+                pass
+
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        self._check()
+        # The caller may reuse its buffer, so the data must be copied.
+        self._queue.put(bytes(data))
+        return len(data)
+
+
+    def close(self):
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if self._close_target:
+                self._target.close()
+            else:
+                self._target.flush()
+        finally:
+            super().close()
+        self._check()
+
+
+def _compressed_text(target, name, close_target):
+    raw = _CompressingWriter(target, _COMPRESSORS[name](), close_target)
+    return io.TextIOWrapper(
+        io.BufferedWriter(raw, 1 << 20), encoding='utf-8', newline='\n'
+    )
+
+
+def open_text_output(filename, compression=None):
+    """Open a text file (or standard output, for `-`) for writing, with
+    the given `compression` format (see `compression_for`). Line endings
+    are written as `\\n` on every platform, so that files are the same
+    everywhere, and offsets in source maps are exact."""
+    if compression is None:
+        if is_stdio(filename):
+            return text_stdout()
+        return open(filename, 'w', encoding='utf-8', newline='\n')
+    if is_stdio(filename):
+        sys.stdout.flush() # keep anything written before in order.
+        return _compressed_text(sys.stdout.buffer, compression, False)
+    return _compressed_text(open(filename, 'wb'), compression, True)
+
+
+def compress(data, name):
+    """Compress binary `data` in the `name`d format (or not, for None)."""
+    if name is None:
+        return data
+    compressor = _COMPRESSORS[name]()
+    return compressor.compress(data) + compressor.flush()
+
+
+@contextmanager
+def open_binary_input(filename):
+    """A context manager giving a binary file (or standard input, for `-`)
+    for reading, decompressed automatically. The stream supports `peek`."""
+    stdin = is_stdio(filename)
+    raw = sys.stdin.buffer if stdin else open(filename, 'rb')
+    try:
+        name, stream = detect_compression(raw)
+        with stream:
+            if name is None:
+                yield stream
+            else:
+                with _decompressed(stream, name, filename) as decompressed:
+                    yield decompressed
+    finally:
+        if not stdin:
+            raw.close()
+
+
+def open_text_input(filename):
+    """Open a text file (or standard input, for `-`) for reading. A file
+    compressed in any supported format is decompressed automatically."""
+    if is_stdio(filename):
+        # Closing the result leaves standard input open.
+        name, stream = detect_compression(sys.stdin.buffer)
+        if name is not None:
+            stream = _decompressed(stream, name, filename)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    with open(filename, 'rb') as f:
+        name, _ = detect_compression(f)
+    if name is None:
+        return open(filename, encoding='utf-8')
+    return io.TextIOWrapper(
+        _decompressed(filename, name, filename), encoding='utf-8'
+    )
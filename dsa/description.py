@@ -93,6 +93,9 @@ class _Interval:
 
 
 class UnlabelledRange:
+    labelled = False
+
+
     def __init__(self, interval):
         self._interval = interval
 
@@ -122,6 +125,9 @@ _labelled_range_parameter = single_parser('labelled range parameter', 'integer')
 
 
 class LabelledRange:
+    labelled = True
+
+
     def __init__(self, interval, label):
         self._interval = interval
         self._label = label
@@ -199,6 +205,20 @@ class EnumDescription:
         )
 
 
+    def label_table(self, values):
+        """A dict mapping those of the `values` that are formatted with
+        labels (rather than as numbers) to the formatted text."""
+        result = {}
+        for value in sorted(set(values)):
+            for r in self._ranges:
+                text = r.format(value, str)
+                if text is not None:
+                    if r.labelled:
+                        result[value] = text
+                    break
+        return result
+
+
     def parse(self, text):
         return PARSE_FAILED.first_not_none(
             (r.parse(text) for r in self._ranges),
@@ -230,6 +250,11 @@ class FlagsDescription:
         return ' | '.join(set_flags) if set_flags else numeric_formatter(0)
 
 
+    def label_table(self, values):
+        # The name of each flag, by its value.
+        return {1 << i: name for i, name in enumerate(self._names)}
+
+
     def parse(self, text):
         value = 0
         # Special case for no flags set.
@@ -267,6 +292,10 @@ class RawDescription:
         return numeric_formatter(value)
 
 
+    def label_table(self, values):
+        return {}
+
+
     def parse(self, text):
         return _field_value([text])
 
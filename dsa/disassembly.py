@@ -2,8 +2,16 @@
 # Licensed under the Open Software License version 3.0
 
 from .errors import wrap as wrap_errors, UserError
+from .binary_listing import is_binary_name
+from .columns import ColumnWriter
+from .compression import compression_for
+from .interning import LineStore, TokenTable
 from .output import output_file
+from .sharding import write_shards
+from .source_map import SOURCE_MAP_UNSUPPORTED, build_source_map
+from .stdio import is_stdio
 from .ui.tracing import my_tracer
+from functools import partial
 from itertools import count
 
 
@@ -30,10 +38,23 @@ class _InterpreterWrapper:
         return (self._name, *self._config)
 
 
-    def disassemble(self, codec_lookup, label, data, register, label_ref):
-        return self._impl.disassemble(
-            codec_lookup, self._config, label, data, register, label_ref
-        )
+    def disassemble(
+        self, codec_lookup, label, data, register, label_ref, export=False
+    ):
+        # Returns the chunk size, lines, and exported columns if `export` is
+        # set. Only some interpreters (i.e. structgroups) can export columns;
+        # they collect what they need while disassembling.
+        args = (codec_lookup, self._config, label, data, register, label_ref)
+        columns = getattr(self._impl, 'columns', None) if export else None
+        if columns is None:
+            return (*self._impl.disassemble(*args), None)
+        matches = []
+        size, lines = self._impl.disassemble(*args, matches.append)
+        return size, lines, columns(self._config, matches)
+
+
+    def item_size(self, token):
+        return self._impl.item_size(token)
 
 
 def _chunk_header(label, location, name):
@@ -69,7 +90,7 @@ class _DummyChunk:
         )
 
 
-    def load(self, codec_lookup, register, label_ref):
+    def load(self, codec_lookup, register, label_ref, export=None):
         pass
 
 
@@ -80,13 +101,25 @@ class _DummyChunk:
         yield ('',)
 
 
+    @property
+    def line_count(self):
+        return 3
+
+
+    def layout(self, location):
+        return 0, 0, [None] * 3
+
+
 class _Chunk:
-    def __init__(self, interpreter_args, interpreter, tag, unpack_chain, label):
+    def __init__(
+        self, interpreter_args, interpreter, tag, unpack_chain, label, table
+    ):
         assert isinstance(interpreter, _InterpreterWrapper)
         self._interpreter = interpreter
         self._tag, self._label = tag, label
         self._data, self._filter_info = unpack_chain.data, unpack_chain.info
         self._lines, self._size = None, 0
+        self._table = table # TokenTable shared by every chunk.
         self._interpreter_args = interpreter_args
 
 
@@ -109,11 +142,19 @@ class _Chunk:
         )
 
 
-    def load(self, codec_lookup, register, label_ref):
-        self._size, self._lines = wrap_errors(
-            self._tag, self._interpreter.disassemble,
-            codec_lookup, self._label, self._data, register, label_ref
+    def load(self, codec_lookup, register, label_ref, export=None):
+        """Disassemble the chunk. If `export` is given, it is called with
+        the label and the exported columns (see `dsa.columns`), if any."""
+        self._size, lines, columns = wrap_errors(
+            self._tag, self._interpreter.disassemble, codec_lookup,
+            self._label, self._data, register, label_ref, export is not None
         )
+        if columns is not None:
+            export(self._label, *columns)
+        # The lines are kept until the listing is written, in compact form.
+        self._lines = LineStore(self._table, lines)
+        # The source data is no longer needed, either.
+        self._data = None
 
 
     def tokens(self, location):
@@ -126,6 +167,36 @@ class _Chunk:
         yield ('',)
 
 
+    @property
+    def line_count(self):
+        """The number of lines produced by `tokens`, without producing
+        them."""
+        lines, size = self._filter_info(self._size)
+        return len(lines) + len(self._lines) + 3
+
+
+    def _item_size(self, line):
+        # Label lines don't correspond to any data.
+        if len(line) < 2 or line[1][:1] == ('@',):
+            return 0
+        return self._interpreter.item_size(list(line[1]))
+
+
+    def layout(self, location):
+        """(size in the binary, index of the header line, and (location,
+        size) or None for each line) for the lines produced by `tokens`."""
+        filter_lines, size = self._filter_info(self._size)
+        spans = [None] * (len(filter_lines) + 1)
+        offset = location
+        for line in self._lines:
+            # Locations within filtered data aren't known.
+            item = 0 if filter_lines else self._item_size(line)
+            spans.append((offset, item) if item else None)
+            offset += item
+        spans.extend((None, None))
+        return size, len(filter_lines), spans
+
+
 class Disassembler:
     def __init__(
         self, source, interpreter_lookup, filter_library, codec_lookup, root_data
@@ -137,6 +208,7 @@ class Disassembler:
         self._chunks = {} # position -> Chunk (disassembled or pending)
         self._pending = set() # positions of pending Chunks
         self._labels = set() # string label names of Chunks
+        self._tokens = TokenTable() # for the lines of every Chunk
         # Using normal tokenization rules is probably not desirable.
         # Just split the "root" data on colons, use the last for the location,
         # and others for name and parameters.
@@ -182,7 +254,10 @@ class Disassembler:
         unpack_chain = self._filter_library.unpack_chain(
             self._codec_lookup, self._source, start, filter_specs
         )
-        return _Chunk(interpreter_args, interpreter, tag, unpack_chain, label)
+        return _Chunk(
+            interpreter_args, interpreter, tag, unpack_chain, label,
+            self._tokens
+        )
 
 
     def _register(self, interpreter_args, filter_specs, location, label_base):
@@ -210,7 +285,65 @@ class Disassembler:
             yield from chunk.tokens(location)
 
 
-    def __call__(self, outfilename):
+    def _label_index_tokens(self):
+        for location, chunk in sorted(self._chunks.items()):
+            yield ('', ('@', chunk.label), (f'0x{location:X}',))
+
+
+    def _layout(self):
+        for location, chunk in sorted(self._chunks.items()):
+            yield (location, chunk.label, *chunk.layout(location))
+
+
+    def listing(self):
+        """The lines of the disassembly listing, in the form used by
+        `output_file`. Only valid after the disassembler has been called."""
+        return self._all_tokens()
+
+
+    def blocks(self):
+        """(location, label, lines, count) for each chunk of the listing,
+        in order, where `lines` is a callable producing the chunk's lines
+        and `count` is the number of lines. Only valid after the
+        disassembler has been called."""
+        return [
+            (
+                location, chunk.label, partial(chunk.tokens, location),
+                chunk.line_count
+            )
+            for location, chunk in sorted(self._chunks.items())
+        ]
+
+
+    def __call__(
+        self, outfilename, labels_filename=None, compression=None,
+        shard_by=None, jobs=None, binary=False, source_map=None, columns=None
+    ):
+        SOURCE_MAP_UNSUPPORTED.require(source_map is None or not (
+            shard_by is not None or binary or is_binary_name(outfilename)
+            or is_stdio(outfilename)
+            or compression_for(outfilename, compression) is not None
+        ))
+        writer = None if columns is None else ColumnWriter(columns)
         for position, chunk in iter(self._next_chunk, None):
-            chunk.load(self._codec_lookup, self._register, self._label_ref)
-        output_file(outfilename, self._all_tokens())
+            chunk.load(
+                self._codec_lookup, self._register, self._label_ref,
+                None if writer is None else partial(writer, position)
+            )
+        if writer is not None:
+            writer.finish()
+        positions = None if source_map is None else []
+        if shard_by is None:
+            output_file(
+                outfilename, self.listing(),
+                compression=compression, binary=binary, positions=positions
+            )
+        else:
+            write_shards(
+                outfilename, self.blocks(), shard_by, compression, jobs,
+                binary
+            )
+        if source_map is not None:
+            build_source_map(positions, self._layout()).write(source_map)
+        if labels_filename is not None:
+            output_file(labels_filename, self._label_index_tokens())
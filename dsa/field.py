@@ -23,6 +23,14 @@ class MISSING_DESCRIPTION(MappingError):
     """unrecognized description name `{key}`"""
 
 
+class VALUE_OUT_OF_RANGE(UserError):
+    """value {value} is out of range (must be from {low} to {high})"""
+
+
+class TEXT_NOT_NUMERIC(UserError):
+    """text fields can't be given as numbers"""
+
+
 class FieldTranslation:
     def __init__(self, bits, bias, signed):
         self.bits = bits
@@ -45,6 +53,13 @@ class FieldTranslation:
         return 1 << (self.bits - 1)
 
 
+    @property
+    def bounds(self):
+        """The lowest and highest values that can be represented."""
+        low = self.bias - self.halfcount if self.signed else self.bias
+        return low, low + self.count - 1
+
+
     # Convert unsigned value from the data into one that will be formatted.
     def value(self, raw):
         assert 0 <= raw < self.count
@@ -89,6 +104,17 @@ class NumericField:
         return self.description.format(value, self.formatter)
 
 
+    def column(self, raws):
+        """(values, bounds, label table) for a column of `raws` from this
+        field, without formatting any text."""
+        value = self.translation.value
+        values = [value(raw) for raw in raws]
+        return (
+            values, self.translation.bounds,
+            self.description.label_table(values)
+        )
+
+
     def parse(self, text):
         result = self.description.parse(text)
         if result is not None:
@@ -96,6 +122,15 @@ class NumericField:
         return result
 
 
+    def raw_value(self, value):
+        """Convert a numeric value, as it would be formatted, to raw data."""
+        low, high = self.translation.bounds
+        VALUE_OUT_OF_RANGE.require(
+            low <= value <= high, value=value, low=low, high=high
+        )
+        return self.translation.raw(value)
+
+
 class TextField:
     def __init__(self, encoding, bits):
         self._encoding = encoding
@@ -116,6 +151,10 @@ class TextField:
         return None
 
 
+    def column(self, raws):
+        return None # only numeric values are exported.
+
+
     def format(self, raw):
         # TODO: make stripping optional when disassembling.
         text = raw.to_bytes(self._bits // 8, 'little').rstrip(b'\x00')
@@ -132,6 +171,10 @@ class TextField:
         return value
 
 
+    def raw_value(self, value):
+        raise TEXT_NOT_NUMERIC
+
+
 _field_argument_parser = argument_parser(
     bias='integer', values='string',
     encoding='encoding',
@@ -4,7 +4,7 @@
 from .errors import wrap as wrap_errors, MappingError
 from .parsing.line_parsing import line_parser
 from .parsing.token_parsing import single_parser
-from .plugins import exists, is_class_with, is_function, is_method, is_property, load_plugins
+from .plugins import exists, is_class_with, is_function, is_method, is_property, lazy_plugins
 
 
 class UNKNOWN_FILTER(MappingError):
@@ -72,7 +72,8 @@ def _build_parser(name, args):
 
 class FilterLibrary:
     def __init__(self, paths):
-        self._filters = load_plugins(
+        # Filter modules are only imported when first used.
+        self._filters = lazy_plugins(
             paths, {
                 'pack': is_function,
                 'pack_args': exists,
@@ -0,0 +1,71 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from array import array
+
+
+"""Compact storage for the lines of a disassembly listing.
+
+A large disassembly has millions of lines, but relatively few distinct
+tokens (struct names, labels, small numbers and so on). Each distinct token
+is stored once, in a TokenTable shared by the whole listing; the lines of
+each chunk are stored as arrays of token ids, and only turned back into
+tuples of tokens as they are written out.
+"""
+
+
+class TokenTable:
+    """Assigns an id to each distinct token, so that it is only stored once.
+    Unhashable tokens (i.e. lists) are stored as tuples."""
+    def __init__(self):
+        self._ids = {}
+        self._tokens = []
+
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+    @property
+    def tokens(self):
+        """The distinct tokens, indexed by id."""
+        return self._tokens
+
+
+    def id(self, token):
+        try:
+            return self._ids[token]
+        except KeyError:
+            pass
+        except TypeError: # unhashable, e.g. a list.
+            return self.id(tuple(token))
+        result = self._ids[token] = len(self._tokens)
+        self._tokens.append(token)
+        return result
+
+
+class LineStore:
+    """A sequence of lines (tuples of a prefix and tokens, as used by
+    `output_file`), stored as the ids of the items in a TokenTable."""
+    def __init__(self, table, lines=()):
+        self._table = table
+        self._ids = array('I') # for every item of every line, in order.
+        self._ends = array('I') # index in `_ids` after each line.
+        for line in lines:
+            self.append(line)
+
+
+    def append(self, line):
+        self._ids.extend(map(self._table.id, line))
+        self._ends.append(len(self._ids))
+
+
+    def __len__(self):
+        return len(self._ends)
+
+
+    def __iter__(self):
+        get, ids, start = self._table.tokens.__getitem__, self._ids, 0
+        for end in self._ends:
+            yield tuple(map(get, ids[start:end]))
+            start = end
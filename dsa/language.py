@@ -1,73 +1,293 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
+from .cache import Cache, Memo, digest, fingerprint
 from .catalog import PathSearcher
 from .codecs import make_codec_library
 from .disassembly import Disassembler
 from .filters import FilterLibrary
+from .lazy import DeferredLookup, LazyLookup
+from .output import read_back
+from .stdio import NEEDS_REAL_FILE, is_stdio
 from .ui.tracing import my_tracer
-from .parsing.file_parsing import load_files, load_files_into
-from .parsing.source_loader import SourceLoader
+from .parsing.file_parsing import DUPLICATE_FILE, load_files, load_files_into
+from .parsing.label_loader import LabelLoader
+from .parsing.source_loader import (
+    LabelScanner, StreamingSourceLoader, assemble_lines, load_blocks,
+    load_source, load_sources
+)
 from .parsing.structgroup_loader import StructGroupLoader
 from .parsing.type_loader import TypeLoader
-from .plugins import is_function, load_plugins
+from .plugins import is_function, plugin_loaders, plugin_name
+from .source_map import SourceMap
+from functools import partial
 from pathlib import Path
+import os
 
 
-@my_tracer('Loading interpreters')
-def _interpreters(get_paths):
-    with my_tracer('Loading native-code interpreters'):
-        interpreters = load_plugins(get_paths('interpreters'), {
-            'assemble': is_function,
-            'disassemble': is_function,
-            'item_size': is_function
-        })
-    with my_tracer('Loading types'):
-        type_data = load_files(get_paths('types'), TypeLoader)
-    with my_tracer('Loading structgroup-based interpreters'):
-        load_files_into(
-            interpreters, get_paths('structgroups'),
-            StructGroupLoader, *type_data
-        )
-    return interpreters
+class _StructGroupSource:
+    """Loads structgroups on demand. Without a cache, each structgroup file
+    is parsed when first needed (after loading all the types, which any of
+    them might use). With a cache, the entire set is loaded or rebuilt
+    together, since the cache is keyed on every definition file."""
+    def __init__(self, type_paths, structgroup_paths, cache, jobs):
+        self._type_paths = type_paths
+        self._structgroup_paths = structgroup_paths
+        self._cache = cache
+        self._jobs = jobs
+        self._type_data = None
+        self._all = None
+
+
+    def _types(self):
+        if self._type_data is None:
+            with my_tracer('Loading types'):
+                self._type_data = load_files(
+                    self._type_paths, TypeLoader, jobs=self._jobs
+                )
+        return self._type_data
+
+
+    def _load_all(self):
+        if self._all is not None:
+            return self._all
+        # Structgroups depend only on the type and structgroup definition
+        # files, so those files (and their versions) determine the cache key.
+        paths = self._type_paths + self._structgroup_paths
+        key = fingerprint(paths=paths)
+        self._all = self._cache.load('structgroups', key)
+        if self._all is not None:
+            my_tracer.trace('Using cached structgroups')
+            return self._all
+        self._all = {}
+        with my_tracer('Loading structgroup-based interpreters'):
+            load_files_into(
+                self._all, self._structgroup_paths,
+                StructGroupLoader, *self._types(), jobs=self._jobs
+            )
+        self._cache.save('structgroups', key, self._all)
+        return self._all
+
+
+    def _load_one(self, path):
+        return load_files([path], StructGroupLoader, *self._types())
+
 
+    def _load_cached(self, name):
+        return self._load_all()[name]
 
-@my_tracer('Loading filters')
+
+    def loaders(self):
+        result = {}
+        for path in self._structgroup_paths:
+            name = plugin_name(path)
+            loader = (
+                partial(self._load_one, path) if self._cache is None
+                else partial(self._load_cached, name)
+            )
+            DUPLICATE_FILE.add_unique(result, name, loader)
+        return result
+
+
+@my_tracer('Indexing interpreters')
+def _interpreters(get_paths, cache, jobs):
+    loaders = plugin_loaders(get_paths('interpreters'), {
+        'assemble': is_function,
+        'disassemble': is_function,
+        'item_size': is_function
+    })
+    structgroups = _StructGroupSource(
+        list(get_paths('types')), list(get_paths('structgroups')),
+        cache, jobs
+    )
+    # Both kinds of interpreter are looked up in the same namespace.
+    for name, loader in structgroups.loaders().items():
+        DUPLICATE_FILE.add_unique(loaders, name, loader)
+    return LazyLookup(loaders)
+
+
+@my_tracer('Indexing filters')
 def _filters(get_paths):
     return FilterLibrary(get_paths('filters'))
 
 
-@my_tracer('Loading codecs')
-def _codecs(get_paths):
-    return make_codec_library(get_paths('codec_code'), get_paths('codec_data'))
+@my_tracer('Indexing codecs')
+def _codecs(get_paths, jobs):
+    # Codec names are defined by the contents of the data files, so they
+    # can't be indexed without loading; instead, all codecs are loaded
+    # the first time any codec is needed.
+    return DeferredLookup(partial(
+        make_codec_library,
+        list(get_paths('codec_code')), list(get_paths('codec_data')), jobs
+    ))
+
+
+_KINDS = (
+    'types', 'structgroups', 'interpreters', 'filters',
+    'codec_code', 'codec_data'
+)
+
+
+def _source_names(sources):
+    # A single file name may be given instead of a sequence of them.
+    if isinstance(sources, (str, os.PathLike)):
+        return [sources]
+    return list(sources)
 
 
 class Language:
-    def __init__(self, interpreters, filters, codecs):
+    def __init__(
+        self, interpreters, filters, codecs,
+        jobs=None, cache=None, definitions=()
+    ):
         self._interpreters = interpreters
         self._filters = filters
         self._codecs = codecs
+        self._jobs = jobs
+        self._cache = cache
+        self._definitions = definitions # every file the language uses.
 
 
     @staticmethod
     @my_tracer('Loading language')
-    def create(libraries, paths, target):
+    def create(libraries, paths, target, cache=None, jobs=None):
+        """Create a Language from the specified libraries and target.
+        `cache` -> optional path to a folder used to store compiled
+        structgroups, and assembled chunk data, between runs. Cached data
+        is used only when every contributing definition file is unchanged.
+        `jobs` -> if specified, the number of worker processes used to
+        tokenize definition files when several are loaded at once, and
+        to parse large source files when assembling."""
+        if cache is not None:
+            cache = Cache(cache, (
+                sorted(libraries),
+                sorted(str(Path(p).resolve()) for p in paths),
+                target
+            ))
         with my_tracer('Loading definition paths'):
-            search = PathSearcher.create(libraries, paths, target)
+            search = PathSearcher.create(libraries, paths, target, cache)
+            found = {kind: list(search(kind)) for kind in _KINDS}
+        get_paths = found.__getitem__
         return Language(
-            _interpreters(search), _filters(search), _codecs(search)
+            _interpreters(get_paths, cache, jobs),
+            _filters(get_paths), _codecs(get_paths, jobs), jobs,
+            cache, [path for kind in _KINDS for path in found[kind]]
+        )
+
+
+    def _chunk_memo(self, sources):
+        # Assembled chunk data may depend on any definition file or plugin.
+        # Each set of source files gets its own cache file, so that
+        # assembling one doesn't discard the results for another.
+        if self._cache is None:
+            return None
+        resolved = tuple(str(Path(source).resolve()) for source in sources)
+        category = 'chunks-' + digest(*resolved)[:16]
+        key = fingerprint(paths=self._definitions)
+        return Memo(self._cache, category, key, 'assembled chunks')
+
+
+    def assemble(self, sources, select=None):
+        """Assemble the `sources` (a file name, or a sequence of them)
+        together, producing a dict mapping binary locations to chunk data.
+        `select` -> optional callback, given the name and location of each
+        chunk, choosing which chunks to assemble (see `dsa.selection`)."""
+        sources = _source_names(sources)
+        memo = self._chunk_memo(sources)
+        result = load_source(
+            sources, self._interpreters, self._filters, self._codecs,
+            memo, self._jobs, select
         )
+        if memo is not None:
+            memo.save(prune=select is None)
+        return result
 
 
-    def assemble(self, source):
-        return load_files(
-            [source], SourceLoader,
-            self._interpreters, self._filters, self._codecs
+    def assemble_streaming(
+        self, sources, emit, labels=None, select=None, source_map=None
+    ):
+        """Assemble each chunk of the `sources` (a file name, or a
+        sequence of them) as soon as it is read, calling `emit(location,
+        data)` for each.
+        `labels` -> optional path to a label index file (as written by
+        `dsd --labels`). Otherwise, the sources are scanned for labels
+        first.
+        `select` -> optional callback, given the name and location of each
+        chunk, choosing which chunks to assemble (see `dsa.selection`).
+        `source_map` -> optional path to a source map (as written by
+        `dsd --source-map`) for a single source, used with `labels` and
+        `select` to read only the selected blocks."""
+        sources = _source_names(sources)
+        if source_map is not None:
+            self._assemble_blocks(sources, emit, labels, select, source_map)
+            return
+        if labels is None:
+            # The sources are read twice, so they must be real files.
+            NEEDS_REAL_FILE.require(
+                not any(map(is_stdio, sources)),
+                purpose='scanning for labels (without `--labels`)'
+            )
+            with my_tracer('Scanning for labels'):
+                index = load_sources(sources, LabelScanner, self._interpreters)
+        else:
+            index = load_files([labels], LabelLoader)
+        memo = self._chunk_memo(sources)
+        load_sources(
+            sources, StreamingSourceLoader,
+            self._interpreters, self._filters, self._codecs, index, emit, memo,
+            select
+        )
+        if memo is not None:
+            memo.save(prune=select is None)
+
+
+    def _assemble_blocks(self, sources, emit, labels, select, source_map):
+        [source] = sources
+        index = load_files([labels], LabelLoader)
+        memo = self._chunk_memo(sources)
+        loader = StreamingSourceLoader(
+            self._interpreters, self._filters, self._codecs, index, emit, memo,
+            select
+        )
+        # The index can't be checked for stale labels, since most of the
+        # blocks are never read.
+        load_blocks(loader, source, SourceMap.load(source_map), select)
+        if memo is not None:
+            memo.save(prune=select is None)
+
+
+    def assemble_listing(self, description, lines):
+        """Assemble a listing directly from `lines` in the form used by
+        `output_file` (e.g. from `disassemble`), without reading any text."""
+        return assemble_lines(
+            description, read_back(lines),
+            self._interpreters, self._filters, self._codecs, self._jobs
         )
 
 
     # TODO fix this interface
-    def disassemble(self, data, root_info, output):
-        Disassembler(
+    def disassemble(
+        self, data, root_info, output, labels=None, compression=None,
+        shard_by=None, binary=False, source_map=None, columns=None
+    ):
+        """Disassemble the `data`, writing the listing to `output` (and a
+        label index to `labels`, if specified). Returns the Disassembler,
+        which can produce the listing again.
+        `compression` -> optional compression format for the listing.
+        `shard_by` -> if specified, `output` is a folder, and the listing is
+        split into several files there according to this method (see
+        `dsa.sharding`).
+        `binary` -> if true, the listing is written in binary form (see
+        `dsa.binary_listing`).
+        `source_map` -> if specified, a source map for the listing is
+        written to this file (see `dsa.source_map`).
+        `columns` -> if specified, the numeric contents of struct chunks
+        are also exported to this folder (see `dsa.columns`)."""
+        disassembler = Disassembler(
             data, self._interpreters, self._filters, self._codecs, root_info
-        )(output)
+        )
+        disassembler(
+            output, labels, compression, shard_by, self._jobs, binary,
+            source_map, columns
+        )
+        return disassembler
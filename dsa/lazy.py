@@ -0,0 +1,67 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from collections.abc import Mapping
+
+
+"""Mappings that defer loading their contents until needed."""
+
+
+class LazyLookup(Mapping):
+    """A mapping with a known set of keys, whose values are each created
+    on first access by calling the corresponding zero-argument loader."""
+    def __init__(self, loaders):
+        self._loaders = loaders
+        self._loaded = {}
+
+
+    def __getitem__(self, key):
+        try:
+            return self._loaded[key]
+        except KeyError:
+            pass
+        loader = self._loaders[key] # an unknown key raises KeyError here.
+        result = loader()
+        self._loaded[key] = result
+        return result
+
+
+    def __contains__(self, key):
+        # Checking for a key should not cause it to be loaded.
+        return key in self._loaders
+
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+
+    def __len__(self):
+        return len(self._loaders)
+
+
+class DeferredLookup(Mapping):
+    """A mapping whose keys can't be known ahead of time; the entire
+    underlying mapping is created on first access."""
+    def __init__(self, create):
+        self._create = create
+        self._mapping = None
+
+
+    @property
+    def mapping(self):
+        if self._mapping is None:
+            self._mapping = self._create()
+            self._create = None
+        return self._mapping
+
+
+    def __getitem__(self, key):
+        return self.mapping[key]
+
+
+    def __iter__(self):
+        return iter(self.mapping)
+
+
+    def __len__(self):
+        return len(self.mapping)
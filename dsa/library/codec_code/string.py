@@ -5,7 +5,7 @@ from dsa.errors import MappingError, UserError
 from dsa.parsing.line_parsing import line_parser
 from dsa.parsing.token_parsing import make_parser, single_parser
 import codecs
-from io import BytesIO, StringIO
+from io import BytesIO
 import re
 
 
@@ -41,41 +41,116 @@ _parse_param = make_parser(
 )
 
 
-def _read_single(output, data, mapping, sizes, stream, reader):
-    start = stream.tell()
-    for size in sizes:
-        data = stream.read(size)
-        try:
-            code, newline = mapping[data].decode_from(stream)
-            output.write(code)
-            return newline
-        except KeyError:
-            stream.seek(start)
-    # If we run out of options, use the encoding.
+def _compile_trie(mapping, allow_zero):
+    # A byte trie of the tags: each node maps the next byte to a child node,
+    # and `None` to the tag ending there (if any). An empty tag is only
+    # matched if it has parameters (i.e., `allow_zero`).
+    root = {}
+    for raw, code in mapping.items():
+        if raw or allow_zero:
+            node = root
+            for byte in raw:
+                node = node.setdefault(byte, {})
+            node[None] = code
+    return root
+
+
+def _tag_start_pattern(trie):
+    # Matches any byte that could start a tag, or None if there are none.
+    starts = sorted(key for key in trie if key is not None)
+    if not starts:
+        return None
+    return re.compile(
+        b'[' + b''.join(b'\\x%02x' % byte for byte in starts) + b']'
+    )
+
+
+def _match_tag(trie, data, position):
+    # The longest tag matching the `data` at `position`, and the position
+    # after it; or None.
+    node = trie
+    result = None if None not in node else (node[None], position)
+    for i in range(position, len(data)):
+        node = node.get(data[i])
+        if node is None:
+            break
+        if None in node:
+            result = node[None], i + 1
+    return result
+
+
+# Decoders that keep state from one character to the next (for byte order
+# marks and shift sequences), or that produce several characters for one
+# sequence, are only used a character at a time, through the StreamReader.
+_STATEFUL_ENCODINGS = {
+    'utf-7', 'utf-8-sig', 'utf-16', 'utf-32', 'hz', 'big5hkscs',
+    'euc_jis_2004', 'euc_jisx0213', 'shift_jis_2004', 'shift_jisx0213'
+}
+
+
+def _decodes_spans(encoding):
+    name = codecs.lookup(encoding).name
+    return name not in _STATEFUL_ENCODINGS and not name.startswith('iso2022')
+
+
+def _read_char(output, stream, reader, position):
+    # Decode a single character using the stream reader, or represent one
+    # byte with a tag if that fails.
+    stream.seek(position)
     try:
-        output.write(reader.read(1))
+        output.append(reader.read(1))
     except UnicodeDecodeError:
         # Consume one byte to make progress, and try again.
-        stream.seek(start)
+        stream.seek(position)
         fallback = stream.read(1)
         reader.reset()
-        output.write(f'[0x{fallback.hex()}]')
-    return False
+        output.append(f'[0x{fallback.hex()}]')
+    return stream.tell()
+
+
+def _read_text(output, view, encoding, position, stop):
+    # Decode the text before the next place a tag could start, in one go.
+    # Decoding stops at an error, where the text must be read a character
+    # at a time (the character may continue past `stop`); returns the
+    # position reached.
+    try:
+        output.append(str(view[position:stop], encoding))
+        return stop
+    except UnicodeDecodeError as e:
+        output.append(str(view[position:position+e.start], encoding))
+        return position + e.start
 
 
-def _decode_gen(data, bound, mapping, encoding):
+def _decode_gen(data, trie, tag_start, encoding):
     stream = BytesIO(data)
+    view = memoryview(data)
     end = len(data)
     reader = codecs.getreader(encoding)(stream)
-    output = StringIO()
-    sizes = range(max(len(k) for k in mapping), bound, -1)
-    while stream.tell() < end:
-        do_newline = _read_single(output, data, mapping, sizes, stream, reader)
-        if do_newline:
-            yield output.getvalue()
-            output.seek(0)
-            output.truncate()
-    yield output.getvalue()
+    spans = _decodes_spans(encoding)
+    output = []
+    position = 0
+    while position < end:
+        tag = _match_tag(trie, data, position)
+        if tag is not None:
+            code, position = tag
+            stream.seek(position)
+            text, newline = code.decode_from(stream)
+            output.append(text)
+            position = stream.tell()
+            if newline:
+                yield ''.join(output)
+                output = []
+            continue
+        # If there is no tag here, use the encoding.
+        if spans:
+            match = None if tag_start is None \
+                else tag_start.search(data, position + 1)
+            stop = end if match is None else match.start()
+            position = _read_text(output, view, encoding, position, stop)
+            if position == stop:
+                continue
+        position = _read_char(output, stream, reader, position)
+    yield ''.join(output)
 
 
 def _process_tag(mapping, tag_name):
@@ -104,8 +179,10 @@ def _encode_gen(line, mapping, encoding):
 
 class Codec:
     def __init__(self, allow_zero, decode_mapping, encode_mapping):
-        self._bound = -1 if allow_zero else 0
-        self._decode_mapping = decode_mapping
+        # Tags are found with a trie when decoding; text in between is
+        # decoded a span at a time, wherever possible.
+        self._decode_trie = _compile_trie(decode_mapping, allow_zero)
+        self._tag_start = _tag_start_pattern(self._decode_trie)
         self._encode_mapping = encode_mapping
 
 
@@ -113,7 +190,7 @@ class Codec:
         return [
             ('', (repr(token),))
             for token in _decode_gen(
-                data, self._bound, self._decode_mapping, encoding
+                data, self._decode_trie, self._tag_start, encoding
             )
         ]
 
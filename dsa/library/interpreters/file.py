@@ -75,3 +75,8 @@ def assemble(codec_lookup, config, lines):
 
 
 alignment = 1
+
+
+# The result of assembly depends on the contents of other files, so it
+# can't be cached.
+cacheable = False
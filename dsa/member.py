@@ -1,7 +1,7 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
-from .errors import SequenceError, UserError
+from .errors import wrap as wrap_errors, SequenceError, UserError
 from .field import member_field_data, numeric_field_maker
 from .parsing.line_parsing import argument_parser, line_parser
 from .parsing.token_parsing import single_parser
@@ -28,6 +28,10 @@ class INVALID_MEMBER_SIZE(UserError):
     """size of data represented by type must be a multiple of 8 bits"""
 
 
+class BAD_TABLE_VALUE(UserError):
+    """couldn't parse `{text}`"""
+
+
 def _extract(value, offset, size):
     # TODO: handle big-endian here.
     # TODO: require that text fields are aligned to a byte boundary?
@@ -35,14 +39,33 @@ def _extract(value, offset, size):
     return (value >> offset) & ((1 << size) - 1)
 
 
+def _text_raw(field, text):
+    raw = field.parse(text)
+    BAD_TABLE_VALUE.require(raw is not None, text=text)
+    return raw
+
+
+def _column_raws(field, column, numeric):
+    # Raw data for a column of a table, with numeric values or else text.
+    # It is converted again a row at a time to report any error.
+    convert = field.raw_value if numeric else partial(_text_raw, field)
+    try:
+        return list(map(convert, column))
+    except UserError:
+        for i, value in enumerate(column, 1):
+            wrap_errors(f'Row #{i}', convert, value)
+        raise
+
+
 class Value:
     def __init__(
-        self, typename, offsets, fields, fixed_mask, fixed_value, size
+        self, typename, offsets, fields, fixed_mask, fixed_value, size, names
     ):
         # 'name' stored at Struct level and injected when needed.
         self._typename = typename
         self.offsets = offsets
         self.fields = fields
+        self.names = names # of the fields.
         self.fixed_mask = fixed_mask
         self.fixed_value = fixed_value
         self._size = size
@@ -80,6 +103,32 @@ class Value:
         )
 
 
+    @property
+    def column_names(self):
+        return self.names
+
+
+    def columns(self, values):
+        # The fixed values were already checked when the data was matched.
+        values = [int.from_bytes(value, 'little') for value in values]
+        return [
+            field.column(
+                [_extract(value, offset, field.size) for value in values]
+            )
+            for offset, field in zip(self.offsets, self.fields)
+        ]
+
+
+    def raws(self, columns, count, numeric):
+        result = [self.fixed_value] * count
+        for offset, field, column in zip(self.offsets, self.fields, columns):
+            raws = _column_raws(field, column, numeric)
+            result = [
+                value | raw << offset for value, raw in zip(result, raws)
+            ]
+        return result
+
+
     def parse(self, items):
         expected = len(self.fields)
         actual = len(items)
@@ -93,11 +142,14 @@ class Value:
 
 
 def _make_value(
-    typename, offsets, fields, fixed_mask, fixed_value, size, member_specs
+    typename, offsets, fields, fixed_mask, fixed_value, size, names,
+    member_specs
 ):
     keys = set(member_specs.keys())
     BAD_SPECS.require(not keys, keys=keys, kind='compound', typename=typename)
-    return Value(typename, offsets, fields, fixed_mask, fixed_value, size)
+    return Value(
+        typename, offsets, fields, fixed_mask, fixed_value, size, names
+    )
 
 
 class ValueLoader:
@@ -112,7 +164,7 @@ class ValueLoader:
 
     def result(self, typename, description_lookup):
         position, fixed_mask, fixed_value = 0, 0, 0
-        offsets, fields = [], []
+        offsets, fields, names = [], [], []
         for name, make_field, fixed, bits in self.field_data:
             field = make_field(description_lookup)
             if fixed is not None:
@@ -124,12 +176,13 @@ class ValueLoader:
             else:
                 offsets.append(position)
                 fields.append(field)
+                names.append(name)
             position += bits
         size, remainder = divmod(position, 8)
         INVALID_MEMBER_SIZE.require(not remainder)
         return partial(
             _make_value,
-            typename, offsets, fields, fixed_mask, fixed_value, size
+            typename, offsets, fields, fixed_mask, fixed_value, size, names
         )
 
 
@@ -163,6 +216,23 @@ class Pointer:
         )
 
 
+    @property
+    def column_names(self):
+        return [None]
+
+
+    def columns(self, values):
+        # Pointers are exported as numbers, like other values.
+        return [self._field.column(
+            [int.from_bytes(value, 'little') for value in values]
+        )]
+
+
+    def raws(self, columns, count, numeric):
+        [column] = columns
+        return _column_raws(self._field, column, numeric)
+
+
     def format(self, value, lookup):
         numeric = int.from_bytes(value, 'little')
         # TODO: avoid repeating this check.
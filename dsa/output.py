@@ -1,8 +1,13 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
+from .binary_listing import encode, is_binary_name
 from .errors import UserError
-from string import printable as printable_chars
+from .compression import compress, compression_for, open_text_output
+from .stdio import write_binary
+from ast import literal_eval
+from string import printable as printable_chars, whitespace
+import re
 
 
 class BAD_TOKEN_PART(UserError):
@@ -22,6 +27,11 @@ _CLEAN = (set(printable_chars) - _SPECIAL).issuperset
 _NEEDS_WRAPPING = {' ', "'", '"', '+'}.intersection
 
 
+def _check_parts(parts):
+    for part in parts:
+        BAD_TOKEN_PART.require(_CLEAN(part), text=part)
+
+
 def _format_token(token, compact):
     if not token:
         # need special handling; wouldn't be detected as needing wrapping
@@ -29,55 +39,197 @@ def _format_token(token, compact):
     first, *rest = token
     if first.startswith(('"', "'", '#')):
         # quoted strings and comments must not be joined or wrapped.
-        assert not rest
+        BAD_TOKEN_PART.require(not rest, text=first)
         return first
     prefix, token = ('@', rest) if first == '@' else ('', token)
-    for part in token:
-        BAD_TOKEN_PART.require(_CLEAN(part), text=part)
+    _check_parts(token)
     joined = (':' if compact else ', ').join(token)
     assert joined == ' '.join(joined.split())
-    return prefix + (f'[{joined}]' if _NEEDS_WRAPPING(joined) else joined)
+    # An empty label name, or a leading '!' (which would be taken as the
+    # line prefix at the start of a line), also needs wrapping.
+    wrap = _NEEDS_WRAPPING(joined) or joined.startswith('!') or \
+        (prefix and not joined)
+    return prefix + (f'[{joined}]' if wrap else joined)
+
+
+# Tokens made only of these characters (and not starting with '!') are
+# written as is. This covers most tokens the disassembler generates
+# (numbers, names and so on), so they can skip the full formatting logic.
+_SAFE = re.compile('(?!!)[{}]+'.format(re.escape(''.join(sorted(
+    set(printable_chars) - _SPECIAL - set(whitespace)
+    - {"'", '"', '+', '@'}
+))))).fullmatch
 
 
 _MAX_LINE_LENGTH = 78
 _CONTINUATION = '\n+   '
 
 
-def _output_line_tokens(outfile, first, rest, position, compact=False):
-    formatted = _format_token(first, compact)
-    outfile.write(formatted) # even if it "doesn't fit"
-    position += len(formatted)
-    for token in rest:
-        formatted = _format_token(token, compact)
-        output = ' ' + formatted
+# Formatted tokens are remembered, up to this many at a time.
+_MEMO_SIZE = 1 << 16
+
+
+# Formatted text is written to the file in pieces of at least this size.
+_BUFFER_SIZE = 1 << 20
+
+
+class _TokenFormatter:
+    """Formats tokens, remembering the results for repeated tokens."""
+    def __init__(self, compact):
+        self._compact = compact
+        self._memo = {}
+
+
+    def _format(self, token):
+        if len(token) == 1 and _SAFE(token[0]):
+            return token[0]
+        return _format_token(token, self._compact)
+
+
+    def __call__(self, token):
+        try:
+            return self._memo[token]
+        except KeyError:
+            pass
+        except TypeError: # unhashable, e.g. a list.
+            return _format_token(token, self._compact)
+        if len(token) == 1 and token[0].startswith(('"', "'", '#')):
+            # Quoted strings and comments are written as is. They are
+            # often unique, so they aren't remembered.
+            return token[0]
+        if len(self._memo) >= _MEMO_SIZE:
+            self._memo.clear()
+        result = self._format(token)
+        self._memo[token] = result
+        return result
+
+
+def _wrapped_line(prefix, formatted):
+    position = len(prefix) + len(formatted[0])
+    result = [prefix, formatted[0]] # the first token "fits" regardless.
+    for text in formatted[1:]:
+        output = ' ' + text
         position += len(output)
         if position > _MAX_LINE_LENGTH:
             # If we line-wrapped a comment onto the next line, just use
             # a full-line comment.
-            prefix = '' if formatted.startswith('#') else _CONTINUATION
-            output = prefix + formatted
+            output = (
+                '' if text.startswith('#') else _CONTINUATION
+            ) + text
             position = len(output)
-        outfile.write(output)
+        result.append(output)
+    return ''.join(result)
 
 
-def _output_line(outfile, prefix, *tokens, compact=False):
+def _line_text(prefix, tokens, formatter):
     assert isinstance(prefix, str) and prefix.strip() in {'+', '!', ''}
-    outfile.write(prefix)
-    if tokens:
-        first, *rest = tokens
-        _output_line_tokens(outfile, first, rest, len(prefix), compact)
-    outfile.write('\n')
-
-
-def output_file(filename, lines, compact=False):
+    if not tokens:
+        return prefix
+    formatted = [formatter(token) for token in tokens]
+    text = ' '.join(formatted)
+    if len(prefix) + len(text) <= _MAX_LINE_LENGTH:
+        return prefix + text
+    return _wrapped_line(prefix, formatted)
+
+
+def output_file(
+    filename, lines, compact=False, compression=None, binary=False,
+    positions=None
+):
     """Write a DSA file (type/structgroup/data definition or path file).
 
-    `filename` -> path to output file
+    `filename` -> path to output file, or `-` for standard output
     `lines` -> iterable of line iterables; each line contains a string
     "prefix" followed by zero or more iterable-of-string "tokens".
     The prefix must either be '+', '!' or whitespace (possibly empty).
     `compact` -> if true, use ':' to join multi-part tokens instead of ', '
+    `compression` -> name of a compression format to use; by default, this
+    is determined by the file name extension (e.g. `.gz`)
+    `binary` -> if true, write a binary listing instead of text (also done
+    if the file name ends with `.dsb`; see `binary_listing`)
+    `positions` -> optional list; for each of the `lines` written as text,
+    (line number, offset in bytes) where it starts is appended, followed
+    by the same for the end of the text
     """
-    with open(filename, 'w', encoding='utf-8') as f:
-        for line in lines:
-            _output_line(f, *line, compact=compact)
+    compression = compression_for(filename, compression)
+    if binary or is_binary_name(filename):
+        data = encode(read_back(lines))
+        write_binary(filename, compress(data, compression))
+        return
+    formatter = _TokenFormatter(compact)
+    with open_text_output(filename, compression) as f:
+        buffer, size = [], 0
+        line_number, offset = 1, 0
+        for prefix, *tokens in lines:
+            text = _line_text(prefix, tokens, formatter)
+            if positions is not None:
+                positions.append((line_number, offset))
+                line_number += text.count('\n') + 1
+                offset += len(text.encode('utf-8')) + 1
+            buffer.append(text)
+            size += len(text) + 1
+            if size >= _BUFFER_SIZE:
+                buffer.append('')
+                f.write('\n'.join(buffer))
+                buffer, size = [], 0
+        if buffer:
+            buffer.append('')
+            f.write('\n'.join(buffer))
+    if positions is not None:
+        positions.append((line_number, offset))
+
+
+def _read_back_tokens(tokens):
+    # The tokens as tokenization would produce them from the formatted
+    # text, validated the same way as when formatting. Comments (and the
+    # rest of the line after them) disappear.
+    for token in tokens:
+        if not token:
+            yield ['']
+            continue
+        first, *rest = token
+        if first.startswith(('"', "'", '#')):
+            BAD_TOKEN_PART.require(not rest, text=first)
+            if first.startswith('#'):
+                return
+            yield [literal_eval(first)]
+            continue
+        _check_parts(rest if first == '@' else token)
+        if first or rest: # a single empty part is written as nothing.
+            yield list(token)
+
+
+def read_back(lines):
+    """Produce the lines that a loader would see when reading a file
+    written by `output_file` from the same `lines`, without actually
+    formatting and tokenizing any text. Yields (line number, prefix,
+    tokens) in the same way as `parsing.file_parsing.process`; line
+    numbers count the input lines, ignoring line wrapping. Tokens that
+    can't be written raise BAD_TOKEN_PART, as they would for text."""
+    for i, (prefix, *tokens) in enumerate(lines, 1):
+        tokens = list(_read_back_tokens(tokens))
+        if prefix == '!' or tokens:
+            yield i, prefix[:1], tokens
+
+
+def _output_token(token):
+    # A token for `output_file` that is read back as the given `token`.
+    if len(token) > 1:
+        return tuple(token)
+    [text] = token
+    if not text:
+        return ()
+    # Other text is quoted if necessary. A quoted token can only have one
+    # part; but parts of multi-part tokens never need quoting.
+    if _SAFE(text):
+        return (text,)
+    return (repr(text),)
+
+
+def as_output(lines):
+    """Produce lines for `output_file` from tokenized `lines`, given as
+    (line number, prefix, tokens) like the output of `process`; i.e., the
+    inverse of `read_back`. The written file (with `compact` output) is
+    tokenized to the same lines again, apart from the line numbers."""
+    for line_number, prefix, tokens in lines:
+        yield (prefix, *map(_output_token, tokens))
@@ -0,0 +1,35 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+import multiprocessing
+
+
+"""Helpers for spreading work across processes."""
+
+
+def can_fork():
+    """Whether worker processes can be started as copies of this one."""
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _pool(jobs, fork):
+    # When forking, workers are copies of this process, so they can use
+    # state that was prepared before calling `ordered_map` (even if it
+    # can't be pickled).
+    return multiprocessing.get_context('fork' if fork else None).Pool(jobs)
+
+
+def ordered_map(func, items, jobs=None, fork=False):
+    """Like `map(func, items)`, but using up to `jobs` worker processes
+    when that is worthwhile. Results are produced in the original order.
+    `func` and each item (as well as the results) must be picklable.
+    `fork` -> if true, workers are forked from this process; check
+    `can_fork` first."""
+    items = list(items)
+    if jobs is None or jobs < 2 or len(items) < 2:
+        yield from map(func, items)
+        return
+    jobs = min(jobs, len(items))
+    chunksize = max(1, len(items) // (jobs * 4))
+    with _pool(jobs, fork) as pool:
+        yield from pool.imap(func, items, chunksize)
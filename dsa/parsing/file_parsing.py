@@ -2,9 +2,14 @@
 # Licensed under the Open Software License version 3.0
 
 from .line_parsing import tokenize
-from ..errors import wrap as wrap_errors, MappingError
+from ..archive import ArchivePath
+from ..binary_listing import BinaryListing, is_binary_listing
+from ..errors import wrap as wrap_errors, MappingError, UserError
+from ..compression import open_binary_input, open_text_input
+from ..parallel import ordered_map
 from ..ui.tracing import my_tracer
-import os.path
+from contextlib import contextmanager
+import io, os.path
 
 
 class DUPLICATE_FILE(MappingError):
@@ -62,20 +67,79 @@ def load_lines(lines, make_loader, *args, **kwargs):
     return loader.result()
 
 
-def load_files(filenames, make_loader, *args, **kwargs):
+def open_source(filename):
+    """Open a text source file, which may be stored in a library archive,
+    be standard input (`-`) or be compressed."""
+    if isinstance(filename, ArchivePath):
+        return filename.open_text()
+    return open_text_input(filename)
+
+
+@contextmanager
+def source_lines(filename):
+    """A context manager giving the tokenized lines of a source file, as
+    produced by `process`. Besides text (as for `open_source`), the file
+    may be a binary listing, whose lines are decoded directly."""
+    if isinstance(filename, ArchivePath):
+        with filename.open_text() as f:
+            yield process(f)
+        return
+    with open_binary_input(filename) as stream:
+        if is_binary_listing(stream):
+            yield BinaryListing(stream.read()).lines()
+            return
+        # The wrapper is detached afterward, rather than closed, in case
+        # the stream is standard input.
+        text = io.TextIOWrapper(stream, encoding='utf-8')
+        try:
+            yield process(text)
+        finally:
+            text.detach()
+
+
+def _tokenize_file(filename):
+    # Runs in a worker process. Tokenization errors are not reported here;
+    # the file is reprocessed normally instead, so that any such error is
+    # reported exactly as it would be otherwise.
+    try:
+        with source_lines(filename) as lines:
+            return list(lines)
+    except UserError:
+        return None
+
+
+def _feed_file(filename, line, tokenized):
+    if tokenized is not None:
+        feed(f'File `{filename}`', line, tokenized)
+        return
+    with source_lines(filename) as lines:
+        feed(f'File `{filename}`', line, lines)
+
+
+def _tokenized_files(filenames, jobs):
+    # Yields (filename, tokenized lines or None) pairs, in order. When a
+    # number of `jobs` is given, files are tokenized in parallel; otherwise,
+    # each file is tokenized as it is fed to a loader.
+    filenames = list(filenames)
+    if jobs is None:
+        return ((filename, None) for filename in filenames)
+    return zip(filenames, ordered_map(_tokenize_file, filenames, jobs))
+
+
+def load_files(filenames, make_loader, *args, jobs=None, **kwargs):
     loader = make_loader(*args, **kwargs)
-    for filename in filenames:
-        with open(filename, encoding='utf-8') as f:
-            feed(f'File `{filename}`', loader.line, process(f))
+    for filename, tokenized in _tokenized_files(filenames, jobs):
+        _feed_file(filename, loader.line, tokenized)
     return loader.result()
 
 
-def load_files_into(result, filenames, make_loader, *args, **kwargs):
-    for filename in filenames:
+def load_files_into(
+    result, filenames, make_loader, *args, jobs=None, **kwargs
+):
+    for filename, tokenized in _tokenized_files(filenames, jobs):
         loader = make_loader(*args, **kwargs)
-        label = os.path.splitext(os.path.basename(filename))[0]
-        with open(filename, encoding='utf-8') as f:
-            feed(f'File `{filename}`', loader.line, process(f))
+        label = os.path.splitext(os.path.basename(str(filename)))[0]
+        _feed_file(filename, loader.line, tokenized)
         DUPLICATE_FILE.add_unique(result, label, loader.result())
 
 
@@ -0,0 +1,48 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .file_parsing import SimpleLoader
+from .line_parsing import line_parser
+from .token_parsing import make_parser, single_parser
+from ..errors import MappingError, UserError
+
+
+class DUPLICATE_INDEXED_LABEL(MappingError):
+    """duplicate entry for label `{key}`"""
+
+
+class META_IN_LABEL_INDEX(UserError):
+    """label index may not contain meta lines"""
+
+
+_parse_entry = line_parser(
+    'label index entry',
+    make_parser(
+        'label', ({'@'}, 'at'), ('string', 'name'), ('[string', 'internal')
+    ),
+    single_parser('location', 'integer'),
+    required=2
+)
+
+
+class LabelLoader(SimpleLoader):
+    """Loads a label index, as written by `dsd --labels`. Each line has
+    a label token (including any internal label name) and its location."""
+    def __init__(self):
+        self._labels = {}
+
+
+    def meta(self, tokens):
+        raise META_IN_LABEL_INDEX()
+
+
+    def unindented(self, tokens):
+        (at, name, internal), location = _parse_entry(tokens)
+        DUPLICATE_INDEXED_LABEL.add_unique(
+            self._labels, (at, name, *internal), location
+        )
+    indented = unindented
+
+
+    def result(self):
+        return self._labels
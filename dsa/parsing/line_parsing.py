@@ -2,7 +2,7 @@
 # Licensed under the Open Software License version 3.0
 
 from ..errors import MappingError, UserError
-from .token_parsing import make_parser, single_parser
+from .token_parsing import generate_function, make_parser, single_parser
 from ast import literal_eval
 from functools import partial
 import re
@@ -130,7 +130,7 @@ def _parse_arguments(dispatch, tokens):
     result = {}
     for token in tokens:
         (name, handler), arguments = dispatch(token)
-        DUPLICATE_PARAMETER.require(name not in result)
+        DUPLICATE_PARAMETER.require(name not in result, key=name)
         result[name] = handler(arguments)
     return result
 
@@ -150,28 +150,36 @@ def argument_parser(**parameters):
     return partial(_parse_arguments, parser)
 
 
-def _extract_gen(more, parsers, line):
-    for parser, token in zip(parsers, line):
-        yield parser(token)
-    if len(parsers) > len(line):
-        for p in parsers[len(line):]:
-            yield p(())
-    if more:
-        # we yield an empty sequence when there isn't an excess.
-        yield line[len(parsers):]
+def _bad_line(description, expected, extracted, actual):
+    raise BAD_LINE(
+        description=description, expected=expected, actual=actual + extracted
+    )
 
 
-def _extract_tokens(description, extracted, required, more, parsers, line):
-    assert required <= len(parsers)
-    actual = len(line) + extracted
+def _compile_line_parser(description, extracted, required, more, parsers):
     low = required + extracted
     high = len(parsers) + extracted
     expected = f'at least {low}' if more else f'exactly {low}' if low == high else f'{low}-{high}'
-    BAD_LINE.require(
-        (actual >= low) and ((actual <= high) or more),
-        description=description, expected=expected, actual=actual
-    )
-    return tuple(_extract_gen(more, parsers, line))
+    namespace = {'_fail': partial(_bad_line, description, expected, extracted)}
+    items = []
+    for i, parser in enumerate(parsers):
+        namespace[f'p{i}'] = parser
+        # Proxy tokens are used for missing optional tokens.
+        item = f'line[{i}]' if i < required else f'(line[{i}] if n > {i} else ())'
+        items.append(f'p{i}({item})')
+    if more:
+        # we produce an empty sequence when there isn't an excess.
+        items.append(f'line[{len(parsers)}:]')
+    conditions = [f'n < {required}'] if required else []
+    if not more:
+        conditions.append(f'n > {len(parsers)}')
+    source = '\n'.join((
+        'def parse(line):',
+        '    n = len(line)',
+        f'    if {" or ".join(conditions)}: _fail(n)' if conditions else '',
+        f'    return ({"".join(item + ", " for item in items)})'
+    ))
+    return generate_function('parse', source, namespace)
 
 
 def line_parser(description, *parsers, extracted=0, required=0, more=False):
@@ -182,6 +190,7 @@ def line_parser(description, *parsers, extracted=0, required=0, more=False):
     more: if true, additional tokens are captured in a tuple
     (otherwise an error is reported for any additional tokens).
     parsers: output contains one item per parser (plus one if `more`)."""
-    return partial(
-        _extract_tokens, description, extracted, required, more, parsers
+    assert required <= len(parsers)
+    return _compile_line_parser(
+        description, extracted, required, more, parsers
     )
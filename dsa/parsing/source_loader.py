@@ -1,11 +1,20 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
-from .file_parsing import SimpleLoader
-from .line_parsing import line_parser
+from .file_parsing import SimpleLoader, feed, process, source_lines
+from .line_parsing import line_parser, tokenize
 from .token_parsing import make_parser, single_parser
-from ..errors import MappingError, UserError
+from ..binary_listing import is_binary_listing
+from ..errors import wrap as wrap_errors, MappingError, UserError
+from ..compression import detect_compression
+from ..parallel import can_fork, ordered_map
+from ..source_map import SOURCE_MAP_UNSUPPORTED
+from ..stdio import is_stdio
 from ..ui.tracing import my_tracer
+from contextlib import redirect_stdout
+from functools import partial
+from io import StringIO
+import mmap, os
 
 
 class UNRECOGNIZED_LABEL(MappingError):
@@ -40,12 +49,25 @@ class DUPLICATE_CHUNK_LOCATION(MappingError):
     """duplicate definition for chunk at 0x{key:X}"""
 
 
+class UNINDEXED_LABEL(MappingError):
+    """label `{key}` is missing from the label index"""
+
+
+class LABEL_INDEX_MISMATCH(UserError):
+    """label `{key}` is at 0x{actual:X}, but the label index has 0x{indexed:X}"""
+
+
+class STALE_LABEL_INDEX(UserError):
+    """label index has labels that are not defined in the source: {keys}"""
+
+
+def _resolve_label(label_lookup, token):
+    return str(UNRECOGNIZED_LABEL.get(label_lookup, tuple(token)))
+
+
 def _resolve_labels(line, label_lookup):
     return [
-        (
-            [str(UNRECOGNIZED_LABEL.get(label_lookup, tuple(token)))]
-            if token[0] == '@' else token
-        )
+        [_resolve_label(label_lookup, token)] if token[0] == '@' else token
         for token in line
     ]
 
@@ -61,7 +83,7 @@ class _DummyInterpreter:
         return b''
 
 
-    def item_size(self, name):
+    def item_size(self, token):
         raise UNNAMED_INTERPRETER(name=self._name)
 
 
@@ -93,6 +115,7 @@ class Chunk:
         self._location = None
         self._filters = [] # (name, tokens) filter specs.
         self._interpreter = None
+        self._interpreter_name = None
         self._chunk_label = None
         self._lines = []
         self._labels = [] # (token for label, position) assuming unfiltered.
@@ -112,21 +135,53 @@ class Chunk:
         return self._labels
 
 
-    def _set_interpreter(self, tokens, interpreter_lookup):
-        UNCLOSED_CHUNK.require(not self.has_interpreter)
-        chunk_label, location, interpreter_info = _chunk_header_parser(tokens)
-        name, *config = interpreter_info
-        self._config = config
+    @property
+    def name(self):
+        return self._chunk_label[1]
+
+
+    @property
+    def location(self):
+        return self._location
+
+
+    def skip_content(self):
+        """Stop keeping struct lines, for a chunk that won't be assembled.
+        Item sizes are still used to locate internal labels."""
+        self._lines = None
+
+
+    def __getstate__(self):
+        # Interpreters (which may be plugin modules) can't be pickled, so
+        # a chunk sent between processes must be rebound by name.
+        state = self.__dict__.copy()
+        state['_interpreter'] = None
+        return state
+
+
+    def rebind(self, interpreter_lookup):
+        name = self._interpreter_name
+        if name is None: # no chunk definition line.
+            return
         interpreter = interpreter_lookup.get(name, None)
         if interpreter is None:
-            interpreter = _DummyInterpreter(chunk_label[1])
+            interpreter = _DummyInterpreter(self._chunk_label[1])
             if name:
                 trace = my_tracer.trace
                 trace(f'Warning: unrecognized interpreter name `{name}`.')
                 trace('This will cause an error later if the chunk has data.')
         self._interpreter = interpreter
-        self._labels.append((chunk_label, location))
+
+
+    def _set_interpreter(self, tokens, interpreter_lookup):
+        UNCLOSED_CHUNK.require(not self.has_interpreter)
+        chunk_label, location, interpreter_info = _chunk_header_parser(tokens)
+        name, *config = interpreter_info
+        self._config = config
         self._chunk_label, self._location = chunk_label, location
+        self._interpreter_name = name
+        self.rebind(interpreter_lookup)
+        self._labels.append((chunk_label, location))
 
 
     def _add_filter(self, tokens):
@@ -151,7 +206,8 @@ class Chunk:
 
 
     def _add_struct(self, tokens):
-        self._lines.append(tokens)
+        if self._lines is not None:
+            self._lines.append(tokens)
         self._offset += self._interpreter.item_size(tokens[0])
 
 
@@ -165,23 +221,99 @@ class Chunk:
             self._add_struct(tokens)
 
 
-    def complete(self, pack_all, label_lookup, codec_lookup):
-        lines = [_resolve_labels(line, label_lookup) for line in self._lines]
-        return self._location, pack_all(
-            codec_lookup,
-            self._interpreter.assemble(
-                codec_lookup, self._config, lines
-            ), self._filters
+    def _reads_files(self):
+        # Whether the interpreter reads other files for these lines (i.e.
+        # structgroups given tables).
+        reads_files = getattr(self._interpreter, 'reads_files', None)
+        return reads_files is not None and reads_files(self._lines)
+
+
+    def _assemble(self, pack_all, codec_lookup, lines, label_lookup):
+        args = (codec_lookup, self._config, lines)
+        if self._reads_files():
+            # Labels used in those files are resolved the same way.
+            args += (partial(_resolve_label, label_lookup),)
+        return pack_all(
+            codec_lookup, self._interpreter.assemble(*args), self._filters
         )
 
 
+    def _resolved(self, label_lookup):
+        return [_resolve_labels(line, label_lookup) for line in self._lines]
+
+
+    def _cacheable(self, memo):
+        # Interpreters that read other files (like the `file` interpreter,
+        # or structgroups given tables) can't be cached, since those files
+        # aren't part of the key.
+        if memo is None or not getattr(self._interpreter, 'cacheable', True):
+            return False
+        return not self._reads_files()
+
+
+    def _memo_parts(self, lines):
+        # The result doesn't depend on the location, so it isn't included.
+        return self._interpreter_name, self._config, self._filters, lines
+
+
+    def is_cached(self, label_lookup, memo):
+        if not self._cacheable(memo):
+            return False
+        try:
+            lines = self._resolved(label_lookup)
+        except UserError: # reported when the chunk is completed.
+            return False
+        return memo.has(*self._memo_parts(lines))
+
+
+    def complete(
+        self, pack_all, label_lookup, codec_lookup, memo=None, assembled=None
+    ):
+        """Assemble the chunk, producing its (location, data).
+        `memo` -> optional Memo of previously assembled chunk data.
+        `assembled` -> data already assembled for this chunk elsewhere
+        (i.e. in a worker process), to store in the memo."""
+        lines = self._resolved(label_lookup)
+        if assembled is None:
+            assemble = partial(
+                self._assemble, pack_all, codec_lookup, lines, label_lookup
+            )
+        else:
+            assemble = partial(bytes, assembled)
+        if not self._cacheable(memo):
+            return self._location, assemble()
+        return self._location, memo.get(assemble, *self._memo_parts(lines))
+
+
 class SourceLoader(SimpleLoader):
-    def __init__(self, interpreter_library, filter_library, codec_library):
+    def __init__(
+        self, interpreter_library, filter_library, codec_library,
+        memo=None, jobs=None, select=None
+    ):
         self._chunks = []
         self._current = None # either None or the last of the self._chunks.
         self._interpreter_lookup = interpreter_library
-        self._pack_all = filter_library.pack_all
+        self._filter_library = filter_library
         self._codec_lookup = codec_library
+        self._memo = memo # optional cache of completed chunks.
+        self._jobs = jobs # worker processes used to complete chunks.
+        # Optional callback, given the name and location of each chunk;
+        # other chunks only define labels, and are not assembled.
+        self._select = select
+
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+
+    def add_chunks(self, chunks):
+        """Add chunks that were parsed separately (e.g. in another process)
+        from a complete, block-aligned section of the source."""
+        assert self._current is None
+        for chunk in chunks:
+            chunk.rebind(self._interpreter_lookup)
+            self._chunks.append(chunk)
 
 
     def _get_labels(self):
@@ -192,15 +324,36 @@ class SourceLoader(SimpleLoader):
         return labels
 
 
+    def _selected(self, chunk):
+        return self._select is None or self._select(chunk.name, chunk.location)
+
+
+    def _finish(self, chunk):
+        # Called when a chunk is closed by a terminator line.
+        # Derived classes may process the chunk immediately.
+        pass
+
+
+    def end_file(self):
+        """Called at the end of each source file. A chunk left open there
+        is finished, as if it had been closed by a terminator line."""
+        if self._current is not None:
+            self.meta([])
+
+
     def meta(self, tokens):
         if self._current is None:
             self._current = Chunk()
             self._chunks.append(self._current)
         if not tokens: # terminator.
             NO_CHUNK_DEFINITION.require(self._current.has_interpreter)
+            self._finish(self._current)
             self._current = None
         else:
-            self._current.add_meta(self._interpreter_lookup, tokens)
+            chunk = self._current
+            chunk.add_meta(self._interpreter_lookup, tokens)
+            if chunk.has_interpreter and not self._selected(chunk):
+                chunk.skip_content()
 
 
     def unindented(self, tokens):
@@ -209,12 +362,346 @@ class SourceLoader(SimpleLoader):
     indented = unindented # alias; handle both cases the same way
 
 
+    def _assembled(self, label_lookup):
+        # Data for chunks assembled by worker processes, by chunk index.
+        # Chunks that are in the memo (or that caused an error) are omitted
+        # and completed normally afterward, so that errors are reported
+        # exactly as they would be without using workers.
+        global _worker_completion
+        jobs = self._jobs
+        if jobs is None or jobs < 2 or not can_fork():
+            return {}
+        pending = [
+            i for i, chunk in enumerate(self._chunks)
+            if self._selected(chunk)
+            and not chunk.is_cached(label_lookup, self._memo)
+        ]
+        if len(pending) < 2:
+            return {}
+        _worker_completion = (
+            self._chunks, self._filter_library.pack_all, label_lookup,
+            self._codec_lookup
+        )
+        try:
+            results = ordered_map(_complete_chunk, pending, jobs, fork=True)
+            return {
+                i: data for i, data in zip(pending, results)
+                if data is not None
+            }
+        finally:
+            _worker_completion = None
+
+
     def result(self):
         processed = {}
         label_lookup = self._get_labels()
-        for chunk in self._chunks:
+        assembled = self._assembled(label_lookup)
+        for i, chunk in enumerate(self._chunks):
+            if not self._selected(chunk):
+                continue
             key, value = chunk.complete(
-                self._pack_all, label_lookup, self._codec_lookup
+                self._filter_library.pack_all, label_lookup,
+                self._codec_lookup, self._memo, assembled.get(i, None)
             )
             DUPLICATE_CHUNK_LOCATION.add_unique(processed, key, value)
         return processed
+
+
+
+class LabelScanner(SourceLoader):
+    """Determines the locations of all labels in a source file, without
+    assembling anything or keeping chunks after they are closed."""
+    def __init__(self, interpreter_library):
+        super().__init__(interpreter_library, None, None)
+        self._labels = {}
+
+
+    def _finish(self, chunk):
+        for token, location in chunk.labels:
+            LABEL_CONFLICT.add_unique(self._labels, token, location)
+        self._chunks.remove(chunk)
+
+
+    def result(self):
+        # A final chunk may be left open at the end of the file.
+        for chunk in list(self._chunks):
+            self._finish(chunk)
+        return self._labels
+
+
+class StreamingSourceLoader(SourceLoader):
+    """Assembles each chunk as soon as it is closed, passing the location
+    and data to `emit`. Labels are resolved using a precomputed index, which
+    is checked against the labels actually defined in the source."""
+    def __init__(
+        self, interpreter_library, filter_library, codec_library,
+        label_index, emit, memo=None, select=None
+    ):
+        super().__init__(
+            interpreter_library, filter_library, codec_library, memo,
+            select=select
+        )
+        self._label_index = label_index
+        self._emit = emit
+        self._defined = set() # label tokens
+        self._locations = set() # of completed chunks
+
+
+    def _check_labels(self, chunk):
+        for token, location in chunk.labels:
+            LABEL_CONFLICT.require(token not in self._defined, key=token)
+            self._defined.add(token)
+            indexed = UNINDEXED_LABEL.get(self._label_index, token)
+            LABEL_INDEX_MISMATCH.require(
+                indexed == location,
+                key=token, actual=location, indexed=indexed
+            )
+
+
+    def _finish(self, chunk):
+        self._check_labels(chunk)
+        self._chunks.remove(chunk)
+        if not self._selected(chunk):
+            return
+        key, value = chunk.complete(
+            self._filter_library.pack_all, self._label_index,
+            self._codec_lookup, self._memo
+        )
+        DUPLICATE_CHUNK_LOCATION.require(key not in self._locations, key=key)
+        self._locations.add(key)
+        self._emit(key, value)
+
+
+    def result(self):
+        for chunk in list(self._chunks):
+            self._finish(chunk)
+        stale = set(self._label_index) - self._defined
+        STALE_LABEL_INDEX.require(not stale, keys=sorted(stale))
+
+
+# Parallel loading of large source files. The file is split into ranges
+# between chunks, each of which is tokenized and parsed in a worker process.
+_MIN_RANGE_SIZE = 1 << 20
+
+
+# Interpreters used by worker processes, which inherit this when forked.
+_worker_interpreters = None
+
+
+# Chunks and completion arguments used by worker processes, likewise.
+_worker_completion = None
+
+
+def _complete_chunk(index):
+    # Runs in a worker process, returning only the assembled data.
+    chunks, pack_all, label_lookup, codec_lookup = _worker_completion
+    try:
+        # Messages about loading codecs will be repeated in the parent
+        # process if it needs them.
+        with redirect_stdout(StringIO()):
+            return chunks[index].complete(
+                pack_all, label_lookup, codec_lookup
+            )[1]
+    except UserError:
+        return None
+
+
+def _split_status(line, terminated):
+    # Returns (whether the source can be split before this line,
+    # whether the source is at the end of a chunk after this line).
+    if b'\r' in line.rstrip(b'\r\n'):
+        # This might be several lines; never split near it.
+        return False, False
+    try:
+        prefix, tokens = tokenize(line.decode('utf-8'))
+    except (UserError, UnicodeDecodeError):
+        return False, False
+    if prefix == '+': # continues the previous line.
+        return False, terminated and not tokens
+    if prefix == '!' or tokens:
+        return terminated, prefix == '!' and not tokens
+    return False, terminated # blank lines are ignored.
+
+
+def _split_point(mapped, position):
+    # The start of the first line after `position` that begins a new chunk
+    # (following a terminator line), or the end of the file.
+    newline = mapped.find(b'\n', position - 1)
+    if newline == -1:
+        return len(mapped)
+    mapped.seek(newline + 1)
+    terminated = False
+    while True:
+        start = mapped.tell()
+        line = mapped.readline()
+        if not line:
+            return start
+        split, terminated = _split_status(line, terminated)
+        if split:
+            return start
+
+
+def _source_ranges(mapped, count):
+    size = len(mapped)
+    starts = [0]
+    for i in range(1, count):
+        start = _split_point(mapped, max(size * i // count, starts[-1] + 1))
+        if start >= size:
+            break
+        starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _parse_range(args):
+    # Runs in a worker process. As with definition files, errors are not
+    # reported here; the source is reloaded normally instead.
+    filename, start, end = args
+    loader = SourceLoader(_worker_interpreters, None, None)
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode('utf-8')
+        # Messages about loading interpreters will be repeated in the
+        # parent process as chunks are rebound.
+        with redirect_stdout(StringIO()):
+            for position, indent, line_tokens in process(
+                StringIO(text, newline=None)
+            ):
+                loader.line(indent, line_tokens)
+            loader.end_file()
+    except (UserError, UnicodeDecodeError):
+        return None
+    return loader.chunks
+
+
+def _file_ranges(filename, jobs):
+    # Large files are split into several ranges; others are parsed whole.
+    size = os.path.getsize(filename)
+    count = min(jobs * 4, size // _MIN_RANGE_SIZE)
+    if count < 2:
+        return [(0, size)]
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _source_ranges(mapped, count)
+
+
+def _splittable(filename):
+    # Whether the file can be read in ranges, by position. Binary listings
+    # are not split, since decoding them is faster than sending the parsed
+    # chunks back from worker processes.
+    if is_stdio(filename) or not os.path.isfile(filename):
+        return False
+    with open(filename, 'rb') as f:
+        name, stream = detect_compression(f)
+        return name is None and not is_binary_listing(stream)
+
+
+def _parsed_sources(filenames, interpreter_library, jobs):
+    # Returns a list with either the parsed Chunks for each source file,
+    # or None if that file should be loaded normally instead.
+    global _worker_interpreters
+    if jobs is None or jobs < 2 or not can_fork():
+        return [None] * len(filenames)
+    ranges = [
+        [(filename, *r) for r in _file_ranges(filename, jobs)]
+        if _splittable(filename) else []
+        for filename in filenames
+    ]
+    work = [r for file_ranges in ranges for r in file_ranges]
+    if len(work) < 2:
+        return [None] * len(filenames)
+    _worker_interpreters = interpreter_library
+    try:
+        results = iter(list(ordered_map(_parse_range, work, jobs, fork=True)))
+    finally:
+        _worker_interpreters = None
+    parsed = []
+    for file_ranges in ranges:
+        chunks = [next(results) for r in file_ranges]
+        parsed.append(
+            None if not chunks or None in chunks
+            else [chunk for c in chunks for chunk in c]
+        )
+    return parsed
+
+
+def _load_into(loader, filename, chunks):
+    if chunks is None:
+        with source_lines(filename) as lines:
+            feed(f'File `{filename}`', loader.line, lines)
+    else:
+        my_tracer.trace(f'Loading: File `{filename}`')
+        loader.add_chunks(chunks)
+    wrap_errors(f'File `{filename}`', loader.end_file)
+
+
+def load_sources(filenames, make_loader, *args, **kwargs):
+    """Load the source files `filenames` in order, into a single loader.
+    Labels may refer to chunks in any of the files, but a chunk can't
+    continue from one file into the next."""
+    loader = make_loader(*args, **kwargs)
+    for filename in filenames:
+        _load_into(loader, filename, None)
+    return loader.result()
+
+
+def load_blocks(loader, filename, source_map, select):
+    """Load only the blocks of the source file `filename` for chunks chosen
+    by `select` (given each chunk's name and location) into the `loader`,
+    finding and reading each directly using the `source_map` (see
+    `dsa.source_map`). The other blocks are never read, so the loader must
+    get its labels elsewhere (i.e. from a label index)."""
+    SOURCE_MAP_UNSUPPORTED.require(_splittable(filename))
+    name = f'File `{filename}`'
+    my_tracer.trace(f'Loading: {name} (selected blocks)')
+    indices = [
+        i for i, label in enumerate(source_map.labels)
+        if select(label, source_map.block(i)[0])
+    ]
+    for first, text in source_map.read_blocks(filename, indices):
+        # Line numbers are given as they are in the whole file.
+        for position, indent, tokens in process(StringIO(text, newline=None)):
+            wrap_errors(
+                f'{name}: Line {position + first - 1}',
+                loader.line, indent, tokens
+            )
+        wrap_errors(name, loader.end_file)
+
+
+def load_source(
+    filenames, interpreter_library, filter_library, codec_library,
+    memo=None, jobs=None, select=None
+):
+    """Assemble the source files `filenames` together, producing a dict
+    mapping binary locations to assembled chunk data.
+    `memo` -> optional Memo of previously assembled chunk data.
+    `jobs` -> if specified, the source files are tokenized and parsed in
+    that many worker processes (large files are split into ranges of whole
+    chunks); chunks are also assembled in worker processes.
+    `select` -> optional callback, given the name and location of each
+    chunk, choosing which chunks to assemble; the rest are only used
+    for their labels."""
+    filenames = list(filenames)
+    loader = SourceLoader(
+        interpreter_library, filter_library, codec_library, memo, jobs,
+        select
+    )
+    parsed = _parsed_sources(filenames, interpreter_library, jobs)
+    for filename, chunks in zip(filenames, parsed):
+        _load_into(loader, filename, chunks)
+    return loader.result()
+
+
+def assemble_lines(
+    description, lines, interpreter_library, filter_library, codec_library,
+    jobs=None
+):
+    """Assemble already-tokenized source `lines`, given as (line number,
+    prefix, tokens) like the output of `file_parsing.process`. Errors are
+    reported using the `description` in place of a file name."""
+    loader = SourceLoader(
+        interpreter_library, filter_library, codec_library, None, jobs
+    )
+    feed(description, loader.line, lines)
+    wrap_errors(description, loader.end_file)
+    return loader.result()
@@ -38,21 +38,9 @@ class BAD_ENCODING_NAME(UserError):
     """{description} `{name}` is not a valid string encoding"""
 
 
-# Helper functions that read token parts from the iterator and
-# yield parsed token parts. The `description` is partial'd on.
-# Any uncaught StopIteration here is a bug; the token parts have been
-# counted ahead of time and should be exactly sufficient.
-def _string(description, it):
-    return next(it)
-
-
-def _optional_string(description, it):
-    try:
-        return next(it)
-    except StopIteration:
-        return None
-
-
+# Helper functions that convert a single token part. The `description` is
+# partial'd on. When an optional part is missing, the converter is instead
+# passed the default value that was specified along with it.
 def _int_helper(error, description, token):
     # FIXME UserError.convert can't do this.
     try:
@@ -61,21 +49,15 @@ def _int_helper(error, description, token):
         raise error(token=token, description=description) from e
 
 
-def _integer(description, it):
-    token = next(it)
+def _integer(description, token):
     return _int_helper(BAD_INTEGER, description, token)
 
 
-def _optional_integer(description, it):
-    try:
-        token = next(it)
-    except StopIteration:
-        token = ''
+def _optional_integer(description, token):
     return None if token == '' else _int_helper(BAD_INTEGER, description, token)
 
 
-def _positive_integer(description, it):
-    token = next(it)
+def _positive_integer(description, token):
     result = _int_helper(BAD_POSITIVE_INTEGER, description, token)
     BAD_POSITIVE_INTEGER.require(
         result > 0, token=token, description=description
@@ -83,8 +65,7 @@ def _positive_integer(description, it):
     return result
 
 
-def _multiple_of_8(description, it):
-    token = next(it)
+def _multiple_of_8(description, token):
     result = _int_helper(BAD_FIELD_SIZE, description, token)
     BAD_FIELD_SIZE.require(
         result % 8 == 0, token=token, description=description
@@ -92,108 +73,146 @@ def _multiple_of_8(description, it):
     return result
 
 
-def _whitelisted_string(whitelist, description, it):
-    try:
-        token = next(it)
-    except StopIteration:
-        # This should only happen when the value is optional,
-        # indicated by `None` being in the whitelist.
-        token = None
-    # Handle None separately when formatting any potential error.
-    allowed = set(whitelist.keys())
-    if None in allowed:
-        allowed.discard(None)
-        error = ILLEGAL_OPTIONAL_VALUE
-    else:
-        error = ILLEGAL_VALUE
+def _whitelisted_string(whitelist, error, allowed, description, token):
+    # A missing token is passed as None, which is only valid when the
+    # value is optional, indicated by `None` being in the whitelist.
     return error.get(whitelist, token, allowed=allowed, description=description)
 
 
-def _hexdump(description, it):
+def _hexdump(description, token):
     try:
-        return binascii.unhexlify(''.join(next(it).split()))
+        return binascii.unhexlify(''.join(token.split()))
     except binascii.Error as e:
         raise INVALID_HEXDUMP(description=description) from e
 
 
-def _encoding(description, it):
-    name = next(it)
+def _encoding(description, name):
     try:
         return codecs.lookup(name)
-    except LookupError:
+    except LookupError as e:
         raise BAD_ENCODING_NAME(description=description, name=name) from e
 
 
-def _make_set(converter, it):
-    return set(converter(iter((i,))) for i in it)
-
-
-def _make_seq(converter, it):
-    return tuple(converter(iter((i,))) for i in it)
+# Helper functions that convert all the remaining parts of a token.
+def _make_set(converter, parts):
+    return set(parts) if converter is None else set(map(converter, parts))
 
 
-# Main parsing machinery.
-def _check(low, high, name, token):
-    actual = len(token)
-    allowed = f'at least {low}' if high is None else f'{low}-{high}'
-    WRONG_PART_COUNT.require(
-        actual >= low,
-        description=name, actual=actual, allowed=allowed
-    )
-    WRONG_PART_COUNT.require(
-        high is None or actual <= high,
-        description=name, actual=actual, allowed=allowed
-    )
+def _make_seq(converter, parts):
+    return tuple(parts) if converter is None else tuple(map(converter, parts))
 
 
-def _extract(converters, low, high, name, token):
-    _check(low, high, name, token)
-    it = iter(token) # must create ahead of time, so that it's reused
-    # (the iterator tracks the state of parsing through the token)
-    return tuple(converter(it) for converter in converters)
+def _whitelist(spec, description):
+    # Handle None separately when formatting any potential error.
+    allowed = set(spec.keys())
+    if None in allowed:
+        allowed.discard(None)
+        error = ILLEGAL_OPTIONAL_VALUE
+    else:
+        error = ILLEGAL_VALUE
+    return partial(_whitelisted_string, spec, error, allowed, description)
 
 
-# Separate logic isn't strictly necessary, but it's simpler and faster.
-def _extract_one(converter, low, high, name, token):
-    _check(low, high, name, token)
-    return converter(iter(token))
+_SIMPLE_SPECS = {
+    # spec: (converter, low, high, default)
+    # A converter of `None` means the part is used as-is.
+    'string': (None, 1, 1, None),
+    'string?': (None, 0, 1, None),
+    'integer': (_integer, 1, 1, None),
+    'integer?': (_optional_integer, 0, 1, ''),
+    'positive': (_positive_integer, 1, 1, None),
+    'fieldsize': (_multiple_of_8, 1, 1, None),
+    'hexdump': (_hexdump, 1, 1, None),
+    'encoding': (_encoding, 1, 1, None)
+}
 
 
 def _make_converter(spec, description):
+    # Returns (converter, low, high, default). When `high` is None, the
+    # converter is given all remaining parts of the token as a sequence.
     if isinstance(spec, (tuple, list, set)):
-        return partial(
-            _whitelisted_string, {x:x for x in spec}, description
-        ), 1, 1
+        return _whitelist({x:x for x in spec}, description), 1, 1, None
     if isinstance(spec, dict):
-        return partial(
-            _whitelisted_string, spec, description
-        ), 0 if None in spec else 1, 1
+        return _whitelist(spec, description), 0 if None in spec else 1, 1, None
     if spec.startswith('{'):
         return partial(
             _make_set, _make_converter(spec[1:], description)[0]
-        ), 0, None
+        ), 0, None, None
     if spec.startswith('['):
         return partial(
             _make_seq, _make_converter(spec[1:], description)[0]
-        ), 0, None
-    func, low, high = {
-        'string': (_string, 1, 1),
-        'string?': (_optional_string, 0, 1),
-        'integer': (_integer, 1, 1),
-        'integer?': (_optional_integer, 0, 1),
-        'positive': (_positive_integer, 1, 1),
-        'fieldsize': (_multiple_of_8, 1, 1),
-        'hexdump': (_hexdump, 1, 1),
-        'encoding': (_encoding, 1, 1)
-    }[spec]
-    return partial(func, description), low, high
+        ), 0, None, None
+    func, low, high, default = _SIMPLE_SPECS[spec]
+    return (
+        None if func is None else partial(func, description)
+    ), low, high, default
+
+
+# Main parsing machinery. Each parser is compiled into a specialized function
+# that checks the number of parts (or tokens) and then converts each in turn
+# with a single expression, avoiding per-call iterator and dispatch overhead.
+# Parsers are also created on the fly (e.g. for filter parameters), so the
+# compiled code is reused for every parser with the same structure.
+_compiled = {}
+
+
+def generate_function(name, source, namespace):
+    """Compile `source` (the definition of a function called `name`)
+    in the given `namespace`, and return the function."""
+    try:
+        code = _compiled[source]
+    except KeyError:
+        code = compile(source, f'<generated {name}>', 'exec')
+        _compiled[source] = code
+    exec(code, namespace)
+    return namespace[name]
+
+
+def _count_check(actual, low, high):
+    # Source for a condition that is true when the count is invalid;
+    # trivially-false conditions are omitted.
+    conditions = []
+    if low > 0:
+        conditions.append(f'{actual} < {low}')
+    if high is not None:
+        conditions.append(f'{actual} > {high}')
+    return ' or '.join(conditions)
+
+
+def _wrong_part_count(name, allowed, actual):
+    raise WRONG_PART_COUNT(description=name, actual=actual, allowed=allowed)
+
+
+def _compile_parser(name, converters, low, high, single):
+    allowed = f'at least {low}' if high is None else f'{low}-{high}'
+    namespace = {'_fail': partial(_wrong_part_count, name, allowed)}
+    items = []
+    for i, (converter, part_low, part_high, default) in enumerate(converters):
+        namespace[f'c{i}'], namespace[f'd{i}'] = converter, default
+        if part_high is None: # takes all remaining parts.
+            item = f'token[{i}:]'
+        elif part_low: # the part is guaranteed to exist.
+            item = f'token[{i}]'
+        else:
+            item = f'(token[{i}] if n > {i} else d{i})'
+        items.append(item if converter is None else f'c{i}({item})')
+    result = items[0] if single else f'({", ".join(items)},)'
+    check = _count_check('n', low, high)
+    source = '\n'.join((
+        'def parse(token):',
+        '    n = len(token)',
+        f'    if {check}: _fail(n)' if check else '',
+        f'    return {result}'
+    ))
+    return generate_function('parse', source, namespace)
 
 
 def make_parser(name, *specs):
-    converters, lows, highs = zip(*(
+    converters = [
         _make_converter(spec, description)
         for spec, description in specs
-    ))
+    ]
+    lows, highs = [c[1] for c in converters], [c[2] for c in converters]
     low = sum(lows)
     if None in highs: # it must be unique, and the last element.
         assert highs[-1] is None
@@ -201,9 +220,9 @@ def make_parser(name, *specs):
         high = None
     else:
         high = sum(highs)
-    return partial(_extract, converters, low, high, name)
+    return _compile_parser(name, converters, low, high, False)
 
 
 def single_parser(name, spec):
-    converter, low, high = _make_converter(spec, name)
-    return partial(_extract_one, converter, low, high, name)
+    converter = _make_converter(spec, name)
+    return _compile_parser(name, [converter], converter[1], converter[2], True)
@@ -1,9 +1,13 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
+from .archive import ArchiveModuleLoader, ArchivePath
 from .errors import wrap as wrap_errors, UserError
+from .lazy import LazyLookup
 from .ui.tracing import my_tracer
-from importlib.util import spec_from_file_location, module_from_spec
+from importlib.util import module_from_spec
+from importlib.util import spec_from_file_location, spec_from_loader
+from functools import partial
 import os
 
 
@@ -75,9 +79,12 @@ def _test(parent, name, children):
 
 
 def _module_from_path(path):
-    folder, filename = os.path.split(path)
-    basename, extension = os.path.splitext(filename)
-    spec = spec_from_file_location(basename, path)
+    basename = plugin_name(path)
+    spec = (
+        spec_from_loader(basename, ArchiveModuleLoader(path), origin=str(path))
+        if isinstance(path, ArchivePath)
+        else spec_from_file_location(basename, path)
+    )
     module = module_from_spec(spec)
     spec.loader.exec_module(module)
     assert module.__name__ == basename
@@ -97,3 +104,26 @@ def load_plugins(paths, checklist):
         wrap_errors(f'File `{path}`', _load_plugin, path, checklist)
         for path in paths
     )
+
+
+def _load_plugin_module(path, checklist):
+    return wrap_errors(f'File `{path}`', _load_plugin, path, checklist)[1]
+
+
+def plugin_name(path):
+    return os.path.splitext(os.path.basename(str(path)))[0]
+
+
+def plugin_loaders(paths, checklist):
+    """Index plugins by file name (which is also the name of the loaded
+    module), mapping to a loader function that imports and checks it."""
+    return {
+        plugin_name(path): partial(_load_plugin_module, path, checklist)
+        for path in paths
+    }
+
+
+def lazy_plugins(paths, checklist):
+    """Like `load_plugins`, but each module is only imported (and checked)
+    when it is first looked up."""
+    return LazyLookup(plugin_loaders(paths, checklist))
@@ -0,0 +1,54 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .errors import UserError
+import re
+
+
+"""Choosing a subset of chunks to assemble, for `dsa --only`."""
+
+
+class BAD_RANGE(UserError):
+    """invalid address range `{text}` (should be `START-END`)"""
+
+
+class SEEK_UNSUPPORTED(UserError):
+    """`--source-map` needs `--only`, `--labels` and a single listing file"""
+
+
+_RANGE = re.compile(r'(\w+)\s*-\s*(\w+)')
+
+
+def _parse_range(text):
+    match = _RANGE.fullmatch(text.strip())
+    if match is None:
+        return None
+    try:
+        start, end = (int(n, 0) for n in match.groups())
+    except ValueError:
+        return None
+    BAD_RANGE.require(start < end, text=text)
+    return start, end
+
+
+class Selection:
+    """Chunks selected by label name, or by location within an address
+    range (including the start but not the end)."""
+    def __init__(self, specs):
+        """`specs` -> label names or address ranges, like `text 2` or
+        `0x1000-0x2000`. Text that doesn't parse as a range is a label."""
+        self._labels, self._ranges = set(), []
+        for spec in specs:
+            bounds = _parse_range(spec)
+            if bounds is None:
+                self._labels.add(spec)
+            else:
+                self._ranges.append(bounds)
+
+
+    def __call__(self, label, location):
+        """Whether the chunk with the given `label` name and `location` is
+        selected."""
+        return label in self._labels or any(
+            start <= location < end for start, end in self._ranges
+        )
@@ -0,0 +1,187 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .binary_listing import EXTENSION as BINARY_EXTENSION
+from .compression import extension_for
+from .errors import MappingError, UserError
+from .output import output_file
+from .parallel import can_fork, ordered_map
+from pathlib import Path
+import re, toml
+
+
+"""Listings split into several files (shards), described by a manifest."""
+
+
+class UNKNOWN_SHARDING(MappingError):
+    """unknown way to shard a listing `{key}` (use one of: {choices})"""
+
+
+class BAD_MANIFEST(UserError):
+    """`{filename}` is not a valid shard manifest ({reason})"""
+
+
+MANIFEST_NAME = 'manifest.toml'
+
+
+# Blocks for chunks within each range of this many bytes of the binary
+# are grouped together when sharding by range.
+_SHARD_RANGE = 1 << 16
+
+
+# Shards have at least this many lines (except the last) when sharding by
+# size. A block is never split between shards.
+_SHARD_LINES = 1 << 16
+
+
+def _label_group(label):
+    # Labels generated for chunks found the same way differ only by a
+    # numeric suffix; see `Disassembler._make_label`.
+    return re.sub(r' \d+$', '', label)
+
+
+def _by_label(blocks):
+    groups = {}
+    for block in blocks:
+        location, label, lines, count = block
+        groups.setdefault(_label_group(label), []).append(block)
+    return list(groups.items())
+
+
+def _by_range(blocks):
+    groups = {}
+    for block in blocks:
+        location, label, lines, count = block
+        start = location - location % _SHARD_RANGE
+        groups.setdefault(f'{start:08X}', []).append(block)
+    return list(groups.items())
+
+
+def _by_size(blocks):
+    groups, current, total = [], [], 0
+    for block in blocks:
+        location, label, lines, count = block
+        current.append(block)
+        total += count
+        if total >= _SHARD_LINES:
+            groups.append(current)
+            current, total = [], 0
+    if current:
+        groups.append(current)
+    return [(None, group) for group in groups]
+
+
+_GROUPERS = {'label': _by_label, 'range': _by_range, 'size': _by_size}
+
+
+SHARDINGS = tuple(_GROUPERS)
+
+
+def _shard_name(index, name, compression, binary):
+    # The index keeps the files in order and unique; the name is only
+    # descriptive, so any awkward characters are replaced.
+    name = '' if name is None else '-' + re.sub(r'[^\w.-]+', '_', name)
+    extension = BINARY_EXTENSION if binary else '.txt'
+    return f'{index:04}{name}{extension}{extension_for(compression)}'
+
+
+# Shards to write, used by worker processes, which inherit this when forked.
+_worker_shards = None
+
+
+def _shard_lines(blocks):
+    for location, label, lines, count in blocks:
+        yield from lines()
+
+
+def _write_shard(index):
+    # Runs in a worker process. As elsewhere, errors are not reported here;
+    # the shard is written again by the parent process instead.
+    directory, shards, compression, binary = _worker_shards
+    filename, blocks = shards[index]
+    try:
+        output_file(
+            directory / filename, _shard_lines(blocks), False, compression,
+            binary
+        )
+    except UserError:
+        return False
+    return True
+
+
+def write_shards(
+    directory, blocks, sharding, compression=None, jobs=None, binary=False
+):
+    """Write listing `blocks` to separate files in the `directory`, grouped
+    according to the `sharding` method, along with a manifest.
+    `blocks` -> sequence of (location, label, lines, count) for each block,
+    where `lines` is a callable producing the lines of the block, and
+    `count` is the number of lines.
+    `compression` -> optional compression format for the shard files.
+    `binary` -> if true, the shard files are binary listings.
+    `jobs` -> if specified, shards are written by that many processes."""
+    global _worker_shards
+    grouper = UNKNOWN_SHARDING.get(
+        _GROUPERS, sharding, choices=', '.join(SHARDINGS)
+    )
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    shards = [
+        (_shard_name(i, name, compression, binary), group)
+        for i, (name, group) in enumerate(grouper(blocks))
+    ]
+    written = [False] * len(shards)
+    if jobs is not None and jobs > 1 and can_fork():
+        _worker_shards = (directory, shards, compression, binary)
+        try:
+            written = list(ordered_map(
+                _write_shard, range(len(shards)), jobs, fork=True
+            ))
+        finally:
+            _worker_shards = None
+    for (filename, group), done in zip(shards, written):
+        if not done:
+            output_file(
+                directory / filename, _shard_lines(group), False,
+                compression, binary
+            )
+    manifest = {
+        'sharding': sharding,
+        'shard': [
+            {'file': filename, 'first': group[0][0], 'blocks': len(group)}
+            for filename, group in shards
+        ]
+    }
+    with open(directory / MANIFEST_NAME, 'w') as f:
+        toml.dump(manifest, f)
+
+
+def _manifest_path(source):
+    path = Path(source)
+    if path.is_dir():
+        return path / MANIFEST_NAME
+    return path if path.suffix == '.toml' else None
+
+
+def _shard_files(manifest):
+    try:
+        with open(manifest) as f:
+            shards = toml.load(f)['shard']
+        return [manifest.parent / shard['file'] for shard in shards]
+    except toml.TomlDecodeError as e:
+        raise BAD_MANIFEST(filename=manifest, reason=str(e))
+    except (KeyError, TypeError) as e:
+        raise BAD_MANIFEST(filename=manifest, reason=f'missing {e}')
+
+
+def expand_manifests(sources):
+    """Replace each source that is a shard manifest (or a directory that
+    contains one) with the shard files it lists, in order."""
+    result = []
+    for source in sources:
+        manifest = _manifest_path(source)
+        if manifest is None:
+            result.append(source)
+        else:
+            result.extend(_shard_files(manifest))
+    return result
@@ -0,0 +1,219 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .errors import UserError
+from array import array
+from bisect import bisect_left, bisect_right
+import sys
+
+
+"""Source maps, linking the lines of a listing to locations in the binary.
+
+A source map is a sidecar file written by `dsd --source-map`. It records,
+for each block of the listing, the location and size of the chunk in the
+binary and the range of the listing file (in bytes) holding the block;
+for each struct line, the location and size of the struct; and for each
+line, where it starts in the listing file. Lookups use binary search, so
+tooling can go from an address to a line, or read a single block of a
+large listing, without scanning the listing.
+
+The file has the magic bytes `DSAM`, a version number byte, then four
+sections: block labels (UTF-8, one per line), then the tables of lines
+(line number, file offset), blocks (location, size, line number of the
+chunk header, file offsets where the block starts and ends) and structs
+(location, size, line number, file offset). Each section starts with its
+size as an unsigned 64-bit little-endian number, as do all table values.
+"""
+
+
+class BAD_SOURCE_MAP(UserError):
+    """`{filename}` is not a valid source map ({reason})"""
+
+
+class SOURCE_MAP_UNSUPPORTED(UserError):
+    """a source map needs a single, uncompressed text listing file"""
+
+
+_MAGIC = b'DSAM'
+
+
+_VERSION = 1
+
+
+_LINE, _BLOCK, _STRUCT = 2, 5, 4 # table entry sizes, in numbers.
+
+
+def _table(values):
+    result = array('Q', values)
+    if sys.byteorder == 'big':
+        result.byteswap()
+    return result.tobytes()
+
+
+def _untable(data, width):
+    result = array('Q')
+    result.frombytes(data)
+    if sys.byteorder == 'big':
+        result.byteswap()
+    values = result.tolist()
+    return [
+        tuple(values[i:i+width]) for i in range(0, len(values), width)
+    ]
+
+
+def _section(data):
+    return len(data).to_bytes(8, 'little') + data
+
+
+class SourceMap:
+    def __init__(self, labels, lines, blocks, structs):
+        """`labels` -> the label of each block's chunk.
+        `lines` -> (line number, file offset) for each line of the listing
+        (wrapped lines count as one), in order.
+        `blocks` -> (location, size, line number, start, end) for each
+        block, in order of location; `start` and `end` are file offsets.
+        `structs` -> (location, size, line number, file offset) for each
+        struct line, in any order."""
+        self._labels = labels
+        self._lines, self._blocks = lines, blocks
+        self._structs = sorted(structs)
+        self._line_numbers = [line[0] for line in lines]
+        self._line_offsets = [line[1] for line in lines]
+        self._block_starts = [block[0] for block in blocks]
+        self._struct_starts = [struct[0] for struct in self._structs]
+
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        BAD_SOURCE_MAP.require(
+            data[:len(_MAGIC) + 1] == _MAGIC + bytes((_VERSION,)),
+            filename=filename, reason='bad header or version'
+        )
+        position, sections = len(_MAGIC) + 1, []
+        for _ in range(4):
+            size = int.from_bytes(data[position:position+8], 'little')
+            position += 8
+            sections.append(data[position:position+size])
+            position += size
+        labels, lines, blocks, structs = sections
+        BAD_SOURCE_MAP.require(
+            position == len(data) and all(
+                len(table) % (width * 8) == 0 for table, width in
+                ((lines, _LINE), (blocks, _BLOCK), (structs, _STRUCT))
+            ),
+            filename=filename, reason='wrong size'
+        )
+        return SourceMap(
+            labels.decode('utf-8').split('\n') if labels else [],
+            _untable(lines, _LINE), _untable(blocks, _BLOCK),
+            _untable(structs, _STRUCT)
+        )
+
+
+    def write(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(_MAGIC + bytes((_VERSION,)))
+            f.write(_section('\n'.join(self._labels).encode('utf-8')))
+            for table in (self._lines, self._blocks, self._structs):
+                f.write(_section(_table(v for row in table for v in row)))
+
+
+    def __len__(self):
+        """The number of blocks in the listing."""
+        return len(self._blocks)
+
+
+    @property
+    def labels(self):
+        return self._labels
+
+
+    def block(self, index):
+        """(location, size, line number, start, end) for the block with the
+        given `index` (in order of location)."""
+        return self._blocks[index]
+
+
+    def _containing(self, starts, items, address):
+        i = bisect_right(starts, address) - 1
+        if i < 0:
+            return None
+        location, size = items[i][:2]
+        return i if address < location + size else None
+
+
+    def block_for(self, address):
+        """The index of the block for the chunk containing the `address`,
+        or None if there isn't one."""
+        return self._containing(self._block_starts, self._blocks, address)
+
+
+    def blocks_between(self, start, end):
+        """Indices of blocks for chunks that overlap the range of addresses
+        from `start` to `end` (chunks are assumed not to overlap)."""
+        first = max(bisect_right(self._block_starts, start) - 1, 0)
+        last = bisect_left(self._block_starts, end)
+        return [
+            i for i in range(first, last)
+            if self._blocks[i][0] >= start or sum(self._blocks[i][:2]) > start
+        ]
+
+
+    def line_for(self, address):
+        """The number of the listing line that describes the `address`: the
+        line for the struct containing it if possible, or else the header
+        line for the chunk. Returns None if neither is found."""
+        i = self._containing(self._struct_starts, self._structs, address)
+        if i is not None:
+            return self._structs[i][2]
+        i = self.block_for(address)
+        return None if i is None else self._blocks[i][2]
+
+
+    def offset_for(self, line_number):
+        """The file offset where the given line starts (for a continuation
+        line, where the wrapped line starts)."""
+        i = bisect_right(self._line_numbers, line_number) - 1
+        return self._lines[max(i, 0)][1]
+
+
+    def read_blocks(self, listing, indices):
+        """Read the text of the blocks with the given `indices` from the
+        `listing` file, producing (number of the block's first line, text)
+        for each."""
+        with open(listing, 'rb') as f:
+            for index in indices:
+                location, size, line, start, end = self._blocks[index]
+                first = self._lines[bisect_left(self._line_offsets, start)]
+                f.seek(start)
+                yield first[0], f.read(end - start).decode('utf-8')
+
+
+    def read_block(self, listing, index):
+        """Read the text of a single block from the `listing` file."""
+        [(first, text)] = self.read_blocks(listing, [index])
+        return text
+
+
+def build_source_map(positions, chunks):
+    """Create a SourceMap for a listing.
+    `positions` -> (line number, file offset) for each line written, and
+    then for the end of the file (as from `output_file`).
+    `chunks` -> (location, label, size, header, spans) for each chunk, in
+    order, where `header` is the index of the chunk header among its
+    lines, and `spans` gives (location, size) or None for each line."""
+    labels, blocks, structs, i = [], [], [], 0
+    for location, label, size, header, spans in chunks:
+        first = i
+        for span in spans:
+            if span is not None:
+                structs.append((*span, *positions[i]))
+            i += 1
+        labels.append(label)
+        blocks.append((
+            location, size, positions[first + header][0],
+            positions[first][1], positions[i][1]
+        ))
+    return SourceMap(labels, positions[:-1], blocks, structs)
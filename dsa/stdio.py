@@ -0,0 +1,72 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .errors import UserError
+from contextlib import contextmanager
+import io, sys
+
+
+"""Standard input and output, used in place of files named `-`."""
+
+
+class STDIO_REUSED(UserError):
+    """standard {stream} (`-`) can only be used for one file"""
+
+
+class NEEDS_REAL_FILE(UserError):
+    """{purpose} can't use standard input or output (`-`)"""
+
+
+STDIO = '-'
+
+
+def is_stdio(filename):
+    return filename == STDIO
+
+
+def check_stdio(stream, *filenames):
+    """Ensure that at most one of the `filenames` (which may include None,
+    for unused options) uses the standard `stream` (input or output)."""
+    STDIO_REUSED.require(sum(map(is_stdio, filenames)) < 2, stream=stream)
+
+
+@contextmanager
+def _text(buffer):
+    # The wrapper is detached afterward, rather than closed, so that the
+    # underlying standard stream stays open.
+    wrapper = io.TextIOWrapper(buffer, encoding='utf-8')
+    try:
+        yield wrapper
+    finally:
+        wrapper.flush()
+        wrapper.detach()
+
+
+def text_stdin():
+    """A context manager giving standard input as UTF-8 text."""
+    return _text(sys.stdin.buffer)
+
+
+def text_stdout():
+    """A context manager giving standard output as UTF-8 text."""
+    sys.stdout.flush() # keep anything written before in order.
+    return _text(sys.stdout.buffer)
+
+
+def read_binary(filename):
+    """Read the entire contents of a binary file, or standard input."""
+    if is_stdio(filename):
+        return sys.stdin.buffer.read()
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def write_binary(filename, data):
+    """Write a binary file, or standard output."""
+    if is_stdio(filename):
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        return
+    with open(filename, 'wb') as f:
+        f.write(data)
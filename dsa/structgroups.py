@@ -3,7 +3,9 @@
 
 from .errors import wrap as wrap_errors, SequenceError, UserError
 from .parsing.line_parsing import line_parser
-from .parsing.token_parsing import single_parser
+from .parsing.token_parsing import make_parser, single_parser
+from .tables import count_rows, load_table
+from functools import partial
 from itertools import count
 
 
@@ -32,11 +34,29 @@ class BAD_CHUNK_SIZE(UserError):
     """chunk has {actual} structs; exactly {required} required"""
 
 
+_struct_name = single_parser('name', 'string')
+
+
 _struct_name_parser = line_parser(
-    'struct', single_parser('name', 'string'), required=1, more=True
+    'struct', _struct_name, required=1, more=True
+)
+
+
+# A line like `name:filename` stands for a struct for each row of a table
+# (see `dsa.tables`), with a path relative to the current directory, as for
+# the `file` interpreter.
+_table = make_parser(
+    'table', ('string', 'struct name'), ('string', 'file name')
 )
 
 
+_table_parser = line_parser('table', _table, required=1)
+
+
+def _is_table(tokens):
+    return len(tokens[0]) > 1
+
+
 def _normalized_graph(graph, first):
     all_nodes = set(graph.keys())
     result = {}
@@ -97,14 +117,37 @@ class StructGroup:
         ))
 
 
-    def _parse(self, tokens, previous):
+    def _check_follower(self, name, previous):
         followers = self._graph[previous]
-        # Name extraction can't fail, since empty lines are skipped.
-        name, tokens = _struct_name_parser(tokens)
         INVALID_FOLLOWER.require(
             name in followers, name=name, followers=followers
         )
-        return name, self._structs[name].parse(tokens)
+
+
+    def _parse(self, tokens, previous):
+        # Name extraction can't fail, since empty lines are skipped.
+        name, tokens = _struct_name_parser(tokens)
+        self._check_follower(name, previous)
+        return name, self._structs[name].parse(tokens), 1
+
+
+    def _parse_table(self, tokens, previous, resolve_label):
+        # The columns are converted and packed in bulk, rather than
+        # producing and tokenizing a line for each row.
+        [(name, filename)] = _table_parser(tokens)
+        self._check_follower(name, previous)
+        table = load_table(filename)
+        if resolve_label is not None:
+            table = wrap_errors(
+                f'Table `{filename}`', table.resolved, resolve_label
+            )
+        if table.rows == 0:
+            return previous, b'', 0
+        if table.rows > 1: # every row after the first follows another.
+            self._check_follower(name, name)
+        struct = self._structs[name]
+        data = wrap_errors(f'Table `{filename}`', struct.pack_table, table)
+        return name, data, table.rows
 
 
     def _parse_end(self, count):
@@ -121,27 +164,45 @@ class StructGroup:
         return self._align
 
 
-    def assemble(self, codec_lookup, config, lines):
+    def assemble(self, codec_lookup, config, lines, resolve_label=None):
         # The codec_lookup and config are ignored, since structgroup-based
-        # interpreters don't use codecs.
+        # interpreters don't use codecs. `resolve_label` is given when
+        # there are tables (see `reads_files`), for label references there.
         previous = None
         result = bytearray()
+        total = 0
         for i, line in enumerate(lines, 1):
-            previous, data = wrap_errors(
-                f'struct #{i}', self._parse, line, previous
+            if _is_table(line):
+                parse = partial(self._parse_table, resolve_label=resolve_label)
+            else:
+                parse = self._parse
+            previous, data, amount = wrap_errors(
+                f'struct #{i}', parse, line, previous
             )
             result.extend(data)
-        result.extend(self._parse_end(len(lines)))
+            total += amount
+        result.extend(self._parse_end(total))
         return bytes(result)
 
 
-    def item_size(self, name):
+    def item_size(self, token):
+        # The token is the first one on the line, naming the struct
+        # (and the table file, for a table line).
         try:
-            return self._structs[name].size
-        except: # Bad struct name? Wait until assembly to report the error.
+            if len(token) > 1:
+                name, filename = _table(token)
+                return self._structs[name].size * count_rows(filename)
+            return self._structs[_struct_name(token)].size
+        except (UserError, KeyError):
+            # Bad struct name? Wait until assembly to report the error.
             return 0
 
 
+    def reads_files(self, lines):
+        """Whether assembling the `lines` reads other files (i.e. tables)."""
+        return any(map(_is_table, lines))
+
+
     def _understand_failure(self, i):
         if self._expect_termination:
             return "didn't find a valid terminator sequence or `last` chunk"
@@ -167,14 +228,12 @@ class StructGroup:
         # if there are no candidates, reached a valid `last` struct; success.
 
 
-    # Get the disassembled lines for a chunk and the corresponding chunk size.
-    def disassemble(
-        self, codec_lookup, config, chunk_label, data, register, label_ref
-    ):
-        # `codec_lookup` and `config` are ignored.
+    def _walk(self, data, visit):
+        # Match structs from the start of the chunk `data`, calling
+        # `visit(i, label, result)` for each (with its index, the label text
+        # if any, and the result from `_extract`); returns the chunk size.
         previous = None
         offset = 0
-        lines = []
         enumerator = (
             range(self._count)
             if self._count is not None
@@ -186,21 +245,57 @@ class StructGroup:
                 offset += adjustment
                 break
             label = self._label_text(i)
-            if label is not None:
-                lines.append(('', ('@', label)))
             result = self._extract(candidates, data, offset, label)
             CHUNK_LOADING_FAILED.require(
                 result is not None,
                 reason=self._understand_failure(i)
             )
+            visit(i, label, result)
+            struct_name, match, referents, struct_size = result
+            offset += struct_size
+            previous = struct_name
+        assert self._count in {None, i+1}
+        return offset
+
+
+    # Get the disassembled lines for a chunk and the corresponding chunk size.
+    # If `collect` is given, it is called with the (struct name, match) for
+    # each struct, to be passed to `columns` afterward.
+    def disassemble(
+        self, codec_lookup, config, chunk_label, data, register, label_ref,
+        collect=None
+    ):
+        # `codec_lookup` and `config` are ignored.
+        lines = []
+        # Repeated tokens (struct names, common values) share one object,
+        # since a large chunk may have a great many of them.
+        share = {}.setdefault
+        def visit(i, label, result):
+            if label is not None:
+                lines.append(('', ('@', label)))
             struct_name, match, referents, struct_size = result
+            if collect is not None:
+                collect((struct_name, match))
             for referent in referents:
                 register(*referent)
-            lines.append(self._format(
+            line = self._format(
                 f'Struct {struct_name} ({self._progress(i)})',
                 struct_name, match, label_ref
-            ))
-            offset += struct_size
-            previous = struct_name
-        assert self._count in {None, i+1}
-        return offset, lines
+            )
+            lines.append(tuple(share(token, token) for token in line))
+        return self._walk(data, visit), lines
+
+
+    def columns(self, config, matches):
+        """Get the numeric values in a chunk of structs all of the same kind,
+        as (struct name, number of structs, [(column name, column), ...]),
+        without formatting any text (see `Struct.columns`); or None for
+        other chunks. `matches` are the (struct name, match) pairs collected
+        by `disassemble`."""
+        # `config` is ignored, as for disassembly.
+        names = {name for name, match in matches}
+        if len(names) != 1:
+            return None
+        [name] = names
+        columns = self._structs[name].columns([m for n, m in matches])
+        return name, len(matches), list(columns)
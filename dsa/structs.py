@@ -54,6 +54,32 @@ class Member:
         )
 
 
+    @property
+    def column_names(self):
+        # A value with several fields has a column for each.
+        names = self._implementation.column_names
+        if len(names) == 1:
+            return [self._name]
+        return [f'{self._name}.{name}' for name in names]
+
+
+    def columns(self, values):
+        return [
+            (name, column) for name, column in zip(
+                self.column_names, self._implementation.columns(values)
+            )
+            if column is not None
+        ]
+
+
+    def raws(self, columns, count, numeric):
+        """The raw value of the member for each of `count` rows of a table,
+        given its columns (of numbers, or else text)."""
+        return wrap_errors(
+            self.tag, self._implementation.raws, columns, count, numeric
+        )
+
+
     def parse(self, items):
         return wrap_errors(
             self.tag, self._implementation.parse, items
@@ -119,6 +145,39 @@ class Struct:
         )
 
 
+    @property
+    def column_names(self):
+        """The names of the columns of a table of these structs."""
+        return [
+            name for member in self._members for name in member.column_names
+        ]
+
+
+    def columns(self, matches):
+        """(name, column) for the numeric values of each member field, given
+        the `matches` for a sequence of these structs (see
+        `NumericField.column`)."""
+        groups = [match.groups() for match in matches]
+        for i, member in enumerate(self._members):
+            yield from member.columns([group[i] for group in groups])
+
+
+    def pack_table(self, table):
+        """Produce the data for one of these structs for each row of the
+        `table` (see `dsa.tables`), a member at a time."""
+        count, size = table.rows, self.size
+        result = bytearray(bytes(self._template) * count)
+        columns = iter(table.columns(self.column_names))
+        for member in self._members:
+            member_columns = [next(columns) for name in member.column_names]
+            raws = member.raws(member_columns, count, table.numeric)
+            width, offset = member.size, member.offset
+            data = b''.join(raw.to_bytes(width, 'little') for raw in raws)
+            for i in range(width):
+                result[offset+i::size] = data[i::width]
+        return bytes(result)
+
+
     def parse(self, tokens):
         # This invariant should be upheld by the struct lookup/dispatch.
         assert len(tokens) == len(self._members)
@@ -0,0 +1,270 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .errors import wrap as wrap_errors, MappingError, UserError
+from .parsing.line_parsing import tokenize
+from array import array
+from ast import literal_eval
+from pathlib import Path
+import csv, sys, zipfile
+
+
+"""Tables of struct values stored outside the listing, for assembly.
+
+A table gives a column of values for each field of a struct, and a row for
+each struct. It can be a CSV file, whose first row names the columns and
+whose cells are written as they would be in a listing (including label
+references, like `@name` or `@[chunk, name]`); a `.npz` file, with
+a one-dimensional integer array for each column (as written by `dsd
+--export-columns`); or a `.npy` file, with a two-dimensional integer array
+holding the columns in order (or a one-dimensional array, for a single
+column). Numbers in NumPy files are values, as they would be shown in a
+listing, rather than raw data.
+"""
+
+
+class BAD_TABLE(UserError):
+    """`{filename}` is not a valid table ({reason})"""
+
+
+class UNKNOWN_TABLE_TYPE(MappingError):
+    """unsupported table file type `{key}` (use `.csv`, `.npy` or `.npz`)"""
+
+
+class MISSING_COLUMN(MappingError):
+    """table has no column `{key}`"""
+
+
+class COLUMN_COUNT(UserError):
+    """table has {actual} columns; {expected} required"""
+
+
+class BAD_LABEL_CELL(UserError):
+    """`{text}` is not a single label reference"""
+
+
+_NPY_MAGIC = b'\x93NUMPY'
+
+
+def _typecode(size, signed):
+    for code in 'bBhHiIlLqQ':
+        if array(code).itemsize == size and code.islower() == signed:
+            return code
+    return None
+
+
+def _npy_header(filename, f):
+    # Returns (array type code, whether to byteswap, number of rows, number
+    # of columns, Fortran order), reading to the start of the data.
+    prefix = f.read(len(_NPY_MAGIC) + 2)
+    BAD_TABLE.require(
+        prefix[:len(_NPY_MAGIC)] == _NPY_MAGIC,
+        filename=filename, reason='not a `.npy` file'
+    )
+    size = 2 if prefix[-2] == 1 else 4
+    length = int.from_bytes(f.read(size), 'little')
+    try:
+        header = literal_eval(f.read(length).decode('latin-1'))
+        descr, shape = header['descr'], tuple(header['shape'])
+        fortran = header['fortran_order']
+    except (SyntaxError, ValueError, KeyError, TypeError):
+        raise BAD_TABLE(filename=filename, reason='bad header')
+    code = None
+    if isinstance(descr, str) and len(descr) == 3 and descr[1] in 'iu':
+        code = _typecode(int(descr[2]), descr[1] == 'i')
+    BAD_TABLE.require(
+        code is not None,
+        filename=filename, reason=f'unsupported array type `{descr}`'
+    )
+    BAD_TABLE.require(
+        1 <= len(shape) <= 2,
+        filename=filename, reason=f'unsupported array shape {shape}'
+    )
+    byteorder = {'<': 'little', '>': 'big'}.get(descr[0], sys.byteorder)
+    rows, count = (shape[0], 1) if len(shape) == 1 else shape
+    return code, byteorder != sys.byteorder, rows, count, fortran
+
+
+def _read_npy(filename, f):
+    # The columns of the array in a `.npy` file.
+    code, swap, rows, count, fortran = _npy_header(filename, f)
+    values = array(code)
+    values.frombytes(f.read())
+    if swap:
+        values.byteswap()
+    BAD_TABLE.require(
+        len(values) == rows * count, filename=filename, reason='wrong size'
+    )
+    values = values.tolist()
+    if fortran: # the columns are stored one after the other.
+        return [values[i*rows:(i+1)*rows] for i in range(count)]
+    return [values[i::count] for i in range(count)]
+
+
+def _npy_rows(filename, f):
+    return _npy_header(filename, f)[2]
+
+
+class Table:
+    def __init__(self, columns, rows, numeric, names=None):
+        """`columns` -> a sequence of values for each column.
+        `rows` -> the number of rows.
+        `numeric` -> whether the values are numbers (or else text).
+        `names` -> names for the columns, if they are named."""
+        self._columns, self._rows = columns, rows
+        self._numeric, self._names = numeric, names
+
+
+    @property
+    def rows(self):
+        return self._rows
+
+
+    @property
+    def numeric(self):
+        return self._numeric
+
+
+    def columns(self, names):
+        """The columns with the given `names`. An unnamed table must have
+        exactly that many columns, in the same order."""
+        if self._names is None:
+            COLUMN_COUNT.require(
+                len(self._columns) == len(names),
+                actual=len(self._columns), expected=len(names)
+            )
+            return self._columns
+        lookup = dict(zip(self._names, self._columns))
+        return [MISSING_COLUMN.get(lookup, name) for name in names]
+
+
+    def resolved(self, resolve):
+        """A copy of the table where each label reference (a text cell
+        starting with `@`) is replaced with `resolve(token)`, given the
+        label's token as it would be tokenized in a listing."""
+        if self._numeric:
+            return self
+        columns = [
+            wrap_errors(
+                f'Column `{name}`', _resolved_column, resolve, column
+            )
+            for name, column in zip(self._names, self._columns)
+        ]
+        return Table(columns, self._rows, False, self._names)
+
+
+def _label_token(text):
+    prefix, tokens = tokenize(text)
+    BAD_LABEL_CELL.require(
+        not prefix and len(tokens) == 1 and tokens[0][0] == '@', text=text
+    )
+    return tokens[0]
+
+
+def _resolve_cell(resolve, text):
+    return resolve(_label_token(text)) if text.startswith('@') else text
+
+
+def _resolved_column(resolve, column):
+    # As when packing, the cells are resolved again a row at a time to
+    # report any error.
+    try:
+        return [_resolve_cell(resolve, text) for text in column]
+    except UserError:
+        for i, text in enumerate(column, 1):
+            wrap_errors(f'Row #{i}', _resolve_cell, resolve, text)
+        raise
+
+
+def _load_csv(filename):
+    with open(filename, newline='', encoding='utf-8') as f:
+        rows = [[cell.strip() for cell in row] for row in csv.reader(f)]
+    if not rows:
+        raise BAD_TABLE(filename=filename, reason='no header row')
+    names, rows = rows[0], rows[1:]
+    for i, row in enumerate(rows, 2):
+        BAD_TABLE.require(
+            len(row) == len(names), filename=filename,
+            reason=f'row {i} has {len(row)} cells, not {len(names)}'
+        )
+    columns = [[row[i] for row in rows] for i in range(len(names))]
+    return Table(columns, len(rows), False, names)
+
+
+def _csv_rows(filename):
+    with open(filename, newline='', encoding='utf-8') as f:
+        return max(sum(1 for row in csv.reader(f)) - 1, 0)
+
+
+def _load_npy(filename):
+    with open(filename, 'rb') as f:
+        rows = _npy_rows(filename, f)
+        f.seek(0)
+        columns = _read_npy(filename, f)
+    return Table(columns, rows, True)
+
+
+def _npz_names(filename, z):
+    names = z.namelist()
+    BAD_TABLE.require(
+        bool(names), filename=filename, reason='there are no arrays'
+    )
+    return names
+
+
+def _load_npz(filename):
+    names, columns = [], []
+    with zipfile.ZipFile(filename) as z:
+        for name in _npz_names(filename, z):
+            with z.open(name) as f:
+                array_columns = _read_npy(f'{filename}: {name}', f)
+            BAD_TABLE.require(
+                len(array_columns) == 1, filename=filename,
+                reason=f'array `{name}` is not one-dimensional'
+            )
+            names.append(name[:-4] if name.endswith('.npy') else name)
+            columns.extend(array_columns)
+    BAD_TABLE.require(
+        len(set(map(len, columns))) == 1, filename=filename,
+        reason='the arrays must all have the same length'
+    )
+    return Table(columns, len(columns[0]), True, names)
+
+
+def _npz_rows(filename):
+    with zipfile.ZipFile(filename) as z:
+        with z.open(_npz_names(filename, z)[0]) as f:
+            return _npy_rows(filename, f)
+
+
+def _npy_file_rows(filename):
+    with open(filename, 'rb') as f:
+        return _npy_rows(filename, f)
+
+
+_LOADERS = {
+    '.csv': (_load_csv, _csv_rows),
+    '.npy': (_load_npy, _npy_file_rows),
+    '.npz': (_load_npz, _npz_rows)
+}
+
+
+def _loaders(filename):
+    return UNKNOWN_TABLE_TYPE.get(_LOADERS, Path(filename).suffix.lower())
+
+
+def load_table(filename):
+    """Load the Table in the file `filename`."""
+    try:
+        return _loaders(filename)[0](filename)
+    except (OSError, zipfile.BadZipFile, UnicodeDecodeError, csv.Error) as e:
+        raise BAD_TABLE(filename=filename, reason=str(e))
+
+
+def count_rows(filename):
+    """The number of rows in the table in the file `filename`, determined
+    without loading the whole table where possible."""
+    try:
+        return _loaders(filename)[1](filename)
+    except (OSError, zipfile.BadZipFile, UnicodeDecodeError, csv.Error) as e:
+        raise BAD_TABLE(filename=filename, reason=str(e))
@@ -0,0 +1,26 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .common import dsa_entrypoint
+from .patching import apply_patch_file, check_patch_file, prepare_output
+from .tracing import my_tracer
+
+
+"""Interface to patch applier."""
+
+
+@dsa_entrypoint(
+    name='dsa-apply',
+    description='Data Structure Assembler - apply patch',
+    message='Applying patch...',
+    patch='patch file to apply (from `dsa --emit-patch`)',
+    binary='binary file to apply the patch to',
+    _output='binary file to write (if not overwriting source)'
+)
+def apply_patch(patch, binary, output=None):
+    # The patch is checked in full before the binary is copied or changed.
+    with my_tracer('Checking patch'):
+        check_patch_file(patch, binary)
+    binary = prepare_output(binary, output)
+    with my_tracer('Patching'):
+        apply_patch_file(patch, binary)
@@ -3,6 +3,7 @@
 
 from .tracing import my_tracer
 from ..errors import UserError
+from ..stdio import is_stdio, read_binary
 from datetime import datetime
 import sys, traceback
 from epmanager import entrypoint, DefaultParser
@@ -13,8 +14,16 @@ from epmanager import entrypoint, DefaultParser
 
 @my_tracer('Loading binary')
 def get_data(source):
-    with open(source, 'rb') as f:
-        return f.read()
+    return read_binary(source)
+
+
+def _uses_stdio(parsed_args):
+    for value in parsed_args.values():
+        if is_stdio(value) or (
+            isinstance(value, list) and any(map(is_stdio, value))
+        ):
+            return True
+    return False
 
 
 def _errmsg(e):
@@ -60,9 +69,26 @@ class _ReportingParser(DefaultParser):
         return {'message'}
 
 
+    def add_option(self, name, deco_spec, param_spec):
+        # By default, the short option uses the first letter of the name.
+        # A spec can give a different `short` letter instead (or None, for
+        # no short option), to avoid conflicts.
+        if 'short' not in deco_spec:
+            return super().add_option(name, deco_spec, param_spec)
+        spec = {**param_spec, **deco_spec}
+        short = spec.pop('short')
+        flags = [f'--{name.replace("_", "-")}']
+        if short is not None:
+            flags.insert(0, f'-{short}')
+        self._impl.add_argument(*flags, **spec)
+        return deco_spec.get('dest', name)
+
+
     def call_with(self, parsed_args):
+        # Standard output may be used for data, so progress goes elsewhere.
+        stream = sys.stderr if _uses_stdio(parsed_args) else None
         try:
-            with my_tracer(self._message):
+            with my_tracer.redirect(stream), my_tracer(self._message):
                 self.raw_call(parsed_args)
         except Exception as e:
             sys.stdout.flush()
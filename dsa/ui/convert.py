@@ -0,0 +1,43 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .common import dsa_entrypoint
+from .tracing import my_tracer
+from ..binary_listing import encode, is_binary_name
+from ..compression import FORMATS, compress as compressed, compression_for
+from ..output import as_output, output_file
+from ..parsing.file_parsing import source_lines
+from ..stdio import write_binary
+
+
+"""Interface to listing converter."""
+
+
+@dsa_entrypoint(
+    name='dsa-convert',
+    description='Data Structure Assembler - convert listing format',
+    message='Converting listing...',
+    source='listing to convert, text or binary (`-` for standard input)',
+    output='file to write (`-` for standard output)',
+    _binary_listing={
+        'help': 'write a binary listing (by default, only if the output'
+        ' name ends with `.dsb`); otherwise, write text',
+        'action': 'store_true',
+        'short': 'B'
+    },
+    _compress={
+        'help': 'compress the output (by default, according to its extension)',
+        'choices': FORMATS,
+        'short': 'z'
+    }
+)
+def convert_listing(source, output, binary_listing=False, compress=None):
+    compression = compression_for(output, compress)
+    with my_tracer('Converting'), source_lines(source) as lines:
+        if binary_listing or is_binary_name(output):
+            # The original line numbers are kept, for error messages.
+            write_binary(output, compressed(encode(lines), compression))
+        else:
+            # Text is written compactly, since that can represent any
+            # tokens; the tokens are the same either way.
+            output_file(output, as_output(lines), True, compression)
@@ -2,46 +2,125 @@
 # Licensed under the Open Software License version 3.0
 
 from .common import dsa_entrypoint, get_data
+from .patching import (
+    MappedPatcher, MemoryPatcher, PatchWriter, check_overlaps, prepare_output
+)
 from .tracing import my_tracer
 from ..language import Language
+from ..selection import SEEK_UNSUPPORTED, Selection
+from ..sharding import expand_manifests
+from ..stdio import NEEDS_REAL_FILE, check_stdio, is_stdio, write_binary
+from functools import partial
 
 
 """Interface to assembler."""
 
 
 def apply(chunks, data):
-    data = bytearray(data)
-    last, expanded = 0, 0
+    patcher = MemoryPatcher(data)
     for position, chunk in chunks.items():
-        assert position >= last
-        last = position + len(chunk)
-        needed = last - len(data)
-        if needed > 0:
-            expanded += needed
-            data.extend(bytes(needed))
-        data[position:position+len(chunk)] = chunk
-    if expanded:
-        message = 'Warning: output binary was expanded by {0} (0x{0:X}) bytes'
-        my_tracer.trace(message.format(expanded))
-        my_tracer.trace('to accomodate written data.')
-    return bytes(data)
+        patcher(position, chunk)
+    return patcher.result()
+
+
+def _assemble(language, sources, patcher, stream, labels, select, seek):
+    if stream or labels:
+        language.assemble_streaming(sources, patcher, labels, select, seek)
+    else:
+        chunks = language.assemble(sources, select)
+        # Patchers that write to a file would otherwise be left with only
+        # some of the chunks written.
+        check_overlaps(chunks)
+        for position, chunk in chunks.items():
+            patcher(position, chunk)
+
+
+def _mapped_patcher(binary, output):
+    return MappedPatcher(prepare_output(binary, output))
+
+
+def _assemble_with(make_patcher, language, sources, *options):
+    # For patchers that write to a file as they go.
+    with make_patcher() as patcher:
+        with my_tracer('Assembling'):
+            _assemble(language, sources, patcher, *options)
+            patcher.result()
 
 
 @dsa_entrypoint(
     description='Data Structure Assembler - assembly mode',
     message='Running DSA...',
-    binary='source binary file to assemble into',
-    source='name of file to assemble',
-    _output='binary file to write (if not overwriting source)',
+    binary='source binary file to assemble into (`-` for standard input)',
+    sources={
+        'help': 'names of files to assemble (labels may refer to any of them)'
+        ' or `-` for standard input; a shard manifest from `dsd --shard-by`'
+        ' (or its folder) stands for all the shards',
+        'nargs': '+'
+    },
+    _output='binary file to write (if not overwriting source), or `-`',
     _libraries={'help': 'symbolic names of libraries to use', 'nargs': '*'},
     _paths={'help': 'paths to roots of libraries to use', 'nargs': '*'},
-    _target='target language to build from libraries'
+    _target='target language to build from libraries',
+    _stream={
+        'help': 'assemble each chunk as it is read, to save memory',
+        'action': 'store_true'
+    },
+    _labels={
+        'help': 'label index file from `dsd --labels` (implies --stream)',
+        'short': 'L'
+    },
+    _mapped={
+        'help': 'write chunks directly into the output via memory mapping',
+        'action': 'store_true'
+    },
+    _emit_patch='write a patch file with the changes, instead of a binary',
+    _only={
+        'help': 'assemble only chunks with these labels, or within these'
+        ' address ranges (like `0x1000-0x2000`); other chunks are left'
+        ' as they are in the binary',
+        'nargs': '+',
+        'short': 'O'
+    },
+    _source_map={
+        'help': 'source map from `dsd --source-map`, used with --only and'
+        ' --labels to read only the selected blocks of the listing',
+        'short': 'S'
+    },
+    _cache='folder for caching compiled library data between runs',
+    _jobs='number of worker processes to use'
 )
-def dsa(binary, source, output=None, libraries=(), paths=(), target=None):
+def dsa(
+    binary, sources, output=None,
+    libraries=(), paths=(), target=None, stream=False, labels=None,
+    mapped=False, emit_patch=None, only=None, source_map=None, cache=None,
+    jobs:int=None
+):
+    check_stdio('input', binary, *sources, labels, source_map)
+    sources = expand_manifests(sources)
+    select = None if only is None else Selection(only)
+    if source_map is not None:
+        SEEK_UNSUPPORTED.require(
+            select is not None and labels is not None and len(sources) == 1
+        )
+    options = (stream, labels, select, source_map)
+    if emit_patch is not None or mapped:
+        # The binary is read (and the output written) by memory mapping.
+        NEEDS_REAL_FILE.require(
+            not any(map(is_stdio, (binary, output, emit_patch))),
+            purpose='`--mapped`' if emit_patch is None else '`--emit-patch`'
+        )
+        my_language = Language.create(libraries, paths, target, cache, jobs)
+        make_patcher = (
+            partial(PatchWriter, binary, emit_patch) if emit_patch is not None
+            else partial(_mapped_patcher, binary, output)
+        )
+        _assemble_with(make_patcher, my_language, sources, *options)
+        return
     data = get_data(binary)
-    my_language = Language.create(libraries, paths, target)
+    my_language = Language.create(libraries, paths, target, cache, jobs)
+    patcher = MemoryPatcher(data)
     with my_tracer('Assembling'):
-        result = apply(my_language.assemble(source), data)
+        _assemble(my_language, sources, patcher, *options)
+        result = patcher.result()
     with my_tracer('Writing to output'):
-        with open(binary if output is None else output, 'wb') as f:
-            f.write(result)
+        write_binary(binary if output is None else output, result)
@@ -3,46 +3,16 @@
 
 from .common import dsa_entrypoint, get_data
 from .tracing import my_tracer
+from .verify import verify_assembly
+from ..compression import FORMATS
 from ..language import Language
+from ..sharding import SHARDINGS
+from ..stdio import NEEDS_REAL_FILE, check_stdio, is_stdio
 
 
 """Interface to disassembler."""
 
 
-def _dumphex(data):
-    for i in range(0, len(data), 16):
-        my_tracer.trace(data[i:i+16].hex(' '))
-
-
-def verify_assembly(chunks, data):
-    offset = 0
-    ok, overwrite, fail = 0, 0, 0
-    for position, chunk in chunks.items():
-        original = data[position:position+len(chunk)]
-        if position < offset:
-            my_tracer.trace(
-                f'OVERWRITE at 0x{position:X}: last ended at 0x{offset:X}'
-            )
-            overwrite += 1
-        elif chunk != original:
-            my_tracer.trace(f'MISMATCH at 0x{position:X}: ORIGINAL (')
-            _dumphex(original)
-            my_tracer.trace(f') ASSEMBLED (')
-            _dumphex(chunk)
-            my_tracer.trace(f')')
-            fail += 1
-        else:
-            ok += 1
-        offset = position + len(chunk)
-    my_tracer.trace('')
-    total = ok + overwrite + fail
-    my_tracer.trace(', '.join((
-        f'{ok}/{total} OK',
-        f'{overwrite}/{total} overwrites',
-        f'{fail}/{total} mismatches'
-    )))
-
-
 def root_data(text):
     location, name, *params = text.split(':')
     return (name, params, int(location, 0))
@@ -51,25 +21,77 @@ def root_data(text):
 @dsa_entrypoint(
     description='Data Structure Assembler - disassembly mode',
     message='Running DSD',
-    binary='source binary file to disassemble from',
+    binary='source binary file to disassemble from (`-` for standard input)',
     root='offset and interpreter name/params for root chunk, e.g. `0x123:example:param`',
-    output='output file name',
+    output='output file name (`-` for standard output), or folder name'
+    ' with `--shard-by`',
     _verify={
         'help': 'try re-assembling the output and comparing to the source',
         'action': 'store_true'
     },
+    _report={
+        'help': 'write a detailed verification report (implies --verify)',
+        'short': 'r'
+    },
     _libraries={'help': 'symbolic names of libraries to use', 'nargs': '*'},
     _paths={'help': 'paths to roots of libraries to use', 'nargs': '*'},
-    _target='target language to build from libraries'
+    _target='target language to build from libraries',
+    _labels={
+        'help': 'also write a label index, for `dsa --labels`',
+        'short': 'L'
+    },
+    _compress={
+        'help': 'compress the listing (by default, according to its extension)',
+        'choices': FORMATS,
+        'short': 'z'
+    },
+    _source_map={
+        'help': 'also write a source map, linking listing lines to locations'
+        ' in the binary',
+        'short': 'S' # as for `dsa`, where `-s` is `--stream`.
+    },
+    _binary_listing={
+        'help': 'write the listing in binary form, for `dsa` or other'
+        ' programs (by default, only if its name ends with `.dsb`)',
+        'action': 'store_true',
+        'short': 'B'
+    },
+    _shard_by={
+        'help': 'split the listing into files in the output folder, grouping'
+        ' chunks by label name, by location or to limit the size of each',
+        'choices': SHARDINGS,
+        'short': 'b'
+    },
+    _export_columns={
+        'help': 'also export the numbers in each chunk of same-type structs'
+        ' to a NumPy `.npz` file in this folder, with an array per member',
+        'short': 'x'
+    },
+    _cache='folder for caching compiled library data between runs',
+    _jobs='number of worker processes to use'
 )
 def dsd(
-    binary, root:root_data, output, verify=False,
-    libraries=(), paths=(), target=None
+    binary, root:root_data, output, verify=False, report=None,
+    libraries=(), paths=(), target=None, labels=None, compress=None,
+    source_map=None, binary_listing=False, shard_by=None,
+    export_columns=None, cache=None, jobs:int=None
 ):
+    check_stdio('output', output, labels, report, source_map)
+    NEEDS_REAL_FILE.require(
+        shard_by is None or not is_stdio(output), purpose='`--shard-by`'
+    )
     data = get_data(binary)
-    my_language = Language.create(libraries, paths, target)
+    my_language = Language.create(libraries, paths, target, cache, jobs)
     with my_tracer('Disassembling'):
-        my_language.disassemble(data, root, output)
-    if verify:
+        disassembler = my_language.disassemble(
+            data, root, output, labels, compress, shard_by,
+            binary_listing, source_map, export_columns
+        )
+    if verify or report is not None:
         with my_tracer('Reassembling for verification'):
-            verify_assembly(my_language.assemble(output), data)
+            # The listing is reassembled directly, rather than from the file.
+            chunks = my_language.assemble_listing(
+                f'Listing `{output}`', disassembler.listing()
+            )
+        with my_tracer('Verifying'):
+            verify_assembly(chunks, data, report, jobs)
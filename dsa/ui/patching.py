@@ -0,0 +1,367 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .tracing import my_tracer
+from ..errors import UserError
+from bisect import bisect_right
+import io, mmap, os, shutil, zlib
+try:
+    import fcntl
+except ImportError: # not available on Windows.
+    fcntl = None
+
+
+"""Writing assembled chunks into binary data."""
+
+
+class CHUNK_OVERLAP(UserError):
+    """chunk at 0x{position:X} overlaps the chunk at 0x{other:X}"""
+
+
+class BAD_PATCH(UserError):
+    """`{filename}` is not a valid patch file ({reason})"""
+
+
+class PATCH_SOURCE_MISMATCH(UserError):
+    """patch is for a binary of {expected} bytes (this one has {actual})"""
+
+
+class PATCH_CHECKSUM_MISMATCH(UserError):
+    """patch is for a binary with CRC-32 {expected:08X} (not {actual:08X})"""
+
+
+_EXPANDED = 'Warning: output binary was expanded by {0} (0x{0:X}) bytes'
+
+
+def _report_expansion(expanded):
+    if expanded:
+        my_tracer.trace(_EXPANDED.format(expanded))
+        my_tracer.trace('to accomodate written data.')
+
+
+class _Extents:
+    """Tracks the regions written so far, to detect overlapping chunks.
+    Chunks are normally written in order, which is the fast case."""
+    def __init__(self):
+        self._starts, self._ends = [], []
+
+
+    def add(self, start, size):
+        if not size: # an empty chunk can't overlap anything.
+            return
+        end = start + size
+        i = bisect_right(self._starts, start)
+        if i and self._ends[i-1] > start:
+            raise CHUNK_OVERLAP(position=start, other=self._starts[i-1])
+        if i < len(self._starts) and self._starts[i] < end:
+            raise CHUNK_OVERLAP(position=start, other=self._starts[i])
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+
+
+def check_overlaps(chunks):
+    """Ensure that none of the `chunks` (a mapping of position to data)
+    overlap, before any of them are written."""
+    extents = _Extents()
+    for position, chunk in chunks.items():
+        extents.add(position, len(chunk))
+
+
+class MemoryPatcher:
+    """Writes assembled chunks into a copy of the source binary data,
+    expanding it as needed."""
+    def __init__(self, data):
+        self._data = bytearray(data)
+        self._extents = _Extents()
+        self._expanded = 0
+
+
+    def __call__(self, position, chunk):
+        self._extents.add(position, len(chunk))
+        needed = position + len(chunk) - len(self._data)
+        if needed > 0:
+            self._expanded += needed
+            self._data.extend(bytes(needed))
+        self._data[position:position+len(chunk)] = chunk
+
+
+    def result(self):
+        _report_expansion(self._expanded)
+        return bytes(self._data)
+
+
+def clone_file(source, destination):
+    """Copy the `source` file to `destination`. Where the file system
+    supports it, the copy shares storage with the original until either
+    is modified, so that this is fast even for very large files."""
+    if fcntl is not None:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno()) # FICLONE
+                return
+            except OSError: # not supported here; make a normal copy.
+                pass
+    shutil.copyfile(source, destination)
+
+
+def prepare_output(binary, output):
+    """Determine the file to patch in place, given the `binary` and
+    optional separate `output`. The binary is copied to the output first."""
+    if output is None:
+        return binary
+    if os.path.exists(output) and os.path.samefile(binary, output):
+        return output
+    with my_tracer('Copying binary to output'):
+        clone_file(binary, output)
+    return output
+
+
+class MappedPatcher:
+    """Writes assembled chunks directly into a file, which is memory-mapped
+    so that only the affected pages are read and written. The file is
+    extended when a chunk is written past the end."""
+    def __init__(self, path):
+        self._file = open(path, 'r+b')
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mapped = self._map()
+        self._extents = _Extents()
+        self._expanded = 0
+
+
+    def _map(self):
+        # An empty file can't be mapped.
+        return mmap.mmap(self._file.fileno(), 0) if self._size else None
+
+
+    def _unmap(self):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+
+    def _grow(self, size):
+        self._unmap() # the mapping must be recreated at the new size.
+        self._file.truncate(size)
+        self._expanded += size - self._size
+        self._size = size
+        self._mapped = self._map()
+
+
+    def __call__(self, position, chunk):
+        self._extents.add(position, len(chunk))
+        end = position + len(chunk)
+        if end > self._size:
+            self._grow(end)
+        if chunk:
+            self._mapped[position:end] = chunk
+
+
+    def result(self):
+        if self._mapped is not None:
+            self._mapped.flush()
+        _report_expansion(self._expanded)
+
+
+    def close(self):
+        self._unmap()
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+# Patch files. The format is:
+#   the _PATCH_MAGIC bytes;
+#   the size of the source binary;
+#   the CRC-32 of the source binary, as 4 little-endian bytes;
+#   any number of records, each giving a position, a nonzero length and
+#   then that many bytes of data to write at that position;
+#   an end marker: the size of the patched binary, then a zero length.
+# Numbers are written as unsigned LEB128 varints.
+_PATCH_MAGIC = b'DSAPATCH'
+
+
+# Identical runs shorter than this, between changed bytes, are included in
+# the same record rather than starting a new one.
+_MIN_GAP = 8
+
+
+# Chunks are compared to the source in blocks of this size first.
+_BLOCK_SIZE = 64
+
+
+# Files are checksummed, and patch data copied, in pieces of this size.
+_COPY_SIZE = 1 << 20
+
+
+def _varint(value):
+    result = bytearray()
+    while value > 0x7f:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _differences(original, chunk):
+    # Positions where the `chunk` differs from the `original` data
+    # (which may be shorter, if the chunk extends past the end).
+    for block in range(0, len(chunk), _BLOCK_SIZE):
+        end = min(block + _BLOCK_SIZE, len(chunk))
+        if original[block:end] == chunk[block:end]:
+            continue
+        for i in range(block, end):
+            if i >= len(original) or original[i] != chunk[i]:
+                yield i
+
+
+def _changed_runs(original, chunk):
+    start = last = None
+    for i in _differences(original, chunk):
+        if start is None:
+            start = i
+        elif i - last > _MIN_GAP:
+            yield start, last + 1
+            start = i
+        last = i
+    if start is not None:
+        yield start, last + 1
+
+
+class PatchWriter:
+    """Writes assembled chunks to a patch file, recording only the data
+    that differs from the source binary."""
+    def __init__(self, source, filename):
+        self._source = open(source, 'rb')
+        self._size = os.fstat(self._source.fileno()).st_size
+        self._original = mmap.mmap(
+            self._source.fileno(), 0, access=mmap.ACCESS_READ
+        ) if self._size else b''
+        self._patch = open(filename, 'wb')
+        self._patch.write(_PATCH_MAGIC + _varint(self._size))
+        self._patch.write(zlib.crc32(self._original).to_bytes(4, 'little'))
+        self._extents = _Extents()
+        self._end = self._size
+
+
+    def __call__(self, position, chunk):
+        self._extents.add(position, len(chunk))
+        self._end = max(self._end, position + len(chunk))
+        original = self._original[position:position+len(chunk)]
+        for start, end in _changed_runs(original, chunk):
+            self._patch.write(_varint(position + start))
+            self._patch.write(_varint(end - start))
+            self._patch.write(chunk[start:end])
+
+
+    def result(self):
+        self._patch.write(_varint(self._end) + _varint(0))
+        _report_expansion(self._end - self._size)
+
+
+    def close(self):
+        if self._size:
+            self._original.close()
+        self._source.close()
+        self._patch.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def _read_varint(stream, filename):
+    result, shift = 0, 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            raise BAD_PATCH(filename=filename, reason='unexpected end of file')
+        result |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def _checksum(filename):
+    result = 0
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(_COPY_SIZE), b''):
+            result = zlib.crc32(block, result)
+    return result
+
+
+def _read_header(stream, filename):
+    # Returns the size and checksum of the source binary.
+    BAD_PATCH.require(
+        stream.read(len(_PATCH_MAGIC)) == _PATCH_MAGIC,
+        filename=filename, reason='wrong file type'
+    )
+    size = _read_varint(stream, filename)
+    checksum = stream.read(4)
+    BAD_PATCH.require(
+        len(checksum) == 4, filename=filename, reason='unexpected end of file'
+    )
+    return size, int.from_bytes(checksum, 'little')
+
+
+def _record_headers(stream, filename):
+    # Yields (position, size) for each record, leaving the stream at the
+    # start of that record's data; then (target size, 0) for the end marker.
+    while True:
+        position = _read_varint(stream, filename)
+        size = _read_varint(stream, filename)
+        yield position, size
+        if not size:
+            return
+
+
+def check_patch_file(patch_filename, binary):
+    """Check that a patch file, as written by a PatchWriter, is complete
+    and applies to the `binary` file, so that a bad patch is rejected before
+    anything is written. Only the record headers are read; the data in
+    between is skipped over."""
+    with open(patch_filename, 'rb') as patch:
+        length = os.fstat(patch.fileno()).st_size
+        expected, checksum = _read_header(patch, patch_filename)
+        actual = os.stat(binary).st_size
+        PATCH_SOURCE_MISMATCH.require(
+            expected == actual, expected=expected, actual=actual
+        )
+        for position, size in _record_headers(patch, patch_filename):
+            BAD_PATCH.require(
+                patch.seek(size, io.SEEK_CUR) <= length,
+                filename=patch_filename, reason='unexpected end of file'
+            )
+    actual = _checksum(binary)
+    PATCH_CHECKSUM_MISMATCH.require(
+        checksum == actual, expected=checksum, actual=actual
+    )
+
+
+def apply_patch_file(patch_filename, binary):
+    """Apply a patch file, already checked with `check_patch_file`, to the
+    `binary` file in place. Record data is copied across in pieces, so the
+    patch is never loaded as a whole, and only the patched regions of the
+    binary are written."""
+    with open(patch_filename, 'rb') as patch, open(binary, 'r+b') as f:
+        original = os.fstat(f.fileno()).st_size
+        _read_header(patch, patch_filename)
+        for position, size in _record_headers(patch, patch_filename):
+            if not size: # the end marker gives the patched size.
+                f.truncate(position)
+                break
+            f.seek(position)
+            while size:
+                piece = patch.read(min(size, _COPY_SIZE))
+                f.write(piece)
+                size -= len(piece)
+    _report_expansion(position - original)
@@ -1,6 +1,7 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
+from contextlib import contextmanager
 from functools import wraps
 from time import time
 import sys
@@ -36,10 +37,28 @@ class _Helper:
 class TimingTracer:
     def __init__(self):
         self._timestamps = []
+        self._stream = None # i.e., whatever sys.stdout currently is.
+
+
+    @contextmanager
+    def redirect(self, stream):
+        """Trace to the given `stream` (None for standard output) within
+        the context."""
+        old, self._stream = self._stream, stream
+        try:
+            yield
+        finally:
+            self._stream = old
+
+
+    @property
+    def _output(self):
+        return sys.stdout if self._stream is None else self._stream
 
 
     def trace(self, message):
-        print('    ' * len(self._timestamps), message, sep='')
+        indent = '    ' * len(self._timestamps)
+        print(indent, message, sep='', file=self._output)
 
 
     def start(self, message):
@@ -51,7 +70,7 @@ class TimingTracer:
     def stop(self, tag):
         elapsed = int((time() - self._timestamps.pop()) * 1000)
         self.trace(f'{tag} ({elapsed} ms)')
-        sys.stdout.flush()
+        self._output.flush()
 
 
     def __call__(self, message):
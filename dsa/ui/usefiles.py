@@ -1,6 +1,7 @@
 # Copyright (C) 2018-2020 Karl Knechtel
 # Licensed under the Open Software License version 3.0
 
+from ..archive import is_archive
 from ..catalog import read_sys_catalog, write_sys_catalog
 from ..errors import MappingError, UserError
 from pathlib import Path
@@ -19,14 +20,17 @@ class NO_SUCH_LIBRARY(MappingError):
     name='dsa-use',
     description='Data Structure Assembler - add library path',
     library_name='symbolic name for library',
-    path='path to use'
+    path='path to use (a library folder or zip archive)'
 )
 def use_files(library_name, path):
     MANDATORY_PATH.require(library_name != 'sys')
     catalog = read_sys_catalog()
     if library_name in catalog:
         print(f'Warning: overwriting existing path `{catalog[library_name]}`.')
-    catalog[library_name] = str(Path(path).resolve())
+    path = Path(path).resolve()
+    if not (path.is_dir() or is_archive(path)):
+        print(f'Warning: `{path}` is not a folder or zip archive.')
+    catalog[library_name] = str(path)
     write_sys_catalog(catalog)
 
 
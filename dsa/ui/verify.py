@@ -0,0 +1,153 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+from .tracing import my_tracer
+from ..parallel import can_fork, ordered_map
+from ..stdio import is_stdio, text_stdout
+from hashlib import sha256
+import toml
+
+
+"""Checking that reassembled chunks match the original binary."""
+
+
+# Problems described in the trace; the rest are only counted.
+_MAX_TRACED = 10
+
+
+# Problems of each kind described in a report file.
+_MAX_REPORTED = 1000
+
+
+# Bytes of data shown for a mismatch, starting at the first difference.
+_EXCERPT_SIZE = 32
+
+
+_BLOCK_SIZE = 64
+
+
+# Chunks and binary data used by worker processes, which inherit this
+# when forked.
+_worker_verification = None
+
+
+def _first_difference(original, chunk):
+    for block in range(0, len(chunk), _BLOCK_SIZE):
+        end = block + _BLOCK_SIZE
+        if original[block:end] == chunk[block:end]:
+            continue
+        for i in range(block, min(end, len(chunk))):
+            if i >= len(original) or original[i] != chunk[i]:
+                return i
+    assert False, 'chunks compare unequal but have no differences'
+
+
+def _mismatch(position, chunk, data):
+    # A description of how the `chunk` differs from the `data` at that
+    # `position`, or None if it matches.
+    original = data[position:position+len(chunk)]
+    if original == chunk:
+        return None
+    offset = _first_difference(original, chunk)
+    excerpt = slice(offset, offset + _EXCERPT_SIZE)
+    return {
+        'location': position,
+        'size': len(chunk),
+        'difference': position + offset,
+        'original_sha256': sha256(original).hexdigest(),
+        'assembled_sha256': sha256(chunk).hexdigest(),
+        'original': original[excerpt].hex(),
+        'assembled': chunk[excerpt].hex()
+    }
+
+
+def _compare(chunks, data, start, end):
+    # Returns (index, mismatch) pairs for chunks that differ.
+    return [
+        (i, mismatch) for i, mismatch in (
+            (i, _mismatch(*chunks[i], data)) for i in range(start, end)
+        )
+        if mismatch is not None
+    ]
+
+
+def _compare_range(bounds):
+    # Runs in a worker process.
+    chunks, data = _worker_verification
+    return _compare(chunks, data, *bounds)
+
+
+def _mismatches(chunks, data, jobs):
+    # A dict of mismatch descriptions, by index into `chunks`.
+    global _worker_verification
+    if jobs is None or jobs < 2 or not can_fork():
+        return dict(_compare(chunks, data, 0, len(chunks)))
+    count = jobs * 4
+    starts = [len(chunks) * i // count for i in range(count + 1)]
+    _worker_verification = (chunks, data)
+    try:
+        return {
+            i: mismatch
+            for results in ordered_map(
+                _compare_range, list(zip(starts, starts[1:])), jobs, fork=True
+            )
+            for i, mismatch in results
+        }
+    finally:
+        _worker_verification = None
+
+
+def _trace_problems(kind, problems, describe):
+    for problem in problems[:_MAX_TRACED]:
+        my_tracer.trace(describe(problem))
+    if len(problems) > _MAX_TRACED:
+        my_tracer.trace(f'(and {len(problems) - _MAX_TRACED} more {kind})')
+
+
+def _write_report(filename, summary, overwrites, mismatches):
+    report = {
+        'summary': summary,
+        'overwrite': overwrites[:_MAX_REPORTED],
+        'mismatch': mismatches[:_MAX_REPORTED]
+    }
+    with text_stdout() if is_stdio(filename) else open(filename, 'w') as f:
+        toml.dump(report, f)
+
+
+def verify_assembly(chunks, data, report=None, jobs=None):
+    """Compare assembled `chunks` (a dict from location to chunk data)
+    to the original binary `data`, and summarize the results.
+    `report` -> optional file name for a detailed report, in TOML format.
+    `jobs` -> if specified, chunks are compared in that many processes."""
+    chunks = sorted(chunks.items())
+    mismatches = _mismatches(chunks, data, jobs)
+    offset = 0
+    overwrites, failures = [], []
+    for i, (position, chunk) in enumerate(chunks):
+        if position < offset:
+            overwrites.append({'location': position, 'previous_end': offset})
+        elif i in mismatches:
+            failures.append(mismatches[i])
+        offset = position + len(chunk)
+    _trace_problems('overwrites', overwrites, lambda o: ' '.join((
+        f'OVERWRITE at 0x{o["location"]:X}:',
+        f'last ended at 0x{o["previous_end"]:X}'
+    )))
+    _trace_problems('mismatches', failures, lambda m: ' '.join((
+        f'MISMATCH at 0x{m["location"]:X}:',
+        f'first difference at 0x{m["difference"]:X}'
+    )))
+    total = len(chunks)
+    ok = total - len(overwrites) - len(failures)
+    my_tracer.trace('')
+    my_tracer.trace(', '.join((
+        f'{ok}/{total} OK',
+        f'{len(overwrites)}/{total} overwrites',
+        f'{len(failures)}/{total} mismatches'
+    )))
+    if report is not None:
+        summary = {
+            'chunks': total, 'ok': ok,
+            'overwrites': len(overwrites), 'mismatches': len(failures)
+        }
+        _write_report(report, summary, overwrites, failures)
@@ -2,7 +2,10 @@
 # Licensed under the Open Software License version 3.0
 
 # System under test.
+from dsa.cache import Cache
 from dsa.catalog import PathSearcher
+from dsa.parsing.file_parsing import open_source
+from dsa.plugins import load_plugins
 # Standard library.
 import shutil
 # Third-party.
@@ -88,3 +91,44 @@ def test_catalog_test2_B(environment):
         # Subdirectories are recursed into.
         test_lib / 'types' / 'B' / 'nested' / 'B.txt'
     )
+
+
+def test_catalog_index_cache(environment):
+    test_lib = environment[0] / 'lib'
+    shutil.copy(test_lib / 'targets2.toml', test_lib / 'targets.toml')
+    cache = Cache('cache', ())
+    search = PathSearcher.create((), ('lib',), 'B', cache)
+    _verify(search, 'types',
+        test_lib / 'types' / 'B' / 'B.txt',
+        test_lib / 'types' / 'B' / 'nested' / 'B.txt'
+    )
+    # The index is reused while the library is unchanged...
+    index = cache.load('index', None)[test_lib]
+    assert index.valid
+    # ...but adding a file anywhere invalidates it.
+    (test_lib / 'types' / 'B' / 'nested' / 'new.txt').touch()
+    assert not index.valid
+    search = PathSearcher.create((), ('lib',), 'B', cache)
+    _verify(search, 'types',
+        test_lib / 'types' / 'B' / 'B.txt',
+        test_lib / 'types' / 'B' / 'nested' / 'B.txt',
+        test_lib / 'types' / 'B' / 'nested' / 'new.txt'
+    )
+    assert cache.load('index', None)[test_lib].valid
+
+
+def test_catalog_archive(environment):
+    test_lib = environment[0] / 'lib'
+    shutil.copy(test_lib / 'targets1.toml', test_lib / 'targets.toml')
+    archive = shutil.make_archive('packed', 'zip', test_lib)
+    search = PathSearcher.create((), (archive,), 'A')
+    found = sorted(search('filters'), key=str)
+    assert [str(p) for p in found] == [
+        f'{archive}/filters/{name}' for name in (
+            'A/outer/inner/use.py', 'A/outer/use.py', 'A/use.py', 'use.py'
+        )
+    ]
+    # Definition files and plugins are read straight from the archive.
+    with open_source(found[-1]) as f:
+        assert 'should find this file' in f.read()
+    assert set(load_plugins(found, {})) == {'use'}
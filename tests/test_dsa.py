@@ -0,0 +1,539 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+# System under test.
+from dsa.ui.apply import apply_patch
+from dsa.ui.convert import convert_listing
+from dsa.ui.dsa import dsa
+from dsa.ui.dsd import dsd, root_data
+from dsa.binary_listing import MAGIC
+from dsa.errors import UserError
+from dsa.parsing.file_parsing import open_source, source_lines
+from dsa import sharding
+from dsa.output import output_file
+from dsa.source_map import SourceMap
+# Third-party.
+import pytest, toml
+# Standard library.
+from functools import partial
+from pathlib import Path
+import os, subprocess, sys
+
+
+def _dsa_wrapper(source, output, **kwargs):
+    sources = [source] if isinstance(source, str) else source
+    dsa(
+        'test.bin', sources, output,
+        target='dsd', libraries=('sys',), paths=('lib',), **kwargs
+    )
+    with open(output, 'rb') as f:
+        return f.read()
+
+
+def _write_listing(name):
+    # Two chunks that refer to each other, including an internal label.
+    with open(name, 'w') as f:
+        f.write('!@first 0x0 example\n')
+        for i in range(16):
+            if i == 2:
+                f.write('@inner\n')
+            f.write(f'DATA @second {i} {i} {i}\n')
+        f.write('!\n!@second 0x80 example\n')
+        for i in range(16):
+            f.write(f'DATA @[first, inner] {i} {i} {i}\n')
+        f.write('!\n')
+
+
+def test_streaming(environment):
+    _write_listing('listing.txt')
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    # The internal label is found after two 8-byte structs.
+    assert normal[0x80:0x84] == (16).to_bytes(4, 'little')
+    assert _dsa_wrapper('listing.txt', 'scanned.bin', stream=True) == normal
+
+
+def test_label_index(environment):
+    dsd(
+        'test.bin', root_data('0:example'), 'listing.txt',
+        target='dsd', libraries=('sys',), paths=('lib',),
+        labels='labels.txt'
+    )
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    assert _dsa_wrapper('listing.txt', 'indexed.bin', labels='labels.txt') \
+        == normal
+    # An index that doesn't match the listing is rejected.
+    _write_listing('other.txt')
+    with pytest.raises(UserError):
+        _dsa_wrapper('other.txt', 'other.bin', labels='labels.txt')
+
+
+def _split_listing(name, first, second):
+    # The two chunks of the listing, in separate files. A chunk left open
+    # at the end of a file ends there.
+    with open(name) as f:
+        text = f.read()
+    split = text.index('!@second')
+    with open(first, 'w') as f:
+        f.write(text[:split].rstrip('!\n') + '\n')
+    with open(second, 'w') as f:
+        f.write(text[split:])
+
+
+@pytest.mark.parametrize('options', ({}, {'stream': True}, {'jobs': 2}))
+def test_multiple_sources(environment, options):
+    _write_listing('listing.txt')
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    _split_listing('listing.txt', 'first.txt', 'second.txt')
+    sources = ['first.txt', 'second.txt']
+    assert _dsa_wrapper(sources, 'split.bin', **options) == normal
+    # Labels must be unique across all the files.
+    with pytest.raises(UserError):
+        _dsa_wrapper(sources + ['first.txt'], 'bad.bin', **options)
+
+
+@pytest.mark.parametrize('extension', ('.gz', '.xz', '.bz2'))
+def test_compressed_listing(environment, extension):
+    for name in ('listing.txt', 'listing.txt' + extension):
+        dsd(
+            'test.bin', root_data('0:example'), name,
+            target='dsd', libraries=('sys',), paths=('lib',)
+        )
+    with open('listing.txt', 'rb') as f:
+        plain = f.read()
+    with open('listing.txt' + extension, 'rb') as f:
+        assert f.read() != plain
+    with open_source('listing.txt' + extension) as f:
+        assert f.read() == plain.decode('utf-8')
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    assert _dsa_wrapper('listing.txt' + extension, 'compressed.bin') == normal
+    assert _dsa_wrapper(
+        'listing.txt' + extension, 'parallel.bin', jobs=2
+    ) == normal
+
+
+def test_binary_listing(environment):
+    for name in ('listing.txt', 'listing.dsb'):
+        dsd(
+            'test.bin', root_data('0:example'), name,
+            target='dsd', libraries=('sys',), paths=('lib',)
+        )
+    with open('listing.dsb', 'rb') as f:
+        assert f.read().startswith(MAGIC)
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    assert _dsa_wrapper('listing.dsb', 'binary.bin') == normal
+    assert _dsa_wrapper('listing.dsb', 'streamed.bin', stream=True) == normal
+    # Conversion works both ways, with the same result.
+    convert_listing('listing.dsb', 'converted.txt.gz')
+    convert_listing('converted.txt.gz', 'converted.dsb')
+    assert _dsa_wrapper('converted.txt.gz', 'converted.bin') == normal
+    with open('listing.dsb', 'rb') as f, open('converted.dsb', 'rb') as g:
+        assert f.read() == g.read()
+
+
+def _write_chunks(name, *locations):
+    with open(name, 'w') as f:
+        for i, location in enumerate(locations):
+            f.write(f'!@c{i} {location:#x} example\n')
+            for j in range(16):
+                f.write(f'DATA {j} {j} {j} {j}\n')
+            f.write('!\n')
+
+
+def test_mapped(environment):
+    # The end of the second chunk extends the binary.
+    _write_chunks('listing.txt', 0x0, 0xC0)
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    assert len(normal) == 0x140
+    assert _dsa_wrapper('listing.txt', 'mapped.bin', mapped=True) == normal
+    # With no separate output, the binary is patched in place.
+    assert _dsa_wrapper('listing.txt', 'test.bin', mapped=True) == normal
+
+
+@pytest.mark.parametrize('mapped', (False, True))
+def test_overlap(environment, mapped):
+    # Chunks may be given in any order, but may not overlap.
+    _write_chunks('good.txt', 0x80, 0x0)
+    _dsa_wrapper('good.txt', 'good.bin', mapped=mapped)
+    _write_chunks('bad.txt', 0x0, 0x100, 0x40)
+    with pytest.raises(UserError) as e:
+        _dsa_wrapper('bad.txt', 'bad.bin', mapped=mapped)
+    assert str(e.value) == 'chunk at 0x40 overlaps the chunk at 0x0'
+    # Nothing is written when patching in place.
+    with pytest.raises(UserError):
+        _dsa_wrapper('bad.txt', 'test.bin', mapped=mapped)
+    with open('test.bin', 'rb') as f:
+        assert f.read() == bytes(range(256))
+
+
+def test_patch(environment):
+    # The first chunk reproduces the original data exactly; the second
+    # extends the binary.
+    dsd(
+        'test.bin', root_data('0:example'), 'listing.txt',
+        target='dsd', libraries=('sys',), paths=('lib',)
+    )
+    _write_chunks('changes.txt', 0x100)
+    with open('listing.txt', 'a') as f, open('changes.txt') as changes:
+        f.write(changes.read())
+    expected = _dsa_wrapper('listing.txt', 'expected.bin')
+    dsa(
+        'test.bin', ['listing.txt'], target='dsd', libraries=('sys',),
+        paths=('lib',), emit_patch='test.patch'
+    )
+    # Only the changed data is stored, with a little overhead.
+    with open('test.patch', 'rb') as f:
+        assert len(f.read()) < 0x80 + 24
+    apply_patch('test.patch', 'test.bin', 'patched.bin')
+    with open('patched.bin', 'rb') as f:
+        assert f.read() == expected
+    # The patch only applies to a binary of the right size.
+    with pytest.raises(UserError):
+        apply_patch('test.patch', 'expected.bin', 'mismatched.bin')
+    assert not os.path.exists('mismatched.bin')
+    # ... and the same contents.
+    with open('other.bin', 'wb') as f:
+        f.write(bytes(256))
+    with pytest.raises(UserError) as e:
+        apply_patch('test.patch', 'other.bin', 'mismatched.bin')
+    assert 'CRC-32' in str(e.value)
+    assert not os.path.exists('mismatched.bin')
+    # A damaged patch is rejected without changing the binary, whether the
+    # end marker or record data is missing.
+    with open('test.patch', 'rb') as f:
+        data = f.read()
+    for cut in (2, 10):
+        with open('truncated.patch', 'wb') as f:
+            f.write(data[:-cut])
+        with pytest.raises(UserError):
+            apply_patch('truncated.patch', 'test.bin')
+        with open('test.bin', 'rb') as f:
+            assert f.read() == bytes(range(256))
+
+
+def _reused(capsys, expected, source='listing.txt'):
+    result = _dsa_wrapper(source, 'output.bin', cache='cache')
+    assert f'Reused {expected} of 2 assembled chunks' in capsys.readouterr().out
+    return result
+
+
+def test_chunk_cache(environment, capsys):
+    _write_listing('listing.txt')
+    original = _reused(capsys, 0)
+    assert _reused(capsys, 2) == original
+    # Chunk data is stored in separate files; a missing one is rebuilt.
+    stored = list(Path('cache').glob('*/*'))
+    assert len(stored) == 2
+    stored[0].unlink()
+    assert _reused(capsys, 1) == original
+    assert len(list(Path('cache').glob('*/*'))) == 2
+    # Only the edited chunk is reassembled.
+    with open('listing.txt') as f:
+        text = f.read()
+    with open('listing.txt', 'w') as f:
+        f.write(text.replace('DATA @second 15 15 15', 'DATA @second 1 1 1'))
+    _reused(capsys, 1)
+    # Moving a chunk only affects the chunks that refer to its label.
+    with open('listing.txt', 'w') as f:
+        f.write(text.replace('!@second 0x80', '!@second 0x100'))
+    moved = _reused(capsys, 1)
+    assert moved[:4] == (0x100).to_bytes(4, 'little')
+    # Data for chunks that are no longer used is removed.
+    assert len(list(Path('cache').glob('*/*'))) == 2
+
+
+def _error(source, **kwargs):
+    with pytest.raises(UserError) as e:
+        _dsa_wrapper(source, 'bad.bin', **kwargs)
+    return str(e.value)
+
+
+def test_parallel_completion(environment):
+    _write_listing('listing.txt')
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    assert _dsa_wrapper('listing.txt', 'parallel.bin', jobs=2) == normal
+    # Errors are the same as for serial assembly: the first in the source.
+    _write_chunks('bad.txt', 0x0, 0x40, 0x0, 0x80)
+    with open('bad.txt') as f:
+        text = f.read()
+    with open('bad.txt', 'a') as f:
+        f.write('!@c4 0xC0 example\nDATA @missing 0 0 0\n!\n')
+    assert _error('bad.txt', jobs=2) == _error('bad.txt') == \
+        'duplicate definition for chunk at 0x0'
+    with open('bad.txt', 'w') as f:
+        f.write(text.replace('DATA 0 0 0 0', 'DATA @missing 0 0 0'))
+    assert _error('bad.txt', jobs=2) == _error('bad.txt') == \
+        "unrecognized label `('@', 'missing')`"
+
+
+def _command(module, name, *args):
+    code = f'from dsa.ui.{module} import {name}; {name}.invoke()'
+    return [sys.executable, '-c', code, *args] + [
+        '-t', 'dsd', '-l', 'sys', '-p', 'lib'
+    ]
+
+
+@pytest.mark.parametrize('options', ([], ['-z', 'gzip'], ['-B']))
+def test_pipeline(environment, options):
+    # dsd | dsa, with the listing passed through a pipe.
+    env = {**os.environ, 'PYTHONPATH': str(environment[2].parent)}
+    with open('test.bin', 'rb') as binary:
+        dsd = subprocess.Popen(
+            _command('dsd', 'dsd', '-', '0:example', '-', *options),
+            stdin=binary, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env
+        )
+        dsa = subprocess.run(
+            _command('dsa', 'dsa', 'test.bin', '-', '-o', '-'),
+            stdin=dsd.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env
+        )
+    listing_trace = dsd.communicate()[1].decode()
+    assert dsd.returncode == 0 and dsa.returncode == 0
+    # Progress is traced to stderr, so the output is just the data.
+    assert 'Disassembling' in listing_trace
+    assert 'Assembling' in dsa.stderr.decode()
+    with open('test.bin', 'rb') as f:
+        assert dsa.stdout == f.read()
+
+
+def _block(location, label, target):
+    # A chunk that refers to the chunk labelled `target`.
+    def lines():
+        yield ('!', ('@', label), (f'0x{location:X}',), ('example',))
+        for i in range(16):
+            yield ('', ('DATA',), ('@', target), (str(i),), ('0',), ('0',))
+        yield ('!',)
+    return location, label, lines, 18
+
+
+@pytest.mark.parametrize('shard_by', sharding.SHARDINGS)
+def test_shards(environment, monkeypatch, shard_by):
+    monkeypatch.setattr(sharding, '_SHARD_RANGE', 0x100)
+    monkeypatch.setattr(sharding, '_SHARD_LINES', 30)
+    blocks = [
+        _block(0x0, 'c', 'd'), _block(0x80, 'c 2', 'c'),
+        _block(0x100, 'd', 'c 3'), _block(0x200, 'c 3', 'c 2')
+    ]
+    output_file('listing.txt', (
+        line for location, label, lines, count in blocks for line in lines()
+    ))
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    sharding.write_shards('shards', blocks, shard_by, 'gzip', jobs=2)
+    with open('shards/manifest.toml') as f:
+        manifest = toml.load(f)
+    shards = manifest['shard']
+    assert len(shards) == {'label': 2, 'range': 3, 'size': 2}[shard_by]
+    assert all(shard['file'].endswith('.txt.gz') for shard in shards)
+    # Either the folder or the manifest itself can be given.
+    assert _dsa_wrapper('shards', 'sharded.bin') == normal
+    assert _dsa_wrapper(
+        'shards/manifest.toml', 'parallel.bin', jobs=2
+    ) == normal
+
+
+def test_dsd_shards(environment):
+    _dsd_shards = partial(
+        dsd, 'test.bin', root_data('0:example'),
+        target='dsd', libraries=('sys',), paths=('lib',)
+    )
+    _dsd_shards('listing.txt')
+    _dsd_shards('shards', shard_by='label', jobs=2)
+    with open('shards/0000-main.txt') as f, open('listing.txt') as g:
+        assert f.read() == g.read()
+    assert _dsa_wrapper('shards', 'sharded.bin') == \
+        _dsa_wrapper('listing.txt', 'normal.bin')
+    with pytest.raises(UserError):
+        _dsd_shards('-', shard_by='size')
+
+
+def _only(source, output, *only, **kwargs):
+    return _dsa_wrapper(source, output, only=only, **kwargs)
+
+
+@pytest.mark.parametrize('options', ({}, {'jobs': 2}, {'stream': True}))
+def test_only(environment, options):
+    _write_chunks('listing.txt', 0x0, 0x80, 0x100)
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')
+    with open('test.bin', 'rb') as f:
+        original = f.read()
+    # Chunks outside the selection are left as they are in the binary.
+    assert _only('listing.txt', 'label.bin', 'c1', **options) == \
+        original[:0x80] + normal[0x80:0x100]
+    assert _only('listing.txt', 'range.bin', '0x100-0x200', **options) == \
+        original + normal[0x100:]
+    # Every chunk still defines its labels.
+    _write_listing('labels.txt')
+    normal = _dsa_wrapper('labels.txt', 'normal.bin')
+    assert _only('labels.txt', 'second.bin', 'second', **options) == \
+        original[:0x80] + normal[0x80:]
+    with pytest.raises(UserError):
+        _only('listing.txt', 'bad.bin', '0x100-0x80', **options)
+
+
+def _write_seek_files(listing):
+    # A source map and label index for a listing from `_write_chunks`, as
+    # `dsd` would write them.
+    with open(listing, 'rb') as f:
+        lines = f.readlines()
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    headers = [i for i, line in enumerate(lines) if line.startswith(b'!@')]
+    labels, blocks = [], []
+    for i, end in zip(headers, headers[1:] + [len(lines)]):
+        label, location, interpreter = lines[i][2:].decode().split()
+        labels.append((label, int(location, 0)))
+        blocks.append(
+            (int(location, 0), 0x80, i + 1, offsets[i], offsets[end])
+        )
+    SourceMap(
+        [label for label, location in labels],
+        list(enumerate(offsets[:-1], 1)), blocks, []
+    ).write('listing.map')
+    with open('labels.txt', 'w') as f:
+        for label, location in labels:
+            f.write(f'@{label} {location:#x}\n')
+
+
+def test_only_seek(environment):
+    _write_chunks('listing.txt', 0x0, 0x80, 0x100)
+    _write_seek_files('listing.txt')
+    expected = _only('listing.txt', 'expected.bin', 'c1', '0x100-0x200')
+    # Unselected blocks are never read, so errors there go unnoticed.
+    with open('listing.txt') as f:
+        text = f.read()
+    with open('listing.txt', 'w') as f:
+        f.write(text.replace('DATA', 'JUNK', 16))
+    seek = partial(
+        _only, 'listing.txt', 'seek.bin', 'c1', '0x100-0x200',
+        labels='labels.txt', source_map='listing.map'
+    )
+    assert seek() == expected
+    # A source map is only used for a selection, with a label index.
+    with pytest.raises(UserError):
+        _dsa_wrapper(
+            'listing.txt', 'bad.bin', labels='labels.txt',
+            source_map='listing.map'
+        )
+    # Errors are reported with line numbers from the whole listing (here,
+    # when the second chunk is closed).
+    with open('listing.txt', 'w') as f:
+        f.write(text.replace('DATA 3 3 3 3', 'DATA @x 3 3 '))
+    with pytest.raises(UserError) as e:
+        seek()
+    assert str(e.value) == \
+        "File `listing.txt`: Line 36: unrecognized label `('@', 'x')`"
+
+
+def _write_table_listing(name, table, before=0):
+    # The example chunk, with `before` structs and then a table of rows,
+    # and a second chunk that points at the first row of the table.
+    with open(name, 'w') as f:
+        f.write('!@main 0x0 example\n')
+        for i in range(before):
+            f.write(f'DATA {i} {i} {i} {i}\n')
+        f.write(f'@table\nDATA:{table}\n!\n!@second 0x80 example\n')
+        for i in range(16):
+            f.write(f'DATA @[main, table] {i} {i} {i}\n')
+        f.write('!\n')
+
+
+def _write_rows(name, rows):
+    with open(name, 'w') as f:
+        f.write('q, p, b, s\n')
+        for row in rows:
+            f.write(', '.join(row) + '\n')
+
+
+def _write_npy(name, rows):
+    # A two-dimensional array of 8-byte integers, as NumPy would save it.
+    header = "{'descr': '<i8', 'fortran_order': False, 'shape': (%d, %d), }" \
+        % (len(rows), len(rows[0]))
+    header = (header + ' ' * (-(len(header) + 11) % 64) + '\n').encode()
+    with open(name, 'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little'))
+        f.write(header)
+        for row in rows:
+            for value in row:
+                f.write(value.to_bytes(8, 'little', signed=True))
+
+
+def test_table(environment, capsys):
+    dsd(
+        'test.bin', root_data('0:example'), 'listing.txt',
+        target='dsd', libraries=('sys',), paths=('lib',),
+        export_columns='columns'
+    )
+    with open('listing.txt') as f:
+        rows = [line.split()[1:] for line in f if line.startswith('DATA')]
+    normal = _dsa_wrapper('listing.txt', 'normal.bin')[:0x80]
+    # Columns exported by `dsd` can be assembled again directly.
+    _write_table_listing('npz.txt', 'columns/00000000.npz')
+    assert _dsa_wrapper('npz.txt', 'npz.bin')[:0x80] == normal
+    _write_rows('rows.csv', rows)
+    _write_table_listing('csv.txt', 'rows.csv')
+    assert _dsa_wrapper('csv.txt', 'csv.bin')[:0x80] == normal
+    # Labels after ordinary structs account for them.
+    _write_rows('rows.csv', rows[3:])
+    _write_table_listing('csv.txt', 'rows.csv', 3)
+    result = _dsa_wrapper('csv.txt', 'csv.bin')
+    assert result[:0x18] == bytes(
+        b for i in range(3) for b in (i, 0, 0, 0, i, 0, i, i)
+    )
+    assert result[0x18:0x80] == normal[0x18:]
+    assert result[0x80:0x84] == (0x18).to_bytes(4, 'little')
+    # Cells can refer to labels, as in the listing.
+    _write_rows('labels.csv', [['@second', '1', '2', '3']] * 8 + [
+        ['@main:table', '1', '2', '3']
+    ] * 8)
+    _write_table_listing('labels.txt', 'labels.csv')
+    assert _dsa_wrapper('labels.txt', 'labels.bin')[:0x80] == \
+        bytes((0x80, 0, 0, 0, 1, 0, 2, 3)) * 8 + \
+        bytes((0, 0, 0, 0, 1, 0, 2, 3)) * 8
+    _write_rows('labels.csv', [['@missing', '1', '2', '3']] * 16)
+    assert _error('labels.txt').endswith(
+        "Column `q`: Row #1: unrecognized label `('@', 'missing')`"
+    )
+    _write_rows('labels.csv', [['@second x', '1', '2', '3']] * 16)
+    assert _error('labels.txt').endswith(
+        'Row #1: `@second x` is not a single label reference'
+    )
+    # Chunks with tables are never taken from the cache.
+    _dsa_wrapper('csv.txt', 'csv.bin', cache='cache')
+    _dsa_wrapper('csv.txt', 'csv.bin', cache='cache')
+    assert 'Reused 1 of 1 assembled chunks' in capsys.readouterr().out
+    # NumPy files give values as numbers; a single array holds every column.
+    _write_npy('rows.npy', [[1, -2, 3, -4]] * 16)
+    _write_table_listing('npy.txt', 'rows.npy')
+    assert _dsa_wrapper('npy.txt', 'npy.bin')[:0x10] == \
+        bytes((1, 0, 0, 0, 254, 255, 3, 252)) * 2
+    # Each error identifies the row, and the number of structs is checked.
+    _write_npy('rows.npy', [[0, 0, 256, 0]] * 16)
+    assert _error('npy.txt').endswith(
+        'Member `b` (of type `Byte`): Row #1: '
+        'value 256 is out of range (must be from 0 to 255)'
+    )
+    _write_rows('rows.csv', rows[:4] + [['0', 'x', '0', '0']] + rows[5:])
+    _write_table_listing('csv.txt', 'rows.csv')
+    assert _error('csv.txt').endswith(
+        'Member `p` (of type `Spair`): Row #5: '
+        'field value must be an integer (got `x`)'
+    )
+    _write_rows('rows.csv', rows[1:])
+    assert _error('csv.txt').endswith(
+        'chunk has 15 structs; exactly 16 required'
+    )
+
+
+def test_compression_detection(environment):
+    # Text that happens to start like a compressed file is still text.
+    with open('text.txt', 'w') as f:
+        f.write('BZh hello\n')
+    with source_lines('text.txt') as lines:
+        assert [tokens for number, prefix, tokens in lines] == \
+            [[['BZh'], ['hello']]]
+    # Corrupt compressed data is reported as an error in the file.
+    with open('listing.txt.bz2', 'wb') as f:
+        f.write(b'BZh91AY&SY' + bytes(100))
+    assert 'couldn\'t decompress `listing.txt.bz2` as bz2' in \
+        _error('listing.txt.bz2')
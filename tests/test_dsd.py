@@ -3,9 +3,15 @@
 
 # System under test.
 from dsa.ui.dsd import dsd, root_data
+from dsa.ui.verify import verify_assembly
+from dsa.source_map import SourceMap
 from dsa.errors import UserError
 # Third-party.
-import pytest
+import pytest, toml
+# Standard library.
+from array import array
+from ast import literal_eval
+import zipfile
 
 
 def _important_lines(filename):
@@ -46,6 +52,33 @@ def test_disassemble_partial(environment):
     _validate(environment[1], 'test_hex_partial')
 
 
+def _disassemble_string(data, encoding):
+    with open('string.bin', 'wb') as f:
+        f.write(data + b'\0')
+    dsd(
+        'string.bin', root_data(f'0:string:{encoding}:basic'), 'string.txt',
+        libraries=('sys',)
+    )
+    return [
+        literal_eval(line) for line in _important_lines('string.txt')
+        if not line.startswith('!')
+    ]
+
+
+@pytest.mark.parametrize('data, encoding, expected', (
+    # Text between tags is decoded in spans, but undecodable bytes are still
+    # shown one at a time.
+    (
+        'tëxt\n[ü]'.encode('utf-8') + b'\xff\xe3\x81x',
+        'utf-8', ['tëxt[NL]', '[Open]ü[Close][0xff][0xe3][0x81]x']
+    ),
+    # A tag byte may be part of a character that started before it.
+    ('aー[b'.encode('shift_jis'), 'shift_jis', ['aー[Open]b'])
+))
+def test_disassemble_string(environment, data, encoding, expected):
+    assert _disassemble_string(data, encoding) == expected
+
+
 def test_use_local(capsys, environment):
     # It uses the local config when and only when requested.
     # Values are little-endian.
@@ -69,3 +102,113 @@ def test_signedness(environment):
     # It properly considers the signedness of types.
     _dsd_wrapper('4:example', 'test_example3.txt', 'lib')
     _validate(environment[1], 'test_example3')
+
+
+def test_verify(environment, capsys):
+    dsd(
+        'test.bin', root_data('0:example'), 'test_example.txt',
+        target='dsd', libraries=('sys',), paths=('lib',), verify=True
+    )
+    assert '1/1 OK, 0/1 overwrites, 0/1 mismatches' in capsys.readouterr().out
+
+
+def test_verify_report(environment, capsys):
+    data = bytes(range(256))
+    chunks = {0: data[:16], 0x10: b'\0' * 16, 0x18: data[0x18:0x20]}
+    chunks.update({i: b'\0' * 2 for i in range(0x40, 0x80, 2)})
+    verify_assembly(chunks, data, 'report.toml', jobs=2)
+    output = capsys.readouterr().out
+    assert '1/35 OK, 1/35 overwrites, 33/35 mismatches' in output
+    # Only the first few problems are traced.
+    assert 'MISMATCH at 0x10: first difference at 0x10' in output
+    assert '(and 23 more mismatches)' in output
+    report = toml.load('report.toml')
+    assert report['summary']['mismatches'] == 33
+    assert report['overwrite'] == [{'location': 0x18, 'previous_end': 0x20}]
+    first = report['mismatch'][0]
+    assert first['original'] == data[0x10:0x20].hex()
+    assert first['assembled'] == '00' * 16
+
+
+def test_source_map(environment):
+    def _dsd_mapped(output, **kwargs):
+        dsd(
+            'test.bin', root_data('0:example'), output, target='dsd',
+            libraries=('sys',), paths=('lib',), source_map='test.map',
+            **kwargs
+        )
+    _dsd_mapped('test_example.txt')
+    source_map = SourceMap.load('test.map')
+    with open('test_example.txt', 'rb') as f:
+        listing = f.read()
+    # The chunk header is line 1; each 8-byte struct follows on one line.
+    assert len(source_map) == 1 and source_map.labels == ['main']
+    assert source_map.block(0) == (0, 0x80, 1, 0, len(listing))
+    assert source_map.line_for(0x13) == 4
+    assert source_map.line_for(0x80) is None
+    start = source_map.offset_for(4)
+    assert listing[start:].startswith(b'DATA 0x13121110 ')
+    assert source_map.read_block('test_example.txt', 0) == listing.decode()
+    assert source_map.blocks_between(0x7F, 0x100) == [0]
+    assert source_map.blocks_between(0x80, 0x100) == []
+    # Offsets are only meaningful in a single, uncompressed text file.
+    for output, options in (
+        ('test.txt.gz', {}), ('test.dsb', {}), ('shards', {'shard_by': 'size'})
+    ):
+        with pytest.raises(UserError):
+            _dsd_mapped(output, **options)
+
+
+def _read_npz(filename):
+    # The arrays in a `.npz` file, as (type description, values).
+    result = {}
+    with zipfile.ZipFile(filename) as f:
+        for name in f.namelist():
+            data = f.read(name)
+            assert data[:8] == b'\x93NUMPY\x01\x00'
+            size = int.from_bytes(data[8:10], 'little')
+            header = literal_eval(data[10:10+size].decode('latin-1'))
+            assert (10 + size) % 64 == 0
+            code = {'|u1': 'B', '|i1': 'b', '<i2': 'h', '<u4': 'I'}
+            values = array(code[header['descr']], data[10+size:])
+            assert header['shape'] == (len(values),)
+            result[name[:-4]] = header['descr'], values.tolist()
+    return result
+
+
+def test_export_columns(environment):
+    dsd(
+        'test.bin', root_data('0:example'), 'test_example.txt',
+        target='dsd', libraries=('sys',), paths=('lib',),
+        export_columns='example'
+    )
+    with open('example/columns.toml') as f:
+        [chunk] = toml.load(f)['chunk']
+    assert chunk == {
+        'file': '00000000.npz', 'label': 'main', 'location': 0,
+        'struct': 'DATA', 'count': 16
+    }
+    # Each 8-byte struct has a 4-byte, 2-byte signed, 1-byte and 1-byte
+    # signed member, in that order.
+    columns = _read_npz('example/00000000.npz')
+    starts = range(0, 128, 8)
+    assert columns == {
+        'q': ('<u4', [int.from_bytes(bytes(range(i, i+4)), 'little')
+            for i in starts]),
+        'p': ('<i2', [int.from_bytes(bytes(range(i+4, i+6)), 'little')
+            for i in starts]),
+        'b': ('|u1', [i+6 for i in starts]),
+        's': ('|i1', [i+7 if i+7 < 128 else i+7-256 for i in starts])
+    }
+    # Values described by an enum are labelled.
+    dsd(
+        'test.bin', root_data('0:hex'), 'test_hex.txt',
+        libraries=('sys',), export_columns='hex'
+    )
+    with open('hex/columns.toml') as f:
+        [chunk] = toml.load(f)['chunk']
+    assert chunk['labels']['bf'] == {
+        str(i+15): f'{i+15:02X}' for i in range(0, 256, 16)
+    }
+    assert _read_npz('hex/00000000.npz')['b1'] == \
+        ('|u1', list(range(1, 256, 16)))
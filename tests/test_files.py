@@ -2,10 +2,17 @@
 # Licensed under the Open Software License version 3.0
 
 # System under test.
+from dsa.binary_listing import BinaryListing, encode
+from dsa.compression import detect_compression
 from dsa.errors import UserError
-from dsa.parsing.file_parsing import process, load_lines
+from dsa.interning import LineStore, TokenTable
+from dsa.output import BAD_TOKEN_PART, as_output, output_file, read_back
+from dsa.parsing.file_parsing import process, load_files, load_lines
 # Third-party.
 import pytest
+# Standard library.
+from itertools import accumulate
+import gzip, io
 
 good = (
     # Examples from the documentation.
@@ -66,3 +73,155 @@ def test_process_bad(i):
     # subsequent lines.
     with pytest.raises(UserError):
         next(process(i))
+
+
+class _RecordingLoader:
+    def __init__(self):
+        self._lines = []
+
+
+    def line(self, indent, tokens):
+        self._lines.append((indent, tokens))
+
+
+    def result(self):
+        return self._lines
+
+
+def _load_results(filenames, jobs):
+    try:
+        return load_files(filenames, _RecordingLoader, jobs=jobs)
+    except UserError as e:
+        return str(e)
+
+
+def test_parallel_loading(tmp_path):
+    filenames = []
+    for i, lines in enumerate(good + (bad_lines,)):
+        filename = tmp_path / f'{i}.txt'
+        filename.write_text('\n'.join(lines))
+        filenames.append(filename)
+    # Files are loaded in order, with the same results either way.
+    count = len(good)
+    serial = _load_results(filenames[:count], None)
+    assert serial == _load_results(filenames[:count], 2)
+    assert len(serial) == sum(len(e) for e in expected)
+    # Errors are reported the same way.
+    serial = _load_results(filenames, None)
+    assert isinstance(serial, str)
+    assert serial == _load_results(filenames, 2)
+
+
+_output_lines = (
+    ('!', ('@', 'main 2'), ('0x0',), ('string', 'ascii', 'basic')),
+    ('', ("'a [quoted] string'",), ('',), ()),
+    ('    ', ('DATA',), ('@', 'main 2', 'inner'), *(
+        (f'{i:02X}',) for i in range(30)
+    ), ('# 0x10',)),
+    ('!', ('# 0x20',)),
+    ('',)
+)
+
+
+def test_output_file(tmp_path):
+    filename = tmp_path / 'output.txt'
+    positions = []
+    output_file(filename, _output_lines, positions=positions)
+    text = filename.read_text().splitlines()
+    # Positions account for the line wrapping.
+    offsets = [0, *accumulate(len(line) + 1 for line in text)]
+    assert positions == [(n, offsets[n-1]) for n in (1, 2, 3, 5, 6, 7)]
+    # Long lines are wrapped at 78 columns, using continuation lines.
+    assert text[2] == ' '.join((
+        '    DATA @[main 2, inner]', *(f'{i:02X}' for i in range(17))
+    ))
+    assert text[3] == '+   11 12 13 14 15 16 17 18 19 1A 1B 1C 1D # 0x10'
+    # The same lines are read back as when bypassing the text. (Line numbers
+    # differ, since the original lines don't account for wrapping.)
+    with open(filename) as f:
+        written = [(prefix[:1], tokens) for _, prefix, tokens in process(f)]
+    assert written == [
+        (prefix, tokens) for _, prefix, tokens in read_back(_output_lines)
+    ]
+
+
+def test_read_back_errors(tmp_path):
+    # Nothing after a comment is read, from the text or otherwise.
+    lines = [('', ('DATA',), ('#c',), ('d',)), ('!',)]
+    filename = tmp_path / 'comment.txt'
+    output_file(filename, lines)
+    with open(filename) as f:
+        written = [(prefix[:1], tokens) for _, prefix, tokens in process(f)]
+    assert written == [
+        (prefix, tokens) for _, prefix, tokens in read_back(lines)
+    ] == [('', [['DATA']]), ('!', [])]
+    # Tokens that can't be written can't be read back either.
+    for token in (("'a'", 'b'), ('a', 'b#')):
+        with pytest.raises(BAD_TOKEN_PART):
+            output_file(tmp_path / 'bad.txt', [('', token)])
+        with pytest.raises(BAD_TOKEN_PART):
+            list(read_back([('', token)]))
+
+
+@pytest.mark.parametrize('lines', expected)
+def test_binary_listing(tmp_path, lines):
+    data = encode(lines)
+    assert list(BinaryListing(data).lines()) == list(lines)
+    # A truncated listing is detected.
+    with pytest.raises(UserError):
+        list(BinaryListing(data[:-1]).lines())
+    # The same tokens are read from the equivalent text.
+    filename = tmp_path / 'output.txt'
+    output_file(filename, as_output(lines), compact=True)
+    with open(filename) as f:
+        assert [line[1:] for line in process(f)] == \
+            [line[1:] for line in lines]
+
+
+def test_binary_listing_blocks():
+    # Blocks end after each terminator line, and can be decoded separately.
+    lines = list(read_back(_output_lines * 2))
+    listing = BinaryListing(encode(lines))
+    assert len(listing) == 2
+    assert list(listing.lines(1)) == lines[len(lines) // 2:]
+
+
+def test_line_store():
+    # Lines read back the same, but each distinct token is stored once.
+    table = TokenTable()
+    first = LineStore(table, _output_lines)
+    second = LineStore(table, [('', ['DATA'], ('@', 'x')), ('',)])
+    assert list(first) == list(_output_lines)
+    assert list(second) == [('', ('DATA',), ('@', 'x')), ('',)]
+    assert len(table) == len(set(
+        item for line in list(first) + list(second) for item in line
+    ))
+
+
+class _Trickle(io.RawIOBase):
+    # Supplies one byte per read, like a slow pipe.
+    def __init__(self, data):
+        super().__init__()
+        self._data = data
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        if not self._data:
+            return 0
+        buffer[0], self._data = self._data[0], self._data[1:]
+        return 1
+
+
+@pytest.mark.parametrize('data, expected', (
+    (gzip.compress(b'text'), 'gzip'), (b'BZh text', None), (b'', None)
+))
+def test_detect_compression(data, expected):
+    # Detection doesn't depend on getting the first bytes in a single read,
+    # and the same data is read afterward.
+    name, stream = detect_compression(_Trickle(data))
+    assert name == expected
+    assert stream.read() == data
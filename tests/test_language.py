@@ -2,7 +2,7 @@
 # Licensed under the Open Software License version 3.0
 
 # System under test.
-import dsa.language
+import dsa.errors, dsa.language, dsa.parsing.source_loader
 # Third-party.
 import pytest
 
@@ -14,9 +14,9 @@ def _dummy_search(kind):
     return ()
 
 
-def _dummy_setup(x, y, z):
+def _dummy_setup(x, y, z, cache):
     # The arguments were forwarded.
-    assert (x, y, z) == (1, 2, 3)
+    assert (x, y, z, cache) == (1, 2, 3, None)
     _dummy_search.called_with = set()
     return _dummy_search
 
@@ -29,3 +29,68 @@ def test_uses_catalog(environment, monkeypatch):
         'codec_code', 'codec_data', 'filters',
         'interpreters', 'structgroups', 'types'
     }
+
+
+def _load_cached(capsys):
+    language = dsa.language.Language.create(('sys',), ('lib',), 'dsd', 'cache')
+    # Structgroups are loaded on demand.
+    assert 'Using cached' not in capsys.readouterr().out
+    language._interpreters['example']
+    return 'Using cached structgroups' in capsys.readouterr().out
+
+
+def test_cache(environment, capsys):
+    # The first run populates the cache, and the next one uses it.
+    assert not _load_cached(capsys)
+    assert _load_cached(capsys)
+    # Any change to a definition file invalidates the cached data.
+    with open('lib/structgroups/dsd/example.txt', 'a') as f:
+        f.write('\n# modified\n')
+    assert not _load_cached(capsys)
+    assert _load_cached(capsys)
+
+
+def test_lazy(environment, capsys):
+    language = dsa.language.Language.create(('sys',), ('lib',), 'dsd')
+    assert 'Loading:' not in capsys.readouterr().out
+    # All the names are known without loading anything.
+    assert {'example', 'hex', 'file', 'string'} <= set(language._interpreters)
+    language._interpreters['hex']
+    loaded = capsys.readouterr().out
+    assert 'hex.txt' in loaded and 'example.txt' not in loaded
+
+
+def _write_listing(name, chunks, extra=''):
+    with open(name, 'w') as f:
+        for i in range(chunks):
+            f.write(f'!@c{i} {i*128:#x} example\n')
+            for j in range(16):
+                # Labels from other chunks are resolved after merging.
+                f.write(f'DATA @c{(i+1)%chunks} {j} {j} {-j}\n')
+            f.write('!\n\n')
+        f.write(extra)
+
+
+def _assemble(name, jobs):
+    language = dsa.language.Language.create(
+        ('sys',), ('lib',), 'dsd', jobs=jobs
+    )
+    try:
+        return language.assemble([name])
+    except dsa.errors.UserError as e:
+        return str(e)
+
+
+def test_parallel_assembly(environment, monkeypatch):
+    monkeypatch.setattr(dsa.parsing.source_loader, '_MIN_RANGE_SIZE', 256)
+    _write_listing('good.txt', 40)
+    serial = _assemble('good.txt', None)
+    assert len(serial) == 40
+    assert _assemble('good.txt', 2) == serial
+    # A single file name can be given directly.
+    language = dsa.language.Language.create(('sys',), ('lib',), 'dsd')
+    assert language.assemble('good.txt') == serial
+    # Errors are reported the same way, with the correct line number.
+    _write_listing('bad.txt', 40, '!@bad 0x0 example\n@inner extra\n')
+    assert 'Line 762' in _assemble('bad.txt', None)
+    assert _assemble('bad.txt', 2) == _assemble('bad.txt', None)
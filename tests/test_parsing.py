@@ -0,0 +1,67 @@
+# Copyright (C) 2018-2020 Karl Knechtel
+# Licensed under the Open Software License version 3.0
+
+# System under test.
+from dsa.errors import UserError
+from dsa.parsing.line_parsing import argument_parser, line_parser
+from dsa.parsing.token_parsing import make_parser, single_parser
+# Third-party.
+import pytest
+
+
+_parser = make_parser(
+    'example',
+    ('string', 'name'), ('integer?', 'size'), ('[string', 'extra')
+)
+
+
+@pytest.mark.parametrize('token,result', (
+    (['a'], ('a', None, ())),
+    (['a', ''], ('a', None, ())),
+    (['a', '0x10'], ('a', 16, ())),
+    (['a', '1', 'b', 'c'], ('a', 1, ('b', 'c')))
+))
+def test_make_parser(token, result):
+    assert _parser(token) == result
+
+
+@pytest.mark.parametrize('token,message', (
+    ([], 'example token must have at least 1 parts (has 0)'),
+    (['a', 'b'], 'size must be an integer (got `b`)')
+))
+def test_make_parser_errors(token, message):
+    with pytest.raises(UserError) as e:
+        _parser(token)
+    assert str(e.value) == message
+
+
+def test_single_parser():
+    choice = single_parser('choice', {'x': 1, None: 2})
+    assert choice(['x']) == 1
+    assert choice([]) == 2
+    with pytest.raises(UserError):
+        choice(['y'])
+    with pytest.raises(UserError) as e:
+        single_parser('codec', 'encoding')(['bogus'])
+    assert str(e.value) == 'codec `bogus` is not a valid string encoding'
+
+
+def test_line_parser():
+    name = single_parser('name', 'string')
+    alias = single_parser('alias', 'string?')
+    parser = line_parser('example', name, alias, required=1, more=True)
+    assert parser([['a']]) == ('a', None, [])
+    assert parser([['a'], ['b'], ['c']]) == ('a', 'b', [['c']])
+    with pytest.raises(UserError) as e:
+        line_parser('example', name, extracted=1)([['a'], ['b']])
+    assert str(e.value) == '`example` line should have 1-2 tokens (has 3)'
+
+
+def test_argument_parser():
+    parser = argument_parser(size='integer', names='[string')
+    assert parser([['size', '3'], ['names', 'a', 'b']]) == {
+        'size': 3, 'names': ('a', 'b')
+    }
+    with pytest.raises(UserError) as e:
+        parser([['size', '1'], ['size', '2']])
+    assert str(e.value) == 'duplicate specification of parameter `size`'